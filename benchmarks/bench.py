@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Ulwazi benchmarks
+Times every command path against a synthetic database (see generate.py),
+writes the results as JSON and compares them with a stored baseline.
+Commands run in-process through the click group, the same way the shell
+runs them, on a scratch copy of the database so writes never accumulate.
+
+    python benchmarks/bench.py --scale medium --save-baseline
+    python benchmarks/bench.py --scale medium            # compare with it
+"""
+
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+from pathlib import Path
+
+import click
+
+from generate import SCALES, database_path, generate_database, standard_codes
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT = BENCH_DIR.parent
+RESULTS_DIR = BENCH_DIR / 'results'
+sys.path.insert(0, str(ROOT))
+
+import ulwazi  # noqa: E402
+
+# Read paths, run against the first synthetic standard
+READ_CASES = [
+    ('show', ['show']),
+    ('show --desc', ['show', '--desc']),
+    ('show --format csv', ['show', '--format', 'csv']),
+    ('coverage module', ['coverage', '-m', '1']),
+    ('coverage day', ['coverage', '-m', '1', '-d', '1', '--notes']),
+    ('coverage session', ['coverage', '-m', '1', '-d', '1', '-s', '1', '--notes']),
+    ('coverage discover', ['coverage', '--discover']),
+    ('coverage handbook', ['coverage', '--all-modules', '--format', 'csv']),
+    ('coverage hours', ['coverage', '--hours']),
+    ('ksb view', ['ksb', 'K1']),
+    ('gaps', ['gaps']),
+    ('search', ['search', 'data', 'quality']),
+    ('progress', ['progress']),
+]
+
+# Read again without clearing the query cache in between
+CACHED_CASES = [
+    ('show (cached)', ['show']),
+    ('coverage module (cached)', ['coverage', '-m', '1']),
+]
+
+# Read from a fresh 'ulwazi snapshot' instead of SQLite
+SNAPSHOT_CASES = [
+    ('show (snapshot)', ['show']),
+    ('coverage module (snapshot)', ['coverage', '-m', '1']),
+    ('coverage day (snapshot)', ['coverage', '-m', '1', '-d', '1']),
+]
+
+# Changes smaller than this are timer noise, whatever the percentage
+MIN_CHANGE_MS = 0.5
+
+# KSBs per bulk import; each is mapped to modules and sessions by the manifest
+BULK_KSBS = 1000
+
+
+def invoke(args):
+    """Run one ulwazi command with its output discarded"""
+    with open(os.devnull, 'w') as null, redirect_stdout(null):
+        try:
+            ulwazi.cli.main(args, prog_name='ulwazi', standalone_mode=False)
+        except SystemExit as e:
+            if e.code:
+                raise click.ClickException(f"'ulwazi {' '.join(args)}' exited with {e.code}")
+
+
+def timed(args, before=None):
+    if before:
+        before()
+    start = time.perf_counter()
+    invoke(args)
+    return time.perf_counter() - start
+
+
+def summary(seconds):
+    return {
+        'runs': len(seconds),
+        'min_ms': round(min(seconds) * 1000, 3),
+        'median_ms': round(statistics.median(seconds) * 1000, 3),
+        'max_ms': round(max(seconds) * 1000, 3),
+    }
+
+
+def write_bulk_files(directory):
+    """A KSB file and a mapping manifest for BULK_KSBS new KSBs"""
+    codes = [f'K{n}' for n in range(1, BULK_KSBS + 1)]
+    ksb_file = directory / 'bulk.txt'
+    ksb_file.write_text(''.join(f'{code}: Synthetic knowledge item {code}\n' for code in codes))
+
+    lines = []
+    for module in range(1, 8):
+        in_module = codes[module - 1::7]
+        lines.append(f"M{module}: {' '.join(in_module)}")
+        for day in range(1, 6):
+            lines.append(f"M{module}/D{day}/S1: {' '.join(in_module[day - 1::5])}")
+    manifest = directory / 'bulk-map.txt'
+    manifest.write_text('\n'.join(lines) + '\n')
+    return ksb_file, manifest
+
+
+def run_cases(runs, work):
+    """Time every case; returns {name: summary}"""
+    standard = standard_codes(1)[0]
+    clear_cache = lambda: ulwazi.get_store().cache.clear()
+    results = {}
+
+    for name, args in READ_CASES:
+        args = args + ['--course', standard]
+        invoke(args)  # warm the page cache and statement cache
+        results[name] = summary([timed(args, clear_cache) for _ in range(runs)])
+
+    for name, args in CACHED_CASES:
+        args = args + ['--course', standard]
+        invoke(args)
+        results[name] = summary([timed(args) for _ in range(runs)])
+
+    invoke(['snapshot', '--course', standard])
+    for name, args in SNAPSHOT_CASES:
+        args = args + ['--course', standard]
+        invoke(args)
+        results[name] = summary([timed(args) for _ in range(runs)])
+
+    ksb_file, manifest = write_bulk_files(work)
+    imports, maps = [], []
+    for run in range(runs):
+        course = f'BN{run:03d}'
+        invoke(['standard', course, '--add', 'Bulk import'])
+        imports.append(timed(['import', str(ksb_file), '--course', course]))
+        maps.append(timed(['map', '--from-file', str(manifest), '--course', course]))
+    results[f'import {BULK_KSBS} KSBs'] = summary(imports)
+    results[f'map --from-file {BULK_KSBS} KSBs'] = summary(maps)
+
+    return results
+
+
+def table_counts(path):
+    conn = sqlite3.connect(path)
+    counts = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+              for table in ('ksbs', 'module_ksbs', 'session_ksbs', 'learners', 'evidence')}
+    counts['standards'] = conn.execute('SELECT COUNT(DISTINCT standard) FROM ksbs').fetchone()[0]
+    conn.close()
+    return counts
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Print median changes against the baseline; returns the names that regressed"""
+    regressions = []
+    click.echo(f"\n{'Case':<32} {'Baseline':>10} {'Now':>10} {'Change':>8}")
+    for name, result in results['cases'].items():
+        before = baseline['cases'].get(name)
+        now = result['median_ms']
+        if not before:
+            click.echo(f"{name:<32} {'-':>10} {now:>8.2f}ms {'new':>8}")
+            continue
+        change = (now - before['median_ms']) / before['median_ms'] if before['median_ms'] else 0
+        flag = ''
+        if change > threshold and now - before['median_ms'] > MIN_CHANGE_MS:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        click.echo(f"{name:<32} {before['median_ms']:>8.2f}ms {now:>8.2f}ms {change:>+8.0%}{flag}")
+    return regressions
+
+
+@click.command()
+@click.option('--scale', type=click.Choice(list(SCALES)), default='small', help='Synthetic database size')
+@click.option('-n', '--runs', default=20, help='Timed runs per case')
+@click.option('--regenerate', is_flag=True, help='Rebuild the synthetic database first')
+@click.option('--baseline', 'baseline_path', type=click.Path(dir_okay=False),
+              help='Baseline to compare with (Default: benchmarks/baseline-<scale>.json)')
+@click.option('--save-baseline', is_flag=True, help='Store these results as the baseline')
+@click.option('--threshold', default=0.25, help='Median slowdown that counts as a regression')
+@click.option('--strict', is_flag=True, help='Exit with status 1 on any regression')
+def bench(scale, runs, regenerate, baseline_path, save_baseline, threshold, strict):
+    """Time ulwazi commands against a synthetic database"""
+    source = database_path(scale)
+    if regenerate or not source.exists():
+        click.echo(f"Generating {scale} database...")
+        generate_database(source, **SCALES[scale])
+
+    with tempfile.TemporaryDirectory(prefix='ulwazi-bench-') as tmp:
+        work = Path(tmp)
+        db_copy = work / 'ulwazi.db'
+        shutil.copyfile(source, db_copy)
+
+        ulwazi.DB_FILE = db_copy
+        ulwazi.CONFIG_DIR = work / 'config'
+        ulwazi.CONFIG_FILE = ulwazi.CONFIG_DIR / 'config.json'
+
+        counts = table_counts(db_copy)
+        click.echo(f"{scale}: {counts['standards']} standards, {counts['ksbs']} KSBs, "
+                   f"{counts['session_ksbs']} session mappings; {runs} runs per case")
+
+        try:
+            cases = run_cases(runs, work)
+        finally:
+            if ulwazi.store_state['store'] is not None:
+                ulwazi.store_state['store'].close()
+                ulwazi.store_state['store'] = None
+
+    results = {
+        'scale': scale,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'data': counts,
+        'cases': cases,
+    }
+
+    RESULTS_DIR.mkdir(exist_ok=True)
+    output = RESULTS_DIR / f"{scale}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.write_text(json.dumps(results, indent=2) + '\n')
+
+    for name, result in cases.items():
+        click.echo(f"  {name:<32} median {result['median_ms']:>9.2f}ms  min {result['min_ms']:>9.2f}ms")
+    click.echo(f"Results: {output}")
+
+    baseline_path = Path(baseline_path) if baseline_path else BENCH_DIR / f'baseline-{scale}.json'
+    if save_baseline:
+        shutil.copyfile(output, baseline_path)
+        click.echo(f"Baseline saved: {baseline_path}")
+        return
+
+    if not baseline_path.exists():
+        click.echo(f"No baseline at {baseline_path} (use --save-baseline to create one)")
+        return
+
+    regressions = compare(results, json.loads(baseline_path.read_text()), threshold)
+    if regressions:
+        click.echo(f"\n{len(regressions)} case(s) slower than the baseline by more than {threshold:.0%}")
+        if strict:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    bench()
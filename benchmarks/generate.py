@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Synthetic curricula for the benchmarks
+Builds a database with the schema from setup_db.py and fills it with
+made-up standards, KSBs, module mappings and session mappings, plus
+cohorts of learners with portfolio evidence on the first standard. Rows go
+in through the normal triggers, so the coverage matrix, search index and
+write generation are populated exactly as the CLI would leave them.
+Descriptions reuse the vocabulary of the real ksb-*.txt files.
+
+    python benchmarks/generate.py --scale large
+"""
+
+import random
+import re
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+import click
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from setup_db import add_timetable, migrate  # noqa: E402
+
+DATA_DIR = Path(__file__).resolve().parent / 'data'
+
+# standards x KSBs per standard; sessions per module mapping (of 5 days x 4 sessions);
+# learners on the first standard
+SCALES = {
+    'small':  {'standards': 10,  'ksbs': 100, 'sessions': 8,  'learners': 500},
+    'medium': {'standards': 100, 'ksbs': 100, 'sessions': 12, 'learners': 2000},
+    'large':  {'standards': 300, 'ksbs': 100, 'sessions': 17, 'learners': 5000},
+}
+
+MODULES = 7
+DAYS = 5
+SESSIONS = 4
+
+LEARNERS_PER_COHORT = 250
+
+# Share of each standard's KSBs per category
+CATEGORY_SHARES = [('K', 'Knowledge', 0.4), ('S', 'Skill', 0.4), ('B', 'Behaviour', 0.2)]
+
+
+def vocabulary():
+    """Words from the real KSB descriptions"""
+    words = []
+    for path in sorted(ROOT.glob('ksb-*.txt')):
+        words += re.findall(r'[a-z][a-z-]+', path.read_text(encoding='utf-8').lower())
+    return words or ['data', 'quality', 'pipeline', 'stakeholder', 'model']
+
+
+def database_path(scale):
+    return DATA_DIR / f'{scale}.db'
+
+
+def standard_codes(count):
+    return [f'ST{n:03d}' for n in range(1, count + 1)]
+
+
+def generate_rows(standards, ksbs, sessions, seed=1):
+    """(ksb_rows, module_rows, session_rows) for the given sizes, reproducible from seed"""
+    rng = random.Random(seed)
+    words = vocabulary()
+    slots = [(day, session) for day in range(1, DAYS + 1) for session in range(1, SESSIONS + 1)]
+
+    ksb_rows, module_rows, session_rows = [], [], []
+    for standard in standard_codes(standards):
+        for prefix, category, share in CATEGORY_SHARES:
+            for number in range(1, max(1, round(ksbs * share)) + 1):
+                code = f'{prefix}{number}'
+                description = ' '.join(rng.choices(words, k=rng.randint(12, 30))).capitalize() + '.'
+                ksb_rows.append((standard, code, category, description))
+
+                if rng.random() < 0.2:
+                    module_rows.append((standard, code, 'Discover', None))
+                for module in rng.sample(range(1, MODULES + 1), rng.randint(1, 3)):
+                    module_rows.append((standard, code, 'Module', module))
+                    for day, session in rng.sample(slots, min(sessions, len(slots))):
+                        notes = ' '.join(rng.choices(words, k=8)) if rng.random() < 0.1 else ''
+                        session_rows.append((standard, code, module, day, session, notes))
+
+    return ksb_rows, module_rows, session_rows
+
+
+def generate_learners(codes, learners, seed=1):
+    """(cohort_rows, learner_rows, evidence_rows) for learners on the first standard
+
+    Each learner has evidenced 60-100% of the KSBs, with one or two pieces each.
+    """
+    rng = random.Random(seed)
+    standard = standard_codes(1)[0]
+    cohorts = [f'{standard}-C{n:02d}' for n in range(1, -(-learners // LEARNERS_PER_COHORT) + 1)]
+    cohort_rows = [(cohort, standard, f'Synthetic cohort {cohort}') for cohort in cohorts]
+
+    learner_rows, evidence_rows = [], []
+    for n in range(learners):
+        learner = f'L{n + 1:05d}'
+        learner_rows.append((learner, f'Learner {n + 1}', cohorts[n // LEARNERS_PER_COHORT]))
+        for code in rng.sample(codes, round(len(codes) * rng.uniform(0.6, 1.0))):
+            for piece in range(1, rng.randint(1, 2) + 1):
+                day = rng.randint(1, 28)
+                evidence_rows.append((learner, standard, code, f'portfolio-{piece}', f'2026-03-{day:02d}'))
+
+    return cohort_rows, learner_rows, evidence_rows
+
+
+def generate_database(path, standards, ksbs, sessions, learners=0, seed=1):
+    """Create a fresh synthetic database at path; returns row counts"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    for stale in (path, Path(f'{path}-wal'), Path(f'{path}-shm')):
+        stale.unlink(missing_ok=True)
+
+    ksb_rows, module_rows, session_rows = generate_rows(standards, ksbs, sessions, seed)
+    first = standard_codes(1)[0]
+    cohort_rows, learner_rows, evidence_rows = generate_learners(
+        [code for standard, code, _, _ in ksb_rows if standard == first], learners, seed)
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = OFF")
+    migrate(conn)
+
+    with conn:
+        for standard in standard_codes(standards):
+            conn.execute('''
+                INSERT INTO standards (code, title) VALUES (?, ?)
+            ''', (standard, f'Synthetic standard {standard}'))
+            add_timetable(conn, standard, MODULES, DAYS, SESSIONS)
+        conn.executemany('''
+            INSERT INTO ksbs (standard, code, category, description)
+            VALUES (?, ?, ?, ?)
+        ''', ksb_rows)
+        conn.executemany('''
+            INSERT INTO module_ksbs (standard, ksb_code, phase, module_number)
+            VALUES (?, ?, ?, ?)
+        ''', module_rows)
+        conn.executemany('''
+            INSERT INTO session_ksbs
+                (standard, ksb_code, module_number, day_number, session_number, notes)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', session_rows)
+        conn.executemany('''
+            INSERT INTO cohorts (code, standard, title) VALUES (?, ?, ?)
+        ''', cohort_rows)
+        conn.executemany('''
+            INSERT INTO learners (id, name, cohort) VALUES (?, ?, ?)
+        ''', learner_rows)
+        conn.executemany('''
+            INSERT INTO evidence (learner, standard, ksb_code, reference, evidenced_on)
+            VALUES (?, ?, ?, ?, ?)
+        ''', evidence_rows)
+
+    conn.execute('ANALYZE')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.close()
+
+    return {'standards': standards, 'ksbs': len(ksb_rows),
+            'module_ksbs': len(module_rows), 'session_ksbs': len(session_rows),
+            'learners': len(learner_rows), 'evidence': len(evidence_rows)}
+
+
+@click.command()
+@click.option('--scale', type=click.Choice(list(SCALES)), default='small', help='Preset size')
+@click.option('--standards', type=int, help='Override the number of standards')
+@click.option('--ksbs', type=int, help='Override KSBs per standard')
+@click.option('--sessions', type=int, help='Override sessions per module mapping (max 20)')
+@click.option('--learners', type=int, help='Override learners on the first standard')
+@click.option('--seed', default=1, help='Random seed')
+@click.option('-o', '--output', type=click.Path(dir_okay=False), help='Database file to write')
+def generate(scale, standards, ksbs, sessions, learners, seed, output):
+    """Generate a synthetic KSB database for benchmarking"""
+    size = dict(SCALES[scale])
+    for name, value in (('standards', standards), ('ksbs', ksbs), ('sessions', sessions),
+                        ('learners', learners)):
+        if value is not None:
+            size[name] = value
+
+    path = Path(output) if output else database_path(scale)
+    start = time.perf_counter()
+    counts = generate_database(path, seed=seed, **size)
+    click.echo(f"{path}: " + ', '.join(f"{count} {name}" for name, count in counts.items())
+               + f" in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    generate()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Load test for 'ulwazi serve'
+Runs concurrent keep-alive clients against the JSON API for a fixed time
+and reports throughput and latency. With --revalidate each client sends
+back the last ETag it saw, so unchanged data comes back as 304.
+
+    ulwazi serve &
+    python bin/loadtest.py --course DE5 -c 32 -t 10
+"""
+
+import asyncio
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+import click
+
+
+async def fetch(reader, writer, host, path, etag=None):
+    """One GET on an open connection; returns (status, etag)"""
+    request = f"GET {path} HTTP/1.1\r\nHost: {host}\r\n"
+    if etag:
+        request += f"If-None-Match: {etag}\r\n"
+    writer.write((request + "\r\n").encode('latin-1'))
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers.get('etag')
+
+
+async def client(host, port, paths, deadline, revalidate, latencies, statuses):
+    reader, writer = await asyncio.open_connection(host, port)
+    etags = {}
+    i = 0
+    try:
+        while time.perf_counter() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            start = time.perf_counter()
+            status, etag = await fetch(reader, writer, host, path,
+                                       etags.get(path) if revalidate else None)
+            latencies.append(time.perf_counter() - start)
+            statuses[status] += 1
+            if etag:
+                etags[path] = etag
+    finally:
+        writer.close()
+
+
+async def run(host, port, paths, clients, seconds, revalidate):
+    latencies = []
+    statuses = Counter()
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        client(host, port, paths[n % len(paths):] + paths[:n % len(paths)],
+               deadline, revalidate, latencies, statuses)
+        for n in range(clients)))
+    return latencies, statuses, time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+@click.command()
+@click.option('--url', default='http://127.0.0.1:8080', help='Server address')
+@click.option('--course', default='DE5', help='Standard to query')
+@click.option('-c', '--clients', default=16, help='Concurrent connections')
+@click.option('-t', '--seconds', default=10.0, help='How long to run')
+@click.option('--revalidate', is_flag=True, help='Send If-None-Match with the last ETag')
+@click.option('--path', 'paths', multiple=True, help='Path to request (repeatable)')
+def loadtest(url, course, clients, seconds, revalidate, paths):
+    """Measure requests per second and latency of 'ulwazi serve'"""
+    address = urlsplit(url)
+    host, port = address.hostname, address.port or 80
+    paths = list(paths) or [
+        f"/show/{course}",
+        f"/coverage/{course}?module=1",
+        f"/coverage/{course}?discover=1",
+        f"/ksb/{course}/K1",
+    ]
+
+    try:
+        latencies, statuses, elapsed = asyncio.run(
+            run(host, port, paths, clients, seconds, revalidate))
+    except OSError as e:
+        click.echo(f"Error: {e}")
+        raise SystemExit(1)
+
+    latencies.sort()
+    if not latencies:
+        click.echo("No requests completed")
+        raise SystemExit(1)
+
+    click.echo(f"{len(latencies)} requests from {clients} clients in {elapsed:.1f}s: "
+               f"{len(latencies) / elapsed:.0f} req/s")
+    click.echo(f"Latency ms: p50 {percentile(latencies, 0.50) * 1000:.2f}  "
+               f"p95 {percentile(latencies, 0.95) * 1000:.2f}  "
+               f"p99 {percentile(latencies, 0.99) * 1000:.2f}  "
+               f"max {latencies[-1] * 1000:.2f}")
+    click.echo("Status: " + ', '.join(f"{status} x{count}" for status, count in sorted(statuses.items())))
+
+
+if __name__ == '__main__':
+    loadtest()
@@ -4,7 +4,13 @@ if [ "$#" -eq 0 ]; then
     echo "The script expects the course code. Exiting"
     exit 1
 fi
-COURSE=$1
+COURSE=$(echo "$1" | tr '[:lower:]' '[:upper:]')
+
+# Standard codes are letters and digits only; anything else never reaches SQL
+if [[ ! "$COURSE" =~ ^[A-Z0-9]+$ ]]; then
+    echo "Invalid course code: $1"
+    exit 1
+fi
 
 directory="/mnt/ssd/Applications/ulwazi"
 database="ulwazi.db"
@@ -18,25 +24,28 @@ fi
 echo "========================================================================"
 
 sqlite3 ${directory}/${database} <<EOF
+.parameter set @course '${COURSE}'
 SELECT standard, code, category, description
 FROM ksbs
-WHERE standard = '${COURSE}'
+WHERE standard = @course
 EOF
 
 echo "------------------------------------------------------------------------"
 
 sqlite3 ${directory}/${database} <<EOF
+.parameter set @course '${COURSE}'
 SELECT standard, ksb_code, phase, module_number
 FROM module_ksbs
-WHERE standard = '${COURSE}'
+WHERE standard = @course
 EOF
 
 echo "------------------------------------------------------------------------"
 
 sqlite3 ${directory}/${database} <<EOF
+.parameter set @course '${COURSE}'
 SELECT standard, ksb_code, module_number, day_number, session_number, notes 
 FROM session_ksbs
-WHERE standard = '${COURSE}'
+WHERE standard = @course
 EOF
 
 echo "------------------------------------------------------------------------"
@@ -24,6 +24,7 @@ if [ ! -f ${filename} ]; then
   echo "ERROR: File not found - ${filename}"
   exit 3
 fi
-python ${filename} "$@"
+# Import the module so the compiled bytecode in __pycache__ is reused
+python -c "import ${PROJECT}; ${PROJECT}.cli(prog_name='${PROJECT}')" "$@"
 
 #EOF
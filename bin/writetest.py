@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Concurrent write test for the ulwazi CLI
+Starts N writer processes against a scratch copy of the database, each
+adding its own KSBs and mapping them with 'ulwazi map' and 'ulwazi
+session --notes', the way several trainers editing at once would. Then
+checks every write landed (no lost updates) and reports throughput and
+any errors a writer saw. --hold also keeps the write lock busy from
+another process for a while, like a long import.
+
+    python bin/writetest.py -w 8 -n 50
+    python bin/writetest.py -w 8 -n 50 --hold 6
+"""
+
+import io
+import multiprocessing
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import click
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# A standard of its own, so existing KSBs never collide with the writers'
+STANDARD = 'WRITETEST'
+MODULES, DAYS, SESSIONS = 7, 5, 4
+
+
+def use_paths(db_path, config_dir):
+    """Point this process's ulwazi at the scratch database and config"""
+    import ulwazi
+    ulwazi.DB_FILE = Path(db_path)
+    ulwazi.CONFIG_DIR = Path(config_dir)
+    ulwazi.CONFIG_FILE = ulwazi.CONFIG_DIR / 'config.json'
+    return ulwazi
+
+
+def invoke(ulwazi, args):
+    """Run one command; returns its error line, or None if it succeeded"""
+    out = io.StringIO()
+    try:
+        with redirect_stdout(out):
+            ulwazi.cli.main(args, prog_name='ulwazi', standalone_mode=False)
+    except SystemExit as e:
+        if e.code:
+            return f"exit {e.code}"
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    for line in out.getvalue().splitlines():
+        if line.startswith('Error'):
+            return line
+    return None
+
+
+def setup(db_path, config_dir):
+    """Add the scratch standard; returns its error line, or None"""
+    ulwazi = use_paths(db_path, config_dir)
+    return invoke(ulwazi, ['standard', STANDARD, '--add', 'Write test',
+                           '--modules', str(MODULES), '--days', str(DAYS),
+                           '--sessions', str(SESSIONS)])
+
+
+def hold_lock(db_path, seconds, start):
+    """Keep the write lock for a while, like a long import in another shell"""
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    start.wait()
+    conn.execute("BEGIN IMMEDIATE")
+    time.sleep(seconds)
+    conn.execute("ROLLBACK")
+    conn.close()
+
+
+def writer(db_path, config_dir, worker, count, start):
+    """Add and map count KSBs; returns ({command: successes}, errors, seconds)"""
+    ulwazi = use_paths(db_path, config_dir)
+    errors = []
+    succeeded = Counter()
+    start.wait()
+    began = time.perf_counter()
+    for n in range(count):
+        code = f"K{worker * count + n + 1}"
+        module = n % MODULES + 1
+        day = n // MODULES % DAYS + 1
+        session = worker % SESSIONS + 1
+        for args in (['ksb', code, '--add', f'Writer {worker} KSB {n}'],
+                     ['map', code, '-m', str(module)],
+                     ['session', code, '-m', str(module), '-d', str(day), '-s', str(session),
+                      '--notes', f'Writer {worker}']):
+            error = invoke(ulwazi, args + ['--course', STANDARD])
+            if error:
+                errors.append(error)
+            else:
+                succeeded[args[0]] += 1
+    return succeeded, errors, time.perf_counter() - began
+
+
+@click.command()
+@click.option('--db', 'source', type=click.Path(exists=True, dir_okay=False),
+              help='Database to copy (Default: the ulwazi database)')
+@click.option('-w', '--writers', default=8, help='Concurrent writer processes')
+@click.option('-n', '--count', default=50, help='KSBs each writer adds and maps')
+@click.option('--hold', default=0.0,
+              help='Also hold the write lock this many seconds from another process')
+def writetest(source, writers, count, hold):
+    """Check that parallel 'map' and 'session' writers lose nothing"""
+    with tempfile.TemporaryDirectory() as scratch:
+        db_path = Path(scratch) / 'ulwazi.db'
+        config_dir = Path(scratch) / 'config'
+        ulwazi = use_paths(db_path, config_dir)
+        shutil.copy(source or ulwazi.DB_FILE, db_path)
+
+        # Set up in a child too, so no writer inherits an open connection
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(1) as pool:
+            error = pool.apply(setup, (db_path, config_dir))
+        if error:
+            click.echo(f"Error: {error}")
+            raise SystemExit(1)
+
+        # Every process imports ulwazi first, then they all start at once
+        manager = context.Manager()
+        start = manager.Barrier(writers + (1 if hold else 0))
+        with context.Pool(writers + 1) as pool:
+            results = [pool.apply_async(writer, (db_path, config_dir, w, count, start))
+                       for w in range(writers)]
+            holder = pool.apply_async(hold_lock, (db_path, hold, start)) if hold else None
+            results = [result.get() for result in results]
+            if holder:
+                holder.get()
+        manager.shutdown()
+
+        conn = sqlite3.connect(db_path)
+        found = [conn.execute(sql, (STANDARD,)).fetchone()[0] for sql in (
+            "SELECT COUNT(*) FROM ksbs WHERE standard = ?",
+            "SELECT COUNT(*) FROM module_ksbs WHERE standard = ?",
+            "SELECT COUNT(*) FROM session_ksbs WHERE standard = ? AND notes LIKE 'Writer %'",
+        )]
+        conn.close()
+
+    succeeded = sum((r[0] for r in results), Counter())
+    errors = Counter(error for r in results for error in r[1])
+    commands = writers * count * 3
+    # Writers start together, so the slowest one is the run's wall time
+    elapsed = max(r[2] for r in results)
+    click.echo(f"{commands} commands from {writers} writers in {elapsed:.2f}s: "
+               f"{commands / elapsed:.0f} commands/s")
+
+    # Every command that reported success must have its row, and no others
+    mismatched = False
+    for label, command, total in zip(('KSBs', 'Module mappings', 'Session mappings with notes'),
+                                     ('ksb', 'map', 'session'), found):
+        expected = succeeded[command]
+        mismatched |= total != expected
+        click.echo(f"{label}: {total} in the database, {expected} reported"
+                   + ('' if total == expected else '  MISMATCH'))
+    if errors:
+        click.echo(f"{sum(errors.values())} commands failed:")
+    for error, times in errors.most_common():
+        click.echo(f"  x{times} {error}")
+    if errors or mismatched:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    writetest()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Ulwazi Cache
+Read-through cache for the show and coverage queries. Results are kept
+until the database's write generation moves (triggers bump it on every
+change to ksbs, module_ksbs and session_ksbs), least recently used out
+first. Optionally saved under ~/.ulwazi/ so separate CLI runs share it.
+"""
+
+import os
+import pickle
+from collections import OrderedDict
+
+# Query results kept in memory (and on disk)
+CACHE_SIZE = 128
+
+
+class ResultCache:
+    """LRU of query results for one connection, keyed by (SQL, parameters)"""
+
+    def __init__(self, conn, size=CACHE_SIZE, path=None):
+        self.conn = conn
+        self.size = size
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.generation = None
+        self.stamp = None
+        self.dirty = False
+        if path:
+            self.load()
+
+    def current_generation(self):
+        """(db_id, generation), dropping every entry when it has moved"""
+        # data_version moves on other connections' commits and total_changes
+        # on ours; while neither has, the generation can't have either
+        stamp = (self.conn.execute("PRAGMA data_version").fetchone()[0], self.conn.total_changes)
+        if stamp != self.stamp:
+            self.stamp = stamp
+            generation = tuple(self.conn.execute(
+                "SELECT db_id, generation FROM write_generation").fetchone())
+            if generation != self.generation:
+                self.generation = generation
+                if self.entries:
+                    self.entries.clear()
+                self.dirty = True
+        return self.generation
+
+    def rows(self, query, params=()):
+        """Iterate the rows of a query, from the cache when nothing has changed
+
+        On a miss the rows still stream straight from the cursor; they are
+        stored once the caller has read them all.
+        """
+        if self.conn.in_transaction:
+            # Uncommitted changes might still be rolled back
+            return self.conn.execute(query, params)
+
+        self.current_generation()
+        key = (query, tuple(params))
+        rows = self.entries.get(key)
+        if rows is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            self.dirty = True
+            return iter(rows)
+
+        self.misses += 1
+        self.dirty = True
+        return self.fill(key, self.conn.execute(query, params))
+
+    def fill(self, key, cursor):
+        rows = []
+        for row in cursor:
+            rows.append(row)
+            yield row
+
+        self.entries[key] = rows
+        self.dirty = True
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = 0
+        self.dirty = True
+
+    def stats(self):
+        self.current_generation()
+        return {'entries': len(self.entries), 'size': self.size,
+                'hits': self.hits, 'misses': self.misses}
+
+    # On disk
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                saved = pickle.load(f)
+            generation, entries = saved['generation'], saved['entries']
+            hits, misses = saved['hits'], saved['misses']
+        except Exception:
+            # Missing, truncated or from an older version: start empty
+            return
+        self.generation = generation
+        self.entries = entries
+        self.hits = hits
+        self.misses = misses
+
+    def save(self):
+        """Write the cache out if anything was looked up or changed"""
+        if not self.path or not self.dirty:
+            return
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+        # Written aside and renamed, so a concurrent run never reads half a file
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            pickle.dump({'generation': self.generation, 'entries': self.entries,
+                         'hits': self.hits, 'misses': self.misses},
+                        f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.path)
+        self.dirty = False
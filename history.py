@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Ulwazi History
+Reads the change journal kept by triggers (see migration_9_change_journal
+in setup_db.py): one KSB's history, a standard's mapping as it stood at
+any time, and what changed between two times. A past state starts from
+the nearest checkpoint at or before it and replays only the journal
+entries after that, so the cost doesn't grow with the age of the log.
+
+Journal times are UTC; times given and shown here are local.
+"""
+
+import json
+from datetime import datetime, timezone
+
+from setup_db import checkpoint_state_sql
+
+# Journal timestamp format (SQLite strftime('%Y-%m-%d %H:%M:%f'))
+JOURNAL_TIME = '%Y-%m-%d %H:%M:%S.%f'
+
+
+class State:
+    """One standard's KSBs, module mappings and session mappings
+
+    ksbs: {code: (category, description)}
+    modules: {(code, phase, module_number)}
+    sessions: {(code, module, day, session): notes}
+    """
+
+    def __init__(self, ksbs=None, modules=None, sessions=None):
+        self.ksbs = ksbs or {}
+        self.modules = modules or set()
+        self.sessions = sessions or {}
+
+    @classmethod
+    def from_json(cls, text):
+        state = json.loads(text)
+        return cls({code: (category, description) for code, category, description in state['ksbs']},
+                   {tuple(row) for row in state['modules']},
+                   {tuple(row[:4]): row[4] for row in state['sessions']})
+
+    def apply(self, source, action, code, category, phase, module, day, session, new_text):
+        """Replay one journal entry; each sets or removes a whole row"""
+        if source == 'ksb':
+            if action == 'delete':
+                self.ksbs.pop(code, None)
+            else:
+                self.ksbs[code] = (category, new_text)
+        elif source == 'module':
+            if action == 'delete':
+                self.modules.discard((code, phase, module))
+            else:
+                self.modules.add((code, phase, module))
+        elif action == 'delete':
+            self.sessions.pop((code, module, day, session), None)
+        else:
+            self.sessions[(code, module, day, session)] = new_text
+
+    def show_rows(self, category=None):
+        """(code, category, description, phase, module_number) per mapping, like show()"""
+        mappings = {}
+        for code, phase, module in sorted(self.modules, key=lambda m: (m[1], m[2] or 0)):
+            mappings.setdefault(code, []).append((phase, module))
+        for code, (ksb_category, description) in self.ksbs.items():
+            if category and ksb_category != category:
+                continue
+            for phase, module in mappings.get(code) or [(None, None)]:
+                yield code, ksb_category, description, phase, module
+
+
+def journal_time(text):
+    """A local date or date-time (ISO format) as a journal timestamp"""
+    moment = datetime.fromisoformat(text)
+    # Naive times are local; astimezone() assumes that
+    return moment.astimezone(timezone.utc).strftime(JOURNAL_TIME)[:-3]
+
+
+def local_time(at):
+    """A journal timestamp as local time, to the second"""
+    moment = datetime.strptime(at, JOURNAL_TIME).replace(tzinfo=timezone.utc)
+    return moment.astimezone().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def change_id_at(conn, at):
+    """Id of the last journal entry at or before a journal timestamp (0 if none)"""
+    return conn.execute('''
+        SELECT COALESCE(MAX(id), 0) FROM changes WHERE at <= ?
+    ''', (at,)).fetchone()[0]
+
+
+def current_state(conn, standard):
+    return State.from_json(conn.execute(
+        f"SELECT {checkpoint_state_sql('?1')}", (standard,)).fetchone()[0])
+
+
+def state_at(conn, standard, change_id):
+    """(State, entries replayed) for a standard just after journal entry change_id"""
+    checkpoint = conn.execute('''
+        SELECT change_id, state FROM checkpoints
+        WHERE standard = ? AND change_id <= ?
+        ORDER BY change_id DESC LIMIT 1
+    ''', (standard, change_id)).fetchone()
+
+    # A standard added after the journal started had nothing before its first entry
+    start, state = (checkpoint[0], State.from_json(checkpoint[1])) if checkpoint else (0, State())
+
+    replayed = 0
+    for entry in conn.execute('''
+        SELECT source, action, ksb_code, category, phase,
+            module_number, day_number, session_number, new_text
+        FROM changes
+        WHERE standard = ? AND id > ? AND id <= ?
+        ORDER BY id
+    ''', (standard, start, change_id)):
+        state.apply(*entry)
+        replayed += 1
+    return state, replayed
+
+
+def location(phase, module, day=None, session=None):
+    if phase == 'Discover':
+        return 'Discover'
+    if day is not None:
+        return f'M{module}/D{day}/S{session}'
+    return f'M{module}'
+
+
+def entries(conn, standard, code, limit):
+    """A KSB's latest journal entries, oldest first"""
+    rows = conn.execute('''
+        SELECT at, source, action, category, phase, module_number, day_number,
+            session_number, old_text, new_text
+        FROM changes
+        WHERE standard = ? AND ksb_code = ?
+        ORDER BY id DESC LIMIT ?
+    ''', (standard, code, limit)).fetchall()
+    return rows[::-1]
+
+
+def describe(source, action, category, phase, module, day, session, old_text, new_text, trim):
+    """One journal entry as a short sentence"""
+    if source == 'ksb':
+        if action == 'insert':
+            return f"Added ({category}): {(new_text or '')[:trim]}"
+        if action == 'delete':
+            return f"Removed: {(old_text or '')[:trim]}"
+        return f"Description: {(new_text or '')[:trim]}"
+
+    where = location(phase, module, day, session)
+    if action == 'insert':
+        return f"Mapped to {where}" + (f" ({new_text[:trim]})" if new_text else '')
+    if action == 'delete':
+        return f"Removed from {where}"
+    return f"Notes in {where}: {(new_text or '')[:trim]}"
+
+
+def diff(before, after):
+    """[(code, sign, what)] between two States: + added, - removed, ~ changed"""
+    changes = []
+    for code in before.ksbs.keys() - after.ksbs.keys():
+        changes.append((code, '-', 'KSB'))
+    for code in after.ksbs.keys() - before.ksbs.keys():
+        changes.append((code, '+', 'KSB'))
+    for code in before.ksbs.keys() & after.ksbs.keys():
+        if before.ksbs[code] != after.ksbs[code]:
+            changes.append((code, '~', 'description'))
+
+    for code, phase, module in before.modules - after.modules:
+        changes.append((code, '-', location(phase, module)))
+    for code, phase, module in after.modules - before.modules:
+        changes.append((code, '+', location(phase, module)))
+
+    for key in before.sessions.keys() - after.sessions.keys():
+        changes.append((key[0], '-', location('Module', *key[1:])))
+    for key in after.sessions.keys() - before.sessions.keys():
+        changes.append((key[0], '+', location('Module', *key[1:])))
+    for key in before.sessions.keys() & after.sessions.keys():
+        if before.sessions[key] != after.sessions[key]:
+            changes.append((key[0], '~', f"notes in {location('Module', *key[1:])}"))
+    return changes
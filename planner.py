@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Ulwazi Planner
+Assigns a module's KSBs to its day/session slots for 'ulwazi plan'.
+A greedy pass places each KSB where it adds the least cost, then local
+search (single moves and swaps) improves the result. Cost, from most to
+least important:
+
+    over capacity        per KSB beyond the session limit
+    out of order         per prerequisite taught after the KSB needing it
+    Behaviours together  per pair of Behaviours on the same day
+    imbalance            sum of squared session loads
+
+KSBs already in a session, and pinned ones, stay where they are; only
+new placements move. Each module is solved on its own, over the days
+and sessions its standard's timetable gives it.
+"""
+
+import random
+
+WEIGHT_CAPACITY = 1000
+WEIGHT_ORDER = 100
+WEIGHT_BEHAVIOUR = 10
+
+# Local search steps per KSB placed (capped by max_iterations)
+ITERATIONS_PER_KSB = 400
+
+
+class ModulePlanner:
+    """State and cost for one module: fixed KSBs plus the KSBs being placed
+
+    fixed: {code: [slot index, ...]} already taught (or pinned), not moved
+    items: codes to place (one slot each)
+    behaviours: codes that are Behaviours
+    prerequisites: [(before, after), ...] pairs of codes
+    slots: [(day, session), ...] the module's sessions in teaching order
+    """
+
+    def __init__(self, fixed, items, behaviours, prerequisites, capacity, slots):
+        self.capacity = capacity
+        self.behaviours = behaviours
+        self.items = list(items)
+        self.slots = slots
+        self.slot = dict.fromkeys(self.items)
+        self.load = [0] * len(slots)
+        days = sorted({day for day, _ in slots})
+        self.slot_day = [days.index(day) for day, _ in slots]
+        self.behaviour_days = [0] * len(days)
+
+        # A fixed KSB's position is the first session that teaches it
+        self.fixed_position = {}
+        for code, slots in fixed.items():
+            for s in slots:
+                self.load[s] += 1
+                if code in behaviours:
+                    self.behaviour_days[self.slot_day[s]] += 1
+            self.fixed_position[code] = min(slots)
+
+        known = set(self.items) | set(self.fixed_position)
+        self.prerequisites = [(a, b) for a, b in prerequisites if a in known and b in known]
+        self.related = {code: [] for code in self.items}
+        for a, b in self.prerequisites:
+            for code in (a, b):
+                if code in self.related:
+                    self.related[code].append((a, b))
+
+    def position(self, code):
+        if code in self.fixed_position:
+            return self.fixed_position[code]
+        return self.slot[code]
+
+    def out_of_order(self, a, b, moving=None, to=None):
+        """1 if a is not taught before b (with `moving` placed at `to`), 0 otherwise"""
+        pa = to if a == moving else self.position(a)
+        pb = to if b == moving else self.position(b)
+        if pa is None or pb is None:
+            return 0
+        return int(pa >= pb)
+
+    def over(self, load):
+        return max(load - self.capacity, 0)
+
+    def delta(self, code, to):
+        """Change in cost if code moved (or was first placed) at slot `to`"""
+        current = self.slot[code]
+        if current == to:
+            return 0
+
+        cost = 0
+        lt = self.load[to]
+        cost += (lt + 1) ** 2 - lt ** 2
+        cost += WEIGHT_CAPACITY * (self.over(lt + 1) - self.over(lt))
+        if current is not None:
+            ls = self.load[current]
+            cost += (ls - 1) ** 2 - ls ** 2
+            cost += WEIGHT_CAPACITY * (self.over(ls - 1) - self.over(ls))
+
+        if code in self.behaviours:
+            day_to = self.slot_day[to]
+            day_from = None if current is None else self.slot_day[current]
+            if day_to != day_from:
+                cost += WEIGHT_BEHAVIOUR * self.behaviour_days[day_to]
+                if day_from is not None:
+                    cost -= WEIGHT_BEHAVIOUR * (self.behaviour_days[day_from] - 1)
+
+        for a, b in self.related[code]:
+            cost += WEIGHT_ORDER * (self.out_of_order(a, b, code, to) - self.out_of_order(a, b))
+
+        return cost
+
+    def move(self, code, to):
+        current = self.slot[code]
+        if current is not None:
+            self.load[current] -= 1
+            if code in self.behaviours:
+                self.behaviour_days[self.slot_day[current]] -= 1
+        self.load[to] += 1
+        if code in self.behaviours:
+            self.behaviour_days[self.slot_day[to]] += 1
+        self.slot[code] = to
+
+    def greedy(self, order):
+        """Place each code, in order, in the cheapest slot (earliest on ties)"""
+        for code in order:
+            best = min(range(len(self.slots)), key=lambda s: (self.delta(code, s), s))
+            self.move(code, best)
+
+    def improve(self, iterations, rng):
+        """Hill-climb with random moves and swaps; sideways steps are allowed"""
+        if not self.items:
+            return
+        for _ in range(iterations):
+            code = rng.choice(self.items)
+            if rng.random() < 0.5 or len(self.items) == 1:
+                to = rng.randrange(len(self.slots))
+                if self.delta(code, to) <= 0:
+                    self.move(code, to)
+            else:
+                other = rng.choice(self.items)
+                a, b = self.slot[code], self.slot[other]
+                if a == b:
+                    continue
+                change = self.delta(code, b)
+                self.move(code, b)
+                change += self.delta(other, a)
+                if change <= 0:
+                    self.move(other, a)
+                else:
+                    self.move(code, a)
+
+    def violations(self):
+        """(KSBs over capacity, prerequisites out of order, Behaviour pairs sharing a day)"""
+        over = sum(self.over(load) for load in self.load)
+        order = sum(self.out_of_order(a, b) for a, b in self.prerequisites)
+        together = sum(n * (n - 1) // 2 for n in self.behaviour_days)
+        return over, order, together
+
+
+def prerequisite_order(codes, prerequisites, sort_key):
+    """Codes with every prerequisite before the KSBs needing it (cycles left in sort order)"""
+    codes = sorted(codes, key=sort_key)
+    present = set(codes)
+    waiting = {code: 0 for code in codes}
+    after = {code: [] for code in codes}
+    for a, b in prerequisites:
+        if a in present and b in present:
+            waiting[b] += 1
+            after[a].append(b)
+
+    ready = [code for code in codes if not waiting[code]]
+    order = []
+    while ready:
+        code = ready.pop(0)
+        order.append(code)
+        for b in after[code]:
+            waiting[b] -= 1
+            if not waiting[b]:
+                ready.append(b)
+        ready.sort(key=sort_key)
+
+    placed = set(order)
+    return order + [code for code in codes if code not in placed]
+
+
+def plan_module(fixed, items, behaviours, prerequisites, capacity, slots, sort_key,
+                seed=0, max_iterations=100000):
+    """Solve one module; returns ({code: (day, session)}, planner)"""
+    planner = ModulePlanner(fixed, items, behaviours, prerequisites, capacity, slots)
+    planner.greedy(prerequisite_order(items, planner.prerequisites, sort_key))
+    planner.improve(min(ITERATIONS_PER_KSB * len(items), max_iterations), random.Random(seed))
+    return {code: slots[s] for code, s in planner.slot.items()}, planner
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Ulwazi Progress
+What each apprentice has evidenced against the KSBs of their standard
+(see migration_11_learner_evidence in setup_db.py): reads learner
+rosters and portfolio evidence from CSV or JSONL, and works out learner
+and cohort completion for 'ulwazi progress'.
+
+Only the KSBs expected by now count: those mapped to Discover or to a
+module that has started, or every KSB when no module has a start date.
+A learner is at risk when they have no evidence for more of those than
+allowed. Completion is one aggregate query over learner_ksbs, a range
+of its primary key per learner, rather than a DISTINCT over every piece
+of evidence.
+"""
+
+import csv
+import json
+from collections import namedtuple
+from datetime import date
+
+# Columns (CSV header) or keys (JSONL) read from each kind of file
+LEARNER_FIELDS = ('learner', 'name', 'cohort')
+EVIDENCE_FIELDS = ('learner', 'ksb', 'reference', 'date')
+
+LearnerProgress = namedtuple('LearnerProgress', 'learner name cohort evidenced expected')
+CohortProgress = namedtuple('CohortProgress', 'cohort learners complete average at_risk')
+
+
+def json_record(n, line):
+    """The object on JSONL line n; anything else raises ValueError"""
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        raise ValueError(f"line {n}: {e}") from None
+    if not isinstance(record, dict):
+        raise ValueError(f"line {n} is not an object")
+    return record
+
+
+def read_records(path, file_format, fields, required):
+    """Tuples of fields from a CSV file with a header row, or a JSONL file
+
+    Values are stripped strings, or None where blank or missing; a record
+    without one of the required fields raises ValueError.
+    """
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if file_format == 'csv':
+            reader = csv.DictReader(f)
+            reader.fieldnames = [name.strip().lower() for name in reader.fieldnames or ()]
+            records = enumerate(reader, 2)
+        else:
+            records = ((n, json_record(n, line)) for n, line in enumerate(f, 1) if line.strip())
+
+        rows = []
+        for n, record in records:
+            row = tuple(str(record[field]).strip() or None if record.get(field) is not None else None
+                        for field in fields)
+            for field, value in zip(fields, row):
+                if value is None and field in required:
+                    raise ValueError(f"line {n} has no {field}")
+            rows.append(row)
+    return rows
+
+
+def expected_ksbs(conn, standard, through=None):
+    """(codes, label) of the KSBs a standard's learners should have evidenced
+
+    through: the last module taught (Default: the last one started by
+    today, or every KSB when no module has a start date).
+    """
+    if through is None:
+        dated, started = conn.execute('''
+            SELECT COUNT(start_date), MAX(CASE WHEN start_date <= ? THEN module_number END)
+            FROM modules
+            WHERE standard = ?
+        ''', (date.today().isoformat(), standard)).fetchone()
+        if not dated:
+            codes = {code for code, in conn.execute('''
+                SELECT code FROM ksbs WHERE standard = ?
+            ''', (standard,))}
+            return codes, 'every KSB'
+        through = started or 0
+
+    codes = {code for code, in conn.execute('''
+        SELECT ksb_code FROM module_ksbs
+        WHERE standard = ? AND (phase = 'Discover' OR module_number <= ?)
+    ''', (standard, through))}
+    return codes, 'Discover' + (f' and M1-M{through}' if through > 1 else ' and M1' if through else '')
+
+
+def learner_progress(conn, standard, expected, cohort=None, learner=None):
+    """LearnerProgress for every learner on a standard (or in one cohort, or just one)"""
+    # Unary + keeps the planner on the learner's range of the primary key,
+    # rather than probing it once per expected KSB
+    rows = conn.execute('''
+        SELECT l.id, l.name, l.cohort,
+            (SELECT COUNT(*) FROM learner_ksbs k
+             WHERE k.learner = l.id AND +k.standard = c.standard
+             AND +k.ksb_code IN (SELECT value FROM json_each(?1)))
+        FROM cohorts c
+        INNER JOIN learners l ON l.cohort = c.code
+        WHERE c.standard = ?2 AND c.code = COALESCE(?3, c.code) AND l.id = COALESCE(?4, l.id)
+    ''', (json.dumps(sorted(expected)), standard, cohort, learner))
+    return [LearnerProgress(*row, len(expected)) for row in rows]
+
+
+def missing(learner):
+    return learner.expected - learner.evidenced
+
+
+def cohort_progress(learners, allow):
+    """CohortProgress per cohort, from LearnerProgress rows"""
+    cohorts = {}
+    for learner in learners:
+        cohorts.setdefault(learner.cohort, []).append(learner)
+    summary = []
+    for cohort, members in sorted(cohorts.items()):
+        shares = [m.evidenced / m.expected if m.expected else 1.0 for m in members]
+        summary.append(CohortProgress(
+            cohort, len(members),
+            sum(1 for m in members if not missing(m)),
+            sum(shares) / len(shares),
+            sum(1 for m in members if missing(m) > allow)))
+    return summary
+
+
+def at_risk(learners, allow):
+    """Learners missing more than allow expected KSBs, most missing first"""
+    return sorted((l for l in learners if missing(l) > allow),
+                  key=lambda l: (-missing(l), l.cohort, l.learner))
+
+
+def evidenced_ksbs(conn, learner, standard):
+    """{code: (pieces of evidence, latest date)} for one learner's KSBs on a standard"""
+    return {code: (pieces, latest) for code, pieces, latest in conn.execute('''
+        SELECT ksb_code, pieces, latest
+        FROM learner_ksbs
+        WHERE learner = ? AND standard = ?
+    ''', (learner, standard))}
+
+
+def evidenced_codes(conn, learners, standard):
+    """{learner id: set of evidenced KSB codes on a standard} for many learners at once"""
+    # KSB codes are a letter and digits, so a comma-joined list splits back cleanly
+    return {learner: set(codes.split(',')) for learner, codes in conn.execute('''
+        SELECT learner, group_concat(ksb_code)
+        FROM learner_ksbs
+        WHERE learner IN (SELECT value FROM json_each(?)) AND standard = ?
+        GROUP BY learner
+    ''', (json.dumps(learners), standard))}
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Ulwazi Queries
+The SQL behind show and coverage, built in one place for the CLI
+(ulwazi.py), the server and report pack (store.py) and the plan check
+in setup_db.py, so the plans it checks are the ones that actually run.
+
+Each function returns (query, params).
+"""
+
+# SQL ORDER BY for KSBs: category, then the number in the code, from the
+# indexed ksbs.sort_key (see migration_12_sort_key in setup_db.py)
+NATURAL_ORDER = 'k.sort_key, k.code'
+
+# A sort key is its category's rank * CATEGORY_STEP + the number in the code
+CATEGORY_STEP = 2 ** 32
+CATEGORY_RANKS = {'Behaviour': 1, 'Knowledge': 2, 'Skill': 3}
+
+
+def show_query(standard, category=None, start=None, limit=None):
+    """(category, code, description, 'Discover, M1, ...' or None) per KSB, in order
+
+    start is a (sort_key, code) the rows come after, so a page is read
+    straight off the ksbs_sort index.
+    """
+    query = '''
+        SELECT k.category, k.code, k.description,
+            (SELECT GROUP_CONCAT(location, ', ') FROM (
+                SELECT CASE m.phase WHEN 'Discover' THEN 'Discover'
+                       ELSE 'M' || m.module_number END AS location
+                FROM module_ksbs m
+                WHERE m.standard = k.standard AND m.ksb_code = k.code
+                ORDER BY m.phase, m.module_number))
+        FROM ksbs k
+        WHERE k.standard = ?
+    '''
+    params = [standard]
+    if category:
+        query += ' AND k.category = ?'
+        params.append(category)
+    if start:
+        query += ' AND (k.sort_key, k.code) > (?, ?)'
+        params += start
+    query += f' ORDER BY {NATURAL_ORDER}'
+    if limit:
+        query += ' LIMIT ?'
+        params.append(limit)
+    return query, params
+
+
+def coverage_query(standard, module=None, day=None, session=None, discover=False,
+                   category=None, start=None, limit=None):
+    """(code, category, description, notes or None) per KSB covered by
+    Discover, a module, a day or a session, in order
+
+    The mappings are read off their sort_key indexes (see
+    migration_14_mapping_sort_key in setup_db.py), so a page starting at
+    start is found without reading the KSBs before it. A day lists a KSB
+    once per session it is in, so limit (in rows) is only applied to the
+    other levels; a day's page is cut where its rows stop being read.
+    """
+    if day:
+        query = '''
+            SELECT k.code, k.category, k.description, s.notes
+            FROM session_ksbs s
+            INNER JOIN ksbs k
+                ON k.standard = s.standard AND k.code = s.ksb_code
+            WHERE s.standard = ? AND s.module_number = ? AND s.day_number = ?
+        '''
+        params = [standard, module, day]
+        if session:
+            query += ' AND s.session_number = ?'
+            params.append(session)
+        mapping = 's'
+    else:
+        query = '''
+            SELECT k.code, k.category, k.description, NULL
+            FROM module_ksbs m
+            INNER JOIN ksbs k
+                ON k.standard = m.standard AND k.code = m.ksb_code
+            WHERE m.standard = ?
+        '''
+        if discover:
+            # Discover mappings have no module
+            query += " AND m.phase = 'Discover' AND m.module_number IS NULL"
+            params = [standard]
+        else:
+            query += " AND m.phase = 'Module' AND m.module_number = ?"
+            params = [standard, module]
+        mapping = 'm'
+
+    if category:
+        # A category is a range of sort keys, so the filter stays on the index
+        rank = CATEGORY_RANKS[category]
+        query += f' AND {mapping}.sort_key >= ? AND {mapping}.sort_key < ?'
+        params += [rank * CATEGORY_STEP, (rank + 1) * CATEGORY_STEP]
+    if start:
+        query += f' AND ({mapping}.sort_key, {mapping}.ksb_code) > (?, ?)'
+        params += start
+    query += f' ORDER BY {mapping}.sort_key, {mapping}.ksb_code'
+    if day:
+        query += ', s.session_number'
+    elif limit:
+        query += ' LIMIT ?'
+        params.append(limit)
+    return query, params
+
+
+def hours_query(standard, module=None, category=None):
+    """(category, code, sessions, minutes, description) per KSB, in order"""
+    # The module filter sits in the join so KSBs with no sessions still show
+    query = f'''
+        SELECT k.category, k.code, COUNT(se.minutes), SUM(se.minutes), k.description
+        FROM ksbs k
+        LEFT OUTER JOIN session_ksbs s
+            ON k.standard = s.standard AND k.code = s.ksb_code
+            {'AND s.module_number = ?' if module else ''}
+        LEFT OUTER JOIN sessions se
+            ON se.standard = s.standard AND se.module_number = s.module_number
+            AND se.day_number = s.day_number AND se.session_number = s.session_number
+        WHERE k.standard = ?
+    '''
+    params = [module, standard] if module else [standard]
+
+    if module:
+        query += '''
+            AND EXISTS (
+                SELECT 1 FROM module_ksbs m
+                WHERE m.standard = k.standard AND m.ksb_code = k.code
+                AND m.phase = 'Module' AND m.module_number = ?
+            )
+        '''
+        params.append(module)
+    if category:
+        query += ' AND k.category = ?'
+        params.append(category)
+    query += f' GROUP BY k.code ORDER BY {NATURAL_ORDER}'
+    return query, params
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Ulwazi Render
+Markdown, HTML, CSV and plain text output for coverage, show and the
+course handbook. Rows are written as they come off the cursor, so the
+first line appears before the query has finished.
+"""
+
+import csv
+import io
+from html import escape
+
+
+class Renderer:
+    """Base renderer: headings, then tables of rows, written through `write`"""
+
+    def __init__(self, write):
+        self.write = write
+        self.columns = None
+
+    def start(self, title):
+        pass
+
+    def heading(self, level, text):
+        pass
+
+    def table(self, columns):
+        self.columns = columns
+
+    def row(self, cells):
+        pass
+
+    def end_table(self):
+        self.columns = None
+
+    def finish(self):
+        pass
+
+
+class TextRenderer(Renderer):
+    """Indented plain text under headings, for the course handbook
+
+    show and coverage print their own text (show_text, coverage_text).
+    """
+
+    def __init__(self, write):
+        super().__init__(write)
+        self.indent = '  '
+
+    def start(self, title):
+        self.write(f"\n{title}")
+
+    def heading(self, level, text):
+        self.write(f"\n{'  ' * (level - 1)}{text}:")
+        self.indent = '  ' * level
+
+    def row(self, cells):
+        values = dict(zip(self.columns, cells))
+        self.write(f"{self.indent}  {values.get('Code', cells[0])}: {values.get('Description') or ''}")
+        if values.get('Notes'):
+            self.write(f"{self.indent}      Notes: {values['Notes']}")
+
+    def finish(self):
+        self.write('')
+
+
+class MarkdownRenderer(Renderer):
+    """GitHub-flavoured Markdown tables under # headings"""
+
+    def start(self, title):
+        self.write(f"# {title}")
+
+    def heading(self, level, text):
+        self.end_table()
+        self.write(f"\n{'#' * (level + 1)} {text}")
+
+    def table(self, columns):
+        super().table(columns)
+        self.write('')
+        self.write('| ' + ' | '.join(columns) + ' |')
+        self.write('|' + '|'.join('---' for _ in columns) + '|')
+
+    def row(self, cells):
+        self.write('| ' + ' | '.join(self.cell(c) for c in cells) + ' |')
+
+    @staticmethod
+    def cell(value):
+        text = '' if value is None else str(value)
+        return text.replace('|', '\\|').replace('\n', '<br>')
+
+
+class HtmlRenderer(Renderer):
+    """A standalone HTML page with one table per section"""
+
+    def start(self, title):
+        self.write('<!DOCTYPE html>')
+        self.write('<html lang="en">')
+        self.write(f'<head><meta charset="utf-8"><title>{escape(title)}</title>')
+        self.write('<style>'
+                   'body{font-family:sans-serif;margin:2em}'
+                   'table{border-collapse:collapse;margin:1em 0}'
+                   'th,td{border:1px solid #ccc;padding:4px 8px;text-align:left;vertical-align:top}'
+                   'th{background:#eee}'
+                   '</style></head>')
+        self.write(f'<body>\n<h1>{escape(title)}</h1>')
+
+    def heading(self, level, text):
+        self.end_table()
+        tag = f"h{min(level + 1, 6)}"
+        self.write(f'<{tag}>{escape(text)}</{tag}>')
+
+    def table(self, columns):
+        super().table(columns)
+        self.write('<table>')
+        self.write('<tr>' + ''.join(f'<th>{escape(c)}</th>' for c in columns) + '</tr>')
+
+    def row(self, cells):
+        self.write('<tr>' + ''.join(
+            f"<td>{escape('' if c is None else str(c))}</td>" for c in cells) + '</tr>')
+
+    def end_table(self):
+        if self.columns is not None:
+            self.write('</table>')
+        super().end_table()
+
+    def finish(self):
+        self.end_table()
+        self.write('</body>\n</html>')
+
+
+class CsvRenderer(Renderer):
+    """One flat CSV: headings become leading columns of every row"""
+
+    def __init__(self, write):
+        super().__init__(write)
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.header_written = False
+
+    def emit(self, cells):
+        self.writer.writerow(cells)
+        self.write(self.buffer.getvalue().rstrip('\r\n'))
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+    def table(self, columns):
+        super().table(columns)
+        if not self.header_written:
+            self.emit(columns)
+            self.header_written = True
+
+    def row(self, cells):
+        self.emit(['' if c is None else c for c in cells])
+
+
+RENDERERS = {
+    'text': TextRenderer,
+    'markdown': MarkdownRenderer,
+    'html': HtmlRenderer,
+    'csv': CsvRenderer,
+}
+
+
+def render(file_format, write, title, columns, rows, group_labels=()):
+    """Stream rows to `write` in the given format
+
+    Each row is (*group_values, *cells) with one group value per label in
+    group_labels (e.g. ('Module', 'Day')). A heading is written whenever a
+    group value changes, so rows must arrive ordered by their groups.
+    Returns the number of rows written.
+    """
+    renderer = RENDERERS[file_format](write)
+    renderer.start(title)
+
+    levels = len(group_labels)
+    flat = file_format == 'csv'
+    if flat:
+        renderer.table(list(group_labels) + list(columns))
+
+    current = None
+    count = 0
+    for row in rows:
+        groups, cells = row[:levels], row[levels:]
+
+        if flat:
+            renderer.row(list(groups) + list(cells))
+        else:
+            if groups != current or count == 0:
+                # Headings from the first level that changed
+                changed = 0
+                if current is not None:
+                    while changed < levels and groups[changed] == current[changed]:
+                        changed += 1
+                for level in range(changed, levels):
+                    text = group_text(group_labels[level], groups[level])
+                    if text is not None:
+                        renderer.heading(level + 1, text)
+                if changed < levels or count == 0:
+                    renderer.table(columns)
+                current = groups
+            renderer.row(cells)
+        count += 1
+
+    renderer.finish()
+    return count
+
+
+def group_text(label, value):
+    """Heading text for one group level: 'Module 2', or a text value as is
+
+    None means the level doesn't apply (e.g. Day under Discover) and
+    gets no heading.
+    """
+    if value is None or isinstance(value, str):
+        return value
+    return f"{label} {value}"
+
+
+def show_text(write, title, rows, descriptions=False):
+    """'ulwazi show' as plain text; rows are (category, code, description, 'M1, ...' or None)
+
+    Returns (KSBs written, the last one's code).
+    """
+    write(f"\n{title}")
+    current, count, last = None, 0, None
+    for category, code, description, locations in rows:
+        if category != current:
+            write(f"\n{category}:")
+            current = category
+        if locations:
+            write(f"  {code:<3} - {locations}")
+            if descriptions:
+                write(f"        {description}\n")
+        else:
+            write(f"  {code:<3} ~ {description}")
+        count, last = count + 1, code
+    return count, last
+
+
+def coverage_text(write, title, rows):
+    """'ulwazi coverage' as plain text; rows are (category, code, description, notes or None)
+
+    A day lists a KSB once per session, so it is counted once. Returns
+    (KSBs written, the last one's code).
+    """
+    write(f"\n{title}")
+    current, count, last = None, 0, None
+    for category, code, description, notes in rows:
+        if category != current:
+            write(f"\n{category}:")
+            current = category
+        write(f"  {code}: {description}")
+        if notes:
+            write(f"      Notes: {notes}")
+        if code != last:
+            count, last = count + 1, code
+    return count, last
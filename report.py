@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Ulwazi Report
+The report pack for 'ulwazi report': for each standard, its KSB list
+(as 'ulwazi show') and what Discover, every module, every day and, if
+asked, every session covers (as 'ulwazi coverage'), one file each:
+
+    reports/DE5/show.md  discover.md  m1.md  m1-d1.md  m1-d1-s1.md ...
+
+Reports are planned from the mappings in one pass, so only locations
+with KSBs get a file, then rendered on a process pool. Each worker opens
+one read-only connection and uses the same queries as the server. Every
+file is written aside and renamed into place, so a reader never sees
+half a report.
+"""
+
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from render import coverage_text, render, show_text
+from store import coverage_rows, open_connection, show_rows
+
+SUFFIXES = {'text': '.txt', 'markdown': '.md', 'html': '.html', 'csv': '.csv'}
+
+# Reports handed to a worker at a time; smaller plans are rendered
+# in-process, where starting the pool would cost more
+CHUNK_SIZE = 32
+
+Report = namedtuple('Report', 'standard level module day session')
+
+# The read-only connection of this (worker) process
+worker = {'conn': None}
+
+
+def plan(conn, standards, levels):
+    """Reports for the given levels of each standard, in standard order
+
+    Discover, module, day and session reports are only planned where
+    something is mapped.
+    """
+    reports = []
+    for standard in standards:
+        if 'show' in levels:
+            reports.append(Report(standard, 'show', None, None, None))
+        if 'discover' in levels and conn.execute('''
+            SELECT 1 FROM module_ksbs WHERE standard = ? AND phase = 'Discover'
+        ''', (standard,)).fetchone():
+            reports.append(Report(standard, 'discover', None, None, None))
+        if 'module' in levels:
+            reports += [Report(standard, 'module', module, None, None) for module, in conn.execute('''
+                SELECT DISTINCT module_number FROM module_ksbs
+                WHERE standard = ? AND phase = 'Module'
+                ORDER BY module_number
+            ''', (standard,))]
+        if 'day' in levels:
+            reports += [Report(standard, 'day', module, day, None) for module, day in conn.execute('''
+                SELECT DISTINCT module_number, day_number FROM session_ksbs
+                WHERE standard = ?
+                ORDER BY module_number, day_number
+            ''', (standard,))]
+        if 'session' in levels:
+            reports += [Report(standard, 'session', *slot) for slot in conn.execute('''
+                SELECT DISTINCT module_number, day_number, session_number FROM session_ksbs
+                WHERE standard = ?
+                ORDER BY module_number, day_number, session_number
+            ''', (standard,))]
+    return reports
+
+
+def file_name(report, file_format):
+    """Path of a report relative to the output directory, e.g. DE5/m2-d1.md"""
+    name = {
+        'show': 'show',
+        'discover': 'discover',
+        'module': f'm{report.module}',
+        'day': f'm{report.module}-d{report.day}',
+        'session': f'm{report.module}-d{report.day}-s{report.session}',
+    }[report.level]
+    return Path(report.standard, name + SUFFIXES[file_format])
+
+
+def location(report):
+    """The location as 'ulwazi coverage' titles it: Discover, M1, M1/D2 or M1/D2/S3"""
+    if report.level == 'discover':
+        return 'Discover'
+    return '/'.join(f'{prefix}{value}' for prefix, value in
+                    (('M', report.module), ('D', report.day), ('S', report.session))
+                    if value is not None)
+
+
+def open_worker(db_path):
+    """Give this process its read-only connection (pool initializer)"""
+    worker['conn'] = open_connection(db_path, readonly=True)
+
+
+def write_report(report, directory, file_format, trim, notes):
+    """Render one report to its file; returns (relative path, KSBs listed)
+
+    Runs on the worker processes.
+    """
+    conn = worker['conn']
+    if report.level == 'show':
+        title = f"Course: {report.standard}"
+        columns = ['Code', 'Description', 'Covered in']
+        rows = [(k['category'], k['code'], (k['description'] or '')[:trim], ', '.join(k['covered_in']) or None)
+                for k in show_rows(conn, report.standard)]
+    else:
+        title = f"Course: {report.standard} - {location(report)}"
+        columns = ['Code', 'Description']
+        with_notes = notes and report.day is not None
+        if with_notes:
+            columns.append('Notes')
+        rows = [(k['category'], k['code'], (k['description'] or '')[:trim],
+                 *([k['notes']] if with_notes else []))
+                for k in coverage_rows(conn, report.standard, report.module, report.day,
+                                       report.session, report.level == 'discover')]
+
+    lines = []
+    if file_format == 'text':
+        # The same text 'ulwazi show' and 'ulwazi coverage' print
+        if report.level == 'show':
+            show_text(lines.append, title, rows)
+        else:
+            coverage_text(lines.append, title, ((*row[:3], row[3] if with_notes else None) for row in rows))
+        lines.append('')
+        count = len(rows)
+    else:
+        count = render(file_format, lines.append, title, columns, rows, group_labels=('Category',))
+
+    relative = file_name(report, file_format)
+    path = Path(directory, relative)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Written aside and renamed, so nobody opening the pack reads half a file
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8', newline='') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp, path)
+    return relative, count
+
+
+def write_reports(db_path, reports, directory, file_format, trim, notes, jobs):
+    """Write every report; yields (relative path, KSBs listed) as each one lands"""
+    args = (reports, [directory] * len(reports), [file_format] * len(reports),
+            [trim] * len(reports), [notes] * len(reports))
+
+    if len(reports) > CHUNK_SIZE and jobs != 1:
+        with ProcessPoolExecutor(jobs, initializer=open_worker, initargs=(db_path,)) as pool:
+            yield from pool.map(write_report, *args, chunksize=CHUNK_SIZE)
+        return
+
+    open_worker(db_path)
+    try:
+        yield from map(write_report, *args)
+    finally:
+        worker['conn'].shutdown()
+        worker['conn'] = None
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+Ulwazi Server
+A small HTTP/JSON API over the KSB database for dashboards and LMS tools.
+Reads run on a pool of read-only WAL connections, so they never wait for
+a write; writes go through one KsbStore on its own thread. GET responses
+carry an ETag that changes whenever anything commits to the database.
+
+    GET    /ksb/<standard>/<code>
+    GET    /show/<standard>[?ksb=k]
+    GET    /coverage/<standard>?module=N[&day=N[&session=N]] | ?discover=1  [&ksb=k]
+    POST   /map/<standard>        {"code": "K1", "module": 2} or {"code": "K1", "discover": true}
+    DELETE /map/<standard>?code=K1&module=2
+    POST   /session/<standard>    {"code": "K1", "module": 2, "day": 1, "session": 3, "notes": "..."}
+    DELETE /session/<standard>?code=K1&module=2&day=1&session=3
+"""
+
+import asyncio
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from store import (ConnectionPool, DatabaseBusy, KsbStore, ModuleMapping, SessionMapping,
+                   coverage_rows, is_foreign_key_error, ksb_detail, open_connection,
+                   show_rows)
+
+# Largest request body accepted (bytes)
+MAX_BODY = 64 * 1024
+
+# Module, day and session numbers must fit an SQLite INTEGER
+MAX_NUMBER = 2 ** 63 - 1
+
+CATEGORIES = {
+    'k': 'Knowledge',
+    's': 'Skill',
+    'b': 'Behaviour',
+}
+
+
+class ApiError(Exception):
+    """A request the API refuses, reported to the client as {"error": ...}"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ChangeCounter:
+    """A generation number that moves whenever any connection commits
+
+    PRAGMA data_version on a connection of our own changes after every
+    commit made elsewhere: by the server's writer or by the CLI.
+    """
+
+    def __init__(self, path):
+        self.conn = open_connection(path, readonly=True)
+        self.data_version = self.read()
+        self.generation = 0
+        # Distinguishes ETags from an earlier run of the server
+        self.epoch = int(time.time())
+
+    def read(self):
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def etag(self):
+        version = self.read()
+        if version != self.data_version:
+            self.data_version = version
+            self.generation += 1
+        return f'"{self.epoch}-{self.generation}"'
+
+    def close(self):
+        self.conn.shutdown()
+
+
+def int_param(params, name, required=False):
+    value = params.get(name)
+    if value is None or value == '':
+        if required:
+            raise ApiError(HTTPStatus.BAD_REQUEST, f"'{name}' is required")
+        return None
+    # int() would also take JSON true (1) and 2.7 (2)
+    digits = value[1:] if isinstance(value, str) and value.startswith('-') else value
+    if isinstance(digits, str) and digits.isascii() and digits.isdigit():
+        number = int(value)
+    elif isinstance(value, int) and not isinstance(value, bool):
+        number = value
+    else:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"'{name}' must be a whole number")
+    if not 1 <= number <= MAX_NUMBER:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"'{name}' must be from 1 to {MAX_NUMBER}")
+    return number
+
+
+def flag_param(params, name):
+    return params.get(name) in (True, 1, '1', 'true', 'yes')
+
+
+def code_param(params):
+    code = params.get('code')
+    if not code or not isinstance(code, str):
+        raise ApiError(HTTPStatus.BAD_REQUEST, "'code' is required")
+    return code.upper()
+
+
+def category_param(params):
+    ksb = params.get('ksb')
+    if not ksb:
+        return None
+    category = CATEGORIES.get(str(ksb).lower())
+    if not category:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "'ksb' must be k, s or b")
+    return category
+
+
+class ApiServer:
+    """Routes requests to the read pool or the writer thread"""
+
+    def __init__(self, path, readers=4):
+        self.path = path
+        self.pool = ConnectionPool(path, size=readers)
+        self.changes = ChangeCounter(path)
+        self.read_executor = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='ulwazi-read')
+        # sqlite3 connections stay on the thread that opened them
+        self.write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ulwazi-write')
+        self.store = self.write_executor.submit(KsbStore, path).result()
+
+        self.reads = {
+            'ksb': self.get_ksb,
+            'show': self.get_show,
+            'coverage': self.get_coverage,
+        }
+        self.writes = {
+            ('POST', 'map'): self.add_map,
+            ('DELETE', 'map'): self.remove_map,
+            ('POST', 'session'): self.add_session,
+            ('DELETE', 'session'): self.remove_session,
+        }
+
+    def close(self):
+        self.write_executor.submit(self.store.close).result()
+        self.write_executor.shutdown()
+        self.read_executor.shutdown()
+        self.pool.close()
+        self.changes.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+    # HTTP
+
+    async def handle(self, reader, writer):
+        """One client connection; HTTP/1.1 keep-alive until the client closes"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    self.respond(writer, HTTPStatus.BAD_REQUEST, {'error': 'Malformed request line'},
+                                 keep_alive=False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = (version == 'HTTP/1.1'
+                              and headers.get('connection', '').lower() != 'close')
+
+                length = int(headers.get('content-length') or 0)
+                if length > MAX_BODY:
+                    self.respond(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                 {'error': 'Request body too large'}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                status, payload, extra = await self.dispatch(method, target, headers, body)
+                self.respond(writer, status, payload, extra, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            # Dropped connection or a garbled Content-Length
+            pass
+        finally:
+            writer.close()
+
+    def respond(self, writer, status, payload, extra=None, keep_alive=True):
+        body = b'' if payload is None else json.dumps(payload).encode('utf-8')
+        lines = [f"HTTP/1.1 {status.value} {status.phrase}"]
+        if payload is not None:
+            lines.append("Content-Type: application/json; charset=utf-8")
+        lines.append(f"Content-Length: {len(body)}")
+        lines.extend(f"{name}: {value}" for name, value in (extra or {}).items())
+        lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+
+    async def dispatch(self, method, target, headers, body):
+        """Returns (status, payload, extra headers)"""
+        url = urlsplit(target)
+        segments = [unquote(s) for s in url.path.split('/') if s]
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        loop = asyncio.get_running_loop()
+
+        try:
+            if not segments:
+                raise ApiError(HTTPStatus.NOT_FOUND, 'Unknown endpoint')
+            endpoint, args = segments[0], segments[1:]
+            if not args:
+                raise ApiError(HTTPStatus.NOT_FOUND, 'Specify a standard, e.g. /show/DE5')
+            args[0] = args[0].upper()
+
+            if method in ('GET', 'HEAD') and endpoint in self.reads:
+                # Taken before the read, so a commit in between can only make
+                # the tag older than the data (a refetch), never newer
+                etag = self.changes.etag()
+                extra = {'ETag': etag, 'Cache-Control': 'no-cache'}
+                if etag in headers.get('if-none-match', ''):
+                    return HTTPStatus.NOT_MODIFIED, None, extra
+                payload = await loop.run_in_executor(
+                    self.read_executor, self.read, self.reads[endpoint], args, params)
+                return HTTPStatus.OK, (None if method == 'HEAD' else payload), extra
+
+            handler = self.writes.get((method, endpoint))
+            if handler is None:
+                if endpoint in self.reads or endpoint in ('map', 'session'):
+                    raise ApiError(HTTPStatus.METHOD_NOT_ALLOWED, f'{method} not allowed on /{endpoint}')
+                raise ApiError(HTTPStatus.NOT_FOUND, 'Unknown endpoint')
+
+            if body:
+                try:
+                    data = json.loads(body)
+                except ValueError:
+                    raise ApiError(HTTPStatus.BAD_REQUEST, 'Body must be JSON')
+                if not isinstance(data, dict):
+                    raise ApiError(HTTPStatus.BAD_REQUEST, 'Body must be a JSON object')
+                params.update(data)
+
+            status, payload = await loop.run_in_executor(
+                self.write_executor, self.write, handler, args, params)
+            return status, payload, None
+
+        except ApiError as e:
+            return e.status, {'error': str(e)}, None
+
+    def read(self, handler, args, params):
+        try:
+            with self.pool.connection() as conn:
+                return handler(conn, args, params)
+        except ApiError:
+            raise
+        except Exception:
+            raise ApiError(HTTPStatus.INTERNAL_SERVER_ERROR, 'Database read failed')
+
+    def write(self, handler, args, params):
+        # One write-locked transaction per request, shared with CLI writers
+        try:
+            with self.store.transaction():
+                return handler(args[0], params)
+        except ApiError:
+            raise
+        except DatabaseBusy as e:
+            raise ApiError(HTTPStatus.SERVICE_UNAVAILABLE, str(e))
+        except Exception:
+            raise ApiError(HTTPStatus.INTERNAL_SERVER_ERROR, 'Database write failed')
+
+    # Reads (on a pooled connection)
+
+    def get_ksb(self, conn, args, params):
+        if len(args) != 2:
+            raise ApiError(HTTPStatus.NOT_FOUND, 'Use /ksb/<standard>/<code>')
+        standard, code = args[0], args[1].upper()
+        ksb = ksb_detail(conn, standard, code)
+        if ksb is None:
+            raise ApiError(HTTPStatus.NOT_FOUND, f'{code} not found in {standard}')
+        return ksb
+
+    def get_show(self, conn, args, params):
+        standard = args[0]
+        return {'standard': standard,
+                'ksbs': show_rows(conn, standard, category_param(params))}
+
+    def get_coverage(self, conn, args, params):
+        standard = args[0]
+        module = int_param(params, 'module')
+        day = int_param(params, 'day')
+        session = int_param(params, 'session')
+        discover = flag_param(params, 'discover')
+
+        if discover and (module or day or session):
+            raise ApiError(HTTPStatus.BAD_REQUEST, "'discover' cannot be combined with module, day or session")
+        if not discover and not module:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Specify 'module' or 'discover'")
+        if session and not day:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "'session' needs 'day'")
+
+        return {'standard': standard,
+                'ksbs': coverage_rows(conn, standard, module, day, session, discover,
+                                      category_param(params))}
+
+    # Writes (on the writer thread, one transaction each)
+
+    def mapping_params(self, standard, params):
+        code = code_param(params)
+        module = int_param(params, 'module')
+        discover = flag_param(params, 'discover')
+        if module and discover:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Specify either 'module' or 'discover', not both")
+        if not module and not discover:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Specify either 'module' or 'discover'")
+        if not self.store.ksb_exists(standard, code):
+            raise ApiError(HTTPStatus.NOT_FOUND, f'{code} not found in {standard}')
+
+        if discover:
+            return ModuleMapping(standard, code, 'Discover', None), 'Discover'
+        return ModuleMapping(standard, code, 'Module', module), f'M{module}'
+
+    def add_map(self, standard, params):
+        mapping, location = self.mapping_params(standard, params)
+        try:
+            added = self.store.add_module_mappings([mapping])
+        except sqlite3.IntegrityError as e:
+            if not is_foreign_key_error(e):
+                raise
+            raise ApiError(HTTPStatus.NOT_FOUND, f'{standard} has no module {location}')
+        if not added:
+            raise ApiError(HTTPStatus.CONFLICT, f'{mapping.ksb_code} already mapped to {location}')
+        return HTTPStatus.CREATED, {'standard': standard, 'code': mapping.ksb_code, 'mapped': location}
+
+    def remove_map(self, standard, params):
+        mapping, location = self.mapping_params(standard, params)
+        if not self.store.remove_module_mapping(*mapping):
+            raise ApiError(HTTPStatus.NOT_FOUND, f'No mapping found for {mapping.ksb_code} in {location}')
+        return HTTPStatus.OK, {'standard': standard, 'code': mapping.ksb_code, 'removed': location}
+
+    def session_params(self, standard, params):
+        code = code_param(params)
+        module = int_param(params, 'module', required=True)
+        day = int_param(params, 'day', required=True)
+        session = int_param(params, 'session', required=True)
+        if not self.store.ksb_exists(standard, code):
+            raise ApiError(HTTPStatus.NOT_FOUND, f'{code} not found in {standard}')
+        if not self.store.module_mapped(standard, code, module):
+            raise ApiError(HTTPStatus.CONFLICT, f'{code} not mapped to M{module}')
+        return code, module, day, session
+
+    def add_session(self, standard, params):
+        notes = params.get('notes')
+        if notes is not None and not isinstance(notes, str):
+            raise ApiError(HTTPStatus.BAD_REQUEST, "'notes' must be a string")
+        code, module, day, session = self.session_params(standard, params)
+        location = f'M{module}/D{day}/S{session}'
+
+        try:
+            added = self.store.add_session_mappings(
+                [SessionMapping(standard, code, module, day, session, notes or '')])
+        except sqlite3.IntegrityError as e:
+            if not is_foreign_key_error(e):
+                raise
+            raise ApiError(HTTPStatus.NOT_FOUND, f'{standard} has no session {location}')
+        if added:
+            return HTTPStatus.CREATED, {'standard': standard, 'code': code, 'mapped': location}
+        if notes is None:
+            raise ApiError(HTTPStatus.CONFLICT, f'{code} already mapped to {location}')
+
+        self.store.set_session_notes(standard, code, module, day, session, notes)
+        return HTTPStatus.OK, {'standard': standard, 'code': code, 'updated': location}
+
+    def remove_session(self, standard, params):
+        code, module, day, session = self.session_params(standard, params)
+        location = f'M{module}/D{day}/S{session}'
+        if not self.store.remove_session_mapping(standard, code, module, day, session):
+            raise ApiError(HTTPStatus.NOT_FOUND, f'No session mapping found for {code} in {location}')
+        return HTTPStatus.OK, {'standard': standard, 'code': code, 'removed': location}
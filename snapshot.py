@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Ulwazi Snapshot
+A read-only binary copy of one standard that show and coverage load
+instead of querying SQLite. The file is memory-mapped and read in place:
+fixed-size KSB records, one bitset per KSB for its modules and another
+for its sessions, and offsets into blobs of codes and descriptions.
+Nothing is parsed up front beyond the header and the code strings.
+
+A snapshot records the database's write generation (see setup_db.py)
+and is ignored as soon as that moves, so it is never read stale.
+
+Layout (little-endian, sections 8-byte aligned):
+
+    header      HEADER
+    records     RECORD per KSB, in category then natural code order
+    modules     module_words uint64 per KSB (bit N = mapped to module N)
+    slots       SLOT per (module, day, session) that has any KSB
+    sessions    slot_words uint64 per KSB (bit N = in slots[N])
+    codes       UTF-8 codes, back to back
+    text        UTF-8 descriptions, back to back
+"""
+
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+
+MAGIC = b'ULWZSNAP'
+VERSION = 1
+
+# magic, version, KSBs, module words, slots, slot words, db_id, generation,
+# standard, codes length, text length
+HEADER = struct.Struct('<8sIIIII16sq16sII')
+# code offset, code length, category, Discover, description offset, description length
+RECORD = struct.Struct('<IHBBII')
+# module, day, session
+SLOT = struct.Struct('<HHH')
+
+# In the order SQLite sorts them, so records are already in display order
+CATEGORIES = ('Behaviour', 'Knowledge', 'Skill')
+
+# Snapshots already mapped by this process: {path: ((mtime, size), Snapshot)}
+loaded = {}
+
+
+def align(offset):
+    return (offset + 7) & ~7
+
+
+def words_for(bits):
+    return bits // 64 + 1
+
+
+class Snapshot:
+    """One standard's KSBs and mappings, read from a snapshot buffer"""
+
+    def __init__(self, buffer):
+        (magic, version, self.count, self.module_words, slot_count, self.slot_words,
+         db_id, generation, standard, codes_length, text_length) = HEADER.unpack_from(buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('not a current ulwazi snapshot')
+
+        self.buffer = buffer
+        self.stamp = (db_id.rstrip(b'\0').decode('ascii'), generation)
+        self.standard = standard.rstrip(b'\0').decode('ascii')
+
+        offset = align(HEADER.size)
+        self.records = offset
+        offset = align(offset + self.count * RECORD.size)
+        view = memoryview(buffer)
+        self.module_bits = view[offset:offset + self.count * self.module_words * 8].cast('Q')
+        offset += self.count * self.module_words * 8
+        self.slots = [SLOT.unpack_from(buffer, offset + i * SLOT.size) for i in range(slot_count)]
+        offset = align(offset + slot_count * SLOT.size)
+        self.session_bits = view[offset:offset + self.count * self.slot_words * 8].cast('Q')
+        offset += self.count * self.slot_words * 8
+        codes = offset
+        self.text = codes + codes_length
+
+        # Codes are tiny and needed for every row; descriptions are decoded on use
+        self.codes, self.categories = [], []
+        for i in range(self.count):
+            code_offset, code_length, category, _, _, _ = RECORD.unpack_from(
+                buffer, self.records + i * RECORD.size)
+            self.codes.append(sys.intern(
+                bytes(buffer[codes + code_offset:codes + code_offset + code_length]).decode()))
+            self.categories.append(CATEGORIES[category])
+
+    def discover(self, i):
+        return bool(self.buffer[self.records + i * RECORD.size + 7])
+
+    def description(self, i):
+        _, _, _, _, offset, length = RECORD.unpack_from(self.buffer, self.records + i * RECORD.size)
+        start = self.text + offset
+        return bytes(self.buffer[start:start + length]).decode()
+
+    def modules(self, i):
+        """Module numbers KSB i is mapped to, in order"""
+        return list(bits_set(self.module_bits, i * self.module_words, self.module_words))
+
+    def in_module(self, i, module):
+        word, bit = divmod(module, 64)
+        return word < self.module_words and bool(self.module_bits[i * self.module_words + word] >> bit & 1)
+
+    def indexes(self, category=None):
+        if category is None:
+            return range(self.count)
+        return [i for i in range(self.count) if self.categories[i] == category]
+
+    # Rows shaped like the SQL queries they replace
+
+    def show_rendered_rows(self, trim, category=None):
+        """(category, code, description, 'Discover, M1, ...') like ulwazi.show_rows()"""
+        for i in self.indexes(category):
+            locations = ['Discover'] if self.discover(i) else []
+            locations += [f'M{module}' for module in self.modules(i)]
+            yield (self.categories[i], self.codes[i], self.description(i)[:trim],
+                   ', '.join(locations) or None)
+
+    def coverage_rows(self, module=None, day=None, session=None, discover=False, category=None):
+        """(code, category, description) or, for a day or session, one
+        (code, category, description, None) per session, like coverage()"""
+        if discover or not day:
+            for i in self.indexes(category):
+                mapped = self.discover(i) if discover else self.in_module(i, module)
+                if mapped:
+                    yield self.codes[i], self.categories[i], self.description(i)
+            return
+
+        wanted = [n for n, (m, d, s) in enumerate(self.slots)
+                  if m == module and d == day and (session is None or s == session)]
+        for i in self.indexes(category):
+            base = i * self.slot_words
+            for n in wanted:
+                word, bit = divmod(n, 64)
+                if self.session_bits[base + word] >> bit & 1:
+                    yield self.codes[i], self.categories[i], self.description(i), None
+
+
+def bits_set(words, start, count):
+    """Positions of the set bits in words[start:start + count]"""
+    for w in range(count):
+        value = words[start + w]
+        while value:
+            low = value & -value
+            yield w * 64 + low.bit_length() - 1
+            value ^= low
+
+
+def database_stamp(db_path):
+    """(db_id, generation) of the database, read without opening a store"""
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        return tuple(conn.execute('SELECT db_id, generation FROM write_generation').fetchone())
+    finally:
+        conn.close()
+
+
+def load(path, db_path, stamp=None):
+    """The snapshot at path if it matches the database now, otherwise None
+
+    stamp is the database's (db_id, generation) when the caller already
+    has it (e.g. from an open store); otherwise it is read from db_path.
+    """
+    if sys.byteorder != 'little':
+        return None
+    try:
+        info = os.stat(path)
+        version = (info.st_mtime_ns, info.st_size)
+        cached = loaded.get(path)
+        if cached and cached[0] == version:
+            snapshot = cached[1]
+        else:
+            with open(path, 'rb') as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            snapshot = Snapshot(buffer)
+            loaded[path] = (version, snapshot)
+        if snapshot.stamp != (stamp or database_stamp(db_path)):
+            return None
+    except (OSError, ValueError, struct.error, sqlite3.Error, TypeError):
+        # Missing, truncated, from an older version, or no database
+        return None
+    return snapshot
+
+
+def build(conn, standard):
+    """Snapshot bytes for one standard, read in a single transaction"""
+    conn.execute('BEGIN')
+    try:
+        db_id, generation = conn.execute('SELECT db_id, generation FROM write_generation').fetchone()
+        ksbs = conn.execute('''
+            SELECT code, category, description FROM ksbs
+            WHERE standard = ?
+            ORDER BY sort_key, code
+        ''', (standard,)).fetchall()
+        module_rows = conn.execute('''
+            SELECT ksb_code, phase, module_number FROM module_ksbs
+            WHERE standard = ?
+        ''', (standard,)).fetchall()
+        session_rows = conn.execute('''
+            SELECT ksb_code, module_number, day_number, session_number FROM session_ksbs
+            WHERE standard = ?
+        ''', (standard,)).fetchall()
+    finally:
+        conn.rollback()
+
+    index = {code: i for i, (code, _, _) in enumerate(ksbs)}
+    slots = sorted({row[1:] for row in session_rows})
+    slot_index = {slot: n for n, slot in enumerate(slots)}
+    module_words = words_for(max((m or 0 for _, _, m in module_rows), default=0))
+    slot_words = words_for(len(slots))
+
+    discover = [0] * len(ksbs)
+    module_bits = [0] * (len(ksbs) * module_words)
+    for code, phase, module in module_rows:
+        i = index[code]
+        if phase == 'Discover':
+            discover[i] = 1
+        else:
+            word, bit = divmod(module, 64)
+            module_bits[i * module_words + word] |= 1 << bit
+
+    session_bits = [0] * (len(ksbs) * slot_words)
+    for code, *slot in session_rows:
+        word, bit = divmod(slot_index[tuple(slot)], 64)
+        session_bits[index[code] * slot_words + word] |= 1 << bit
+
+    codes, text, records = bytearray(), bytearray(), bytearray()
+    for i, (code, category, description) in enumerate(ksbs):
+        code_bytes, description_bytes = code.encode(), (description or '').encode()
+        records += RECORD.pack(len(codes), len(code_bytes), CATEGORIES.index(category),
+                               discover[i], len(text), len(description_bytes))
+        codes += code_bytes
+        text += description_bytes
+
+    out = bytearray(HEADER.pack(MAGIC, VERSION, len(ksbs), module_words, len(slots), slot_words,
+                                db_id.encode('ascii'), generation, standard.encode('ascii'),
+                                len(codes), len(text)))
+    for section in (records, struct.pack(f'<{len(module_bits)}Q', *module_bits),
+                    b''.join(SLOT.pack(*slot) for slot in slots),
+                    struct.pack(f'<{len(session_bits)}Q', *session_bits)):
+        out += bytes(align(len(out)) - len(out))
+        out += section
+    out += codes + text
+    return bytes(out)
+
+
+def save(conn, standard, path):
+    """Write a standard's snapshot to path; returns its size in bytes"""
+    data = build(conn, standard)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Written aside and renamed, so a running command never maps half a file
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return len(data)
@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+"""
+Ulwazi Store
+Data access for the KSB database: one long-lived, tuned connection for
+the CLI and shell, plus a small pool of read-only connections for servers.
+SQL lives here as fixed strings so sqlite3's statement cache can reuse
+the prepared statements.
+"""
+
+import queue
+import random
+import sqlite3
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+import timings
+from cache import ResultCache
+from queries import coverage_query, show_query
+from setup_db import SCHEMA_VERSION, add_timetable
+
+Ksb = namedtuple('Ksb', 'standard code category description')
+ModuleMapping = namedtuple('ModuleMapping', 'standard ksb_code phase module_number')
+SessionMapping = namedtuple('SessionMapping', 'standard ksb_code module_number day_number session_number notes')
+
+# Applied once per connection
+PRAGMAS = [
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+]
+
+# Prepared statements kept per connection (sqlite3 default is 128)
+CACHED_STATEMENTS = 256
+
+# Seconds SQLite waits for another process's write lock before giving up
+BUSY_TIMEOUT = 5.0
+# Attempts at the write lock in transaction(), with jittered backoff between
+WRITE_ATTEMPTS = 4
+RETRY_DELAY = 0.05
+
+
+class SchemaError(Exception):
+    """The database was created by an older setup_db.py"""
+
+
+class DatabaseBusy(Exception):
+    """Another process kept the write lock for longer than transaction() waits"""
+
+
+class StoreConnection(sqlite3.Connection):
+    """Connection owned by a KsbStore
+
+    Commands share it and leave it open; only the store closes it (with
+    shutdown). A stray close() just rolls back anything left uncommitted.
+    """
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def shutdown(self):
+        super().close()
+
+    def execute(self, sql, parameters=()):
+        if timings.active is None:
+            return super().execute(sql, parameters)
+        timings.active.watch(self)
+        return self.cursor(TimedCursor).execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        if timings.active is None:
+            return super().executemany(sql, parameters)
+        timings.active.watch(self)
+        return self.cursor(TimedCursor).executemany(sql, parameters)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor used while timings are on: charges execute and every fetch to its statement"""
+
+    statement = None
+
+    def execute(self, sql, parameters=()):
+        return self.timed(sql, super().execute, sql, parameters)
+
+    def executemany(self, sql, parameters):
+        return self.timed(sql, super().executemany, sql, parameters)
+
+    def timed(self, sql, method, *args):
+        self.statement = timings.active.statement(sql) if timings.active else None
+        if self.statement is None:
+            return method(*args)
+        self.statement.calls += 1
+        timings.active.push('sql')
+        try:
+            method(*args)
+        finally:
+            self.statement.seconds += timings.active.pop()
+        return self
+
+    def fetched(self, method, *args):
+        if self.statement is None or timings.active is None:
+            return method(*args)
+        timings.active.push('sql')
+        try:
+            return method(*args)
+        finally:
+            self.statement.seconds += timings.active.pop()
+
+    def __next__(self):
+        row = self.fetched(super().__next__)
+        if self.statement is not None:
+            self.statement.rows += 1
+        return row
+
+    def fetchone(self):
+        row = self.fetched(super().fetchone)
+        if row is not None and self.statement is not None:
+            self.statement.rows += 1
+        return row
+
+    def fetchall(self):
+        rows = self.fetched(super().fetchall)
+        if self.statement is not None:
+            self.statement.rows += len(rows)
+        return rows
+
+    def fetchmany(self, size=None):
+        rows = self.fetched(super().fetchmany, size or self.arraysize)
+        if self.statement is not None:
+            self.statement.rows += len(rows)
+        return rows
+
+
+def open_connection(path, readonly=False):
+    """Open a tuned connection and check the schema version"""
+    if readonly:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, factory=StoreConnection,
+                               cached_statements=CACHED_STATEMENTS, check_same_thread=False)
+    else:
+        conn = sqlite3.connect(path, factory=StoreConnection, timeout=BUSY_TIMEOUT,
+                               cached_statements=CACHED_STATEMENTS)
+
+    if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+        conn.shutdown()
+        raise SchemaError("Database schema is out of date. Run 'python setup_db.py' to upgrade it.")
+
+    if not readonly:
+        # Readers never block the writer (persists in the database file)
+        conn.execute("PRAGMA journal_mode = WAL")
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class KsbStore:
+    """Typed access to ksbs, module_ksbs and session_ksbs over one connection"""
+
+    def __init__(self, path, cache_path=None):
+        self.path = path
+        self.conn = open_connection(path)
+        self.closed = False
+        # Read-through cache for report queries, saved to cache_path if given
+        self.cache = ResultCache(self.conn, path=cache_path)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.conn.in_transaction:
+            self.conn.rollback()
+        try:
+            self.cache.save()
+        except OSError:
+            pass
+        self.conn.shutdown()
+
+    @contextmanager
+    def transaction(self):
+        """One BEGIN IMMEDIATE transaction, committed unless the block raises
+
+        The write lock is taken before anything is read, so a check and the
+        write it guards see the same data even with other writers running,
+        and the commit can't fail with SQLITE_BUSY part-way. Waiting for the
+        lock is bounded: BUSY_TIMEOUT per attempt, WRITE_ATTEMPTS attempts.
+        """
+        conn = self.conn
+        # Whatever an earlier command left uncommitted is dropped, as close() would
+        if conn.in_transaction:
+            conn.rollback()
+        for attempt in range(WRITE_ATTEMPTS):
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                break
+            except sqlite3.OperationalError as e:
+                if not is_busy_error(e):
+                    raise
+                if attempt == WRITE_ATTEMPTS - 1:
+                    raise DatabaseBusy("The database is busy with another writer; try again") from e
+                time.sleep(RETRY_DELAY * 2 ** attempt * random.uniform(0.5, 1.5))
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+    # Standards and timetable
+
+    def standard_exists(self, standard):
+        return self.conn.execute('''
+            SELECT 1 FROM standards WHERE code = ?
+        ''', (standard,)).fetchone() is not None
+
+    def add_standard(self, standard, title, modules, days, sessions, minutes):
+        """Insert a standard with a modules x days x sessions timetable"""
+        self.conn.execute('''
+            INSERT INTO standards (code, title) VALUES (?, ?)
+        ''', (standard, title))
+        add_timetable(self.conn, standard, modules, days, sessions, minutes)
+
+    def extend_timetable(self, standard, modules, days, sessions, minutes):
+        """Add missing modules, days and sessions; returns the number of sessions added"""
+        count = '''
+            SELECT COUNT(*) FROM sessions WHERE standard = ?
+        '''
+        before = self.conn.execute(count, (standard,)).fetchone()[0]
+        add_timetable(self.conn, standard, modules, days, sessions, minutes)
+        return self.conn.execute(count, (standard,)).fetchone()[0] - before
+
+    def session_grid(self, standard, module_number):
+        """(day_number, session_number) for every session in a module, in order"""
+        return self.conn.execute('''
+            SELECT day_number, session_number FROM sessions
+            WHERE standard = ? AND module_number = ?
+            ORDER BY day_number, session_number
+        ''', (standard, module_number)).fetchall()
+
+    def timetable_slots(self, standard):
+        """Set of (module_number, day_number, session_number) in a standard's timetable"""
+        return set(self.conn.execute('''
+            SELECT module_number, day_number, session_number FROM sessions
+            WHERE standard = ?
+        ''', (standard,)))
+
+    # KSBs
+
+    def ksb_exists(self, standard, code):
+        return self.conn.execute('''
+            SELECT 1 FROM ksbs
+            WHERE standard = ? AND code = ?
+        ''', (standard, code)).fetchone() is not None
+
+    def get_ksb(self, standard, code):
+        row = self.conn.execute('''
+            SELECT standard, code, category, description
+            FROM ksbs
+            WHERE standard = ? AND code = ?
+        ''', (standard, code)).fetchone()
+        return Ksb(*row) if row else None
+
+    def categories(self, standard):
+        """{code: category} for every KSB in a standard"""
+        return dict(self.conn.execute('''
+            SELECT code, category FROM ksbs
+            WHERE standard = ?
+        ''', (standard,)))
+
+    def descriptions(self, standard):
+        """{code: description} for every KSB in a standard"""
+        return dict(self.conn.execute('''
+            SELECT code, description FROM ksbs
+            WHERE standard = ?
+        ''', (standard,)))
+
+    def add_ksbs(self, ksbs):
+        """Insert Ksb rows; returns the number added"""
+        return max(self.conn.executemany('''
+            INSERT INTO ksbs (standard, code, category, description)
+            VALUES (?, ?, ?, ?)
+        ''', ksbs).rowcount, 0)
+
+    def update_descriptions(self, rows):
+        """Update from (standard, code, description) rows; returns the number changed"""
+        return max(self.conn.executemany('''
+            UPDATE ksbs
+            SET description = ?3
+            WHERE standard = ?1 AND code = ?2
+        ''', rows).rowcount, 0)
+
+    # Module mappings
+
+    def module_mapped(self, standard, code, module_number):
+        return self.conn.execute('''
+            SELECT 1 FROM module_ksbs
+            WHERE standard = ? AND ksb_code = ?
+            AND phase = 'Module' AND module_number = ?
+        ''', (standard, code, module_number)).fetchone() is not None
+
+    def module_pairs(self, standard):
+        """Set of (code, module_number) for every Module mapping in a standard"""
+        return set(self.conn.execute('''
+            SELECT ksb_code, module_number FROM module_ksbs
+            WHERE standard = ? AND phase = 'Module'
+        ''', (standard,)))
+
+    def add_module_mappings(self, mappings):
+        """Insert ModuleMapping rows, skipping existing ones; returns the number added"""
+        # NOT EXISTS rather than OR IGNORE: Discover rows have a NULL module_number
+        return max(self.conn.executemany('''
+            INSERT INTO module_ksbs (standard, ksb_code, phase, module_number)
+            SELECT ?1, ?2, ?3, ?4
+            WHERE NOT EXISTS (
+                SELECT 1 FROM module_ksbs
+                WHERE standard = ?1 AND ksb_code = ?2
+                AND phase = ?3 AND module_number IS ?4
+            )
+        ''', mappings).rowcount, 0)
+
+    def remove_module_mapping(self, standard, code, phase, module_number):
+        """Delete one module or Discover mapping; returns True if it existed"""
+        return self.conn.execute('''
+            DELETE FROM module_ksbs
+            WHERE standard = ? AND ksb_code = ? AND phase = ? AND module_number IS ?
+        ''', (standard, code, phase, module_number)).rowcount > 0
+
+    # Session mappings
+
+    def set_session_notes(self, standard, code, module_number, day_number, session_number, notes):
+        """Replace the notes on one session mapping; returns True if it existed"""
+        return self.conn.execute('''
+            UPDATE session_ksbs
+            SET notes = ?
+            WHERE standard = ? AND ksb_code = ?
+            AND module_number = ? AND day_number = ? AND session_number = ?
+        ''', (notes, standard, code, module_number, day_number, session_number)).rowcount > 0
+
+    def remove_session_mapping(self, standard, code, module_number, day_number, session_number):
+        """Delete one session mapping; returns True if it existed"""
+        return self.conn.execute('''
+            DELETE FROM session_ksbs
+            WHERE standard = ? AND ksb_code = ?
+            AND module_number = ? AND day_number = ? AND session_number = ?
+        ''', (standard, code, module_number, day_number, session_number)).rowcount > 0
+
+    def session_slots(self, standard):
+        """(code, module_number, day_number, session_number) for every session mapping"""
+        return self.conn.execute('''
+            SELECT ksb_code, module_number, day_number, session_number
+            FROM session_ksbs
+            WHERE standard = ?
+        ''', (standard,)).fetchall()
+
+    def remove_session_mappings(self, rows):
+        """Delete from (standard, code, module, day, session) rows; returns the number removed"""
+        return max(self.conn.executemany('''
+            DELETE FROM session_ksbs
+            WHERE standard = ? AND ksb_code = ?
+            AND module_number = ? AND day_number = ? AND session_number = ?
+        ''', rows).rowcount, 0)
+
+    def add_session_mappings(self, mappings):
+        """Insert SessionMapping rows, skipping existing ones; returns the number added"""
+        return max(self.conn.executemany('''
+            INSERT OR IGNORE INTO session_ksbs
+                (standard, ksb_code, module_number, day_number, session_number, notes)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', mappings).rowcount, 0)
+
+    # Cohorts, learners and evidence
+
+    def cohorts(self):
+        """{code: standard} for every cohort"""
+        return dict(self.conn.execute('''
+            SELECT code, standard FROM cohorts
+        '''))
+
+    def add_cohort(self, code, standard, title, start_date):
+        self.conn.execute('''
+            INSERT INTO cohorts (code, standard, title, start_date)
+            VALUES (?, ?, ?, ?)
+        ''', (code, standard, title, start_date))
+
+    def learner_standards(self):
+        """{learner id: standard of their cohort} for every learner"""
+        return dict(self.conn.execute('''
+            SELECT l.id, c.standard
+            FROM learners l
+            INNER JOIN cohorts c ON c.code = l.cohort
+        '''))
+
+    def add_learners(self, learners):
+        """Insert (id, name, cohort) rows, updating existing learners; returns the number written"""
+        return max(self.conn.executemany('''
+            INSERT INTO learners (id, name, cohort) VALUES (?, ?, ?)
+            ON CONFLICT (id) DO UPDATE
+            SET name = COALESCE(excluded.name, name), cohort = excluded.cohort
+        ''', learners).rowcount, 0)
+
+    def add_evidence(self, evidence):
+        """Insert (learner, standard, ksb_code, reference, evidenced_on) rows,
+        skipping existing ones; returns the number added"""
+        return max(self.conn.executemany('''
+            INSERT OR IGNORE INTO evidence
+                (learner, standard, ksb_code, reference, evidenced_on)
+            VALUES (?, ?, ?, ?, ?)
+        ''', evidence).rowcount, 0)
+
+
+def is_foreign_key_error(error):
+    """True if an IntegrityError came from a foreign key (not a duplicate)"""
+    return 'FOREIGN KEY' in str(error)
+
+
+def is_busy_error(error):
+    """True if an OperationalError means another connection holds a lock"""
+    # Extended codes (e.g. SQLITE_BUSY_SNAPSHOT) keep the primary code in the low byte
+    code = getattr(error, 'sqlite_errorcode', 0) & 0xff
+    return code in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED) or 'database is locked' in str(error)
+
+
+class ConnectionPool:
+    """A fixed set of read-only connections shared between threads
+
+    With WAL, readers see the last committed state and never block the writer.
+    """
+
+    def __init__(self, path, size=4):
+        self.path = path
+        self.idle = queue.Queue()
+        for _ in range(size):
+            self.idle.put(open_connection(path, readonly=True))
+
+    @contextmanager
+    def connection(self):
+        conn = self.idle.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self.idle.put(conn)
+
+    def close(self):
+        while not self.idle.empty():
+            self.idle.get().shutdown()
+
+
+# Read queries shared by the server (work on any connection)
+
+
+def ksb_detail(conn, standard, code):
+    """A KSB with its module coverage, or None"""
+    row = conn.execute('''
+        SELECT standard, code, category, description
+        FROM ksbs
+        WHERE standard = ? AND code = ?
+    ''', (standard, code)).fetchone()
+    if not row:
+        return None
+
+    ksb = Ksb(*row)._asdict()
+    ksb['covered_in'] = [
+        'Discover' if phase == 'Discover' else f'M{module_number}'
+        for phase, module_number in conn.execute('''
+            SELECT phase, module_number
+            FROM module_ksbs
+            WHERE standard = ? AND ksb_code = ?
+            ORDER BY phase, module_number
+        ''', (standard, code))
+    ]
+    return ksb
+
+
+def show_rows(conn, standard, category=None):
+    """Every KSB in a standard with the list of places it is covered"""
+    return [{'code': code, 'category': category, 'description': description,
+             'covered_in': mappings.split(', ') if mappings else []}
+            for category, code, description, mappings in conn.execute(*show_query(standard, category))]
+
+
+def coverage_rows(conn, standard, module=None, day=None, session=None,
+                  discover=False, category=None):
+    """KSBs covered by Discover, a module, a day or a session (same rules as the CLI)"""
+    query, params = coverage_query(standard, module, day, session, discover, category)
+    return [{'code': code, 'category': category, 'description': description, 'notes': notes}
+            for code, category, description, notes in conn.execute(query, params)]
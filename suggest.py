@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Ulwazi Suggest
+Proposes module and session mappings from a tree of course material
+(Markdown and text files). A file's module, day and session come from
+its path, e.g. module-2/day-1/session-3-pipelines.md or M2/D1/S3.md;
+files with no module in their path are indexed but never suggested.
+
+Files are tokenised on a process pool into material_files and
+material_terms (see migration_10_material_index in setup_db.py). A
+rescan re-reads only files whose mtime or size moved, and re-tokenises
+only those whose content hash changed. KSBs are scored against each
+file through an inverted index of their TF-IDF terms: the share of a
+KSB's (unit-length) weight whose terms appear in the file.
+"""
+
+import hashlib
+import json
+import os
+import re
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from terms import tokenise
+
+MATERIAL_SUFFIXES = ('.md', '.markdown', '.txt')
+
+# Files handed to a worker at a time; fewer changed files than this are
+# tokenised in-process, where starting the pool would cost more
+CHUNK_SIZE = 16
+
+# Location in a path component: m2, module-2, D1, day_1, s3, session 3 ...
+LOCATION_PARTS = [re.compile(rf'(?<![a-z]){name}[ _-]?(\d+)', re.IGNORECASE)
+                  for name in ('m(?:odule)?', 'd(?:ay)?', 's(?:ession)?')]
+
+Suggestion = namedtuple('Suggestion', 'code module day session score path')
+IndexStats = namedtuple('IndexStats', 'files tokenised touched removed')
+
+
+def material_files(root):
+    """Paths of the material files under a resolved root, skipping hidden directories"""
+    files = []
+    for directory, subdirectories, names in os.walk(root):
+        subdirectories[:] = sorted(d for d in subdirectories if not d.startswith('.'))
+        files += [Path(directory, name) for name in sorted(names)
+                  if name.lower().endswith(MATERIAL_SUFFIXES)]
+    return files
+
+
+def location(relative):
+    """(module, day, session) from a path relative to the material root
+
+    Each is None when the path doesn't say; a day needs a module and a
+    session needs a day.
+    """
+    found = [None, None, None]
+    for part in relative.with_suffix('').parts:
+        for i, pattern in enumerate(LOCATION_PARTS):
+            match = pattern.search(part)
+            if match and found[i] is None:
+                found[i] = int(match.group(1))
+    module, day, session = found
+    if module is None:
+        return None, None, None
+    if day is None:
+        return module, None, None
+    return module, day, session
+
+
+def path_range(root):
+    """(low, high) bounds selecting every indexed path under root"""
+    prefix = str(root).rstrip(os.sep) + os.sep
+    return prefix, prefix[:-1] + chr(ord(os.sep) + 1)
+
+
+def index_file(path, known_sha1):
+    """(path, sha1, {term: count}) for one file, or terms None if its content is unchanged
+
+    Runs on the worker processes.
+    """
+    data = Path(path).read_bytes()
+    sha1 = hashlib.sha1(data).hexdigest()
+    if sha1 == known_sha1:
+        return path, sha1, None
+    return path, sha1, dict(tokenise(data.decode('utf-8', errors='replace')))
+
+
+def refresh_index(store, root, jobs):
+    """Bring the index for the material under root up to date; returns IndexStats"""
+    low, high = path_range(root)
+    known = {path: (mtime_ns, size, sha1) for path, mtime_ns, size, sha1 in store.conn.execute('''
+        SELECT path, mtime_ns, size, sha1 FROM material_files
+        WHERE path >= ? AND path < ?
+    ''', (low, high))}
+
+    files = {}
+    for path in material_files(root):
+        info = path.stat()
+        files[str(path)] = (info.st_mtime_ns, info.st_size)
+    stale = [(path, known.get(path, (None, None, None))[2])
+             for path, stamp in files.items() if known.get(path, ())[:2] != stamp]
+
+    # Tokenising happens before the write lock is taken
+    if len(stale) > CHUNK_SIZE and jobs != 1:
+        with ProcessPoolExecutor(jobs) as pool:
+            results = list(pool.map(index_file, *zip(*stale), chunksize=CHUNK_SIZE))
+    else:
+        results = [index_file(path, sha1) for path, sha1 in stale]
+
+    removed = [path for path in known if path not in files]
+    changed = [(path, terms) for path, _, terms in results if terms is not None]
+    with store.transaction() as conn:
+        conn.executemany('''
+            DELETE FROM material_files WHERE path = ?
+        ''', [(path,) for path in removed])
+        conn.executemany('''
+            INSERT INTO material_files (path, mtime_ns, size, sha1) VALUES (?, ?, ?, ?)
+            ON CONFLICT (path) DO UPDATE
+            SET mtime_ns = excluded.mtime_ns, size = excluded.size, sha1 = excluded.sha1
+        ''', [(path, *files[path], sha1) for path, sha1, _ in results])
+        conn.executemany('''
+            DELETE FROM material_terms WHERE path = ?
+        ''', [(path,) for path, _ in changed])
+        conn.executemany('''
+            INSERT INTO material_terms (path, term, count) VALUES (?, ?, ?)
+        ''', [(path, term, count) for path, terms in changed for term, count in terms.items()])
+
+    return IndexStats(len(files), len(changed), len(results) - len(changed), len(removed))
+
+
+def suggestions(conn, root, vectors, threshold, top):
+    """Ranked Suggestions for the material under root
+
+    vectors: unit-length TF-IDF vector per KSB code. Each file proposes
+    its top KSBs scoring at least threshold, for its module and, if its
+    path names one, its session; the best file for a mapping is its evidence.
+    """
+    postings = {}
+    for code, vector in vectors.items():
+        for term, weight in vector.items():
+            postings.setdefault(term, []).append((code, weight * weight))
+
+    # Only terms some KSB uses can score, so the rest never leave SQLite
+    low, high = path_range(root)
+    documents = {}
+    for path, term in conn.execute('''
+        SELECT path, term FROM material_terms
+        WHERE path >= ? AND path < ?
+        AND term IN (SELECT value FROM json_each(?))
+    ''', (low, high, json.dumps(sorted(postings)))):
+        documents.setdefault(path, []).append(term)
+
+    best = {}
+    for path, doc_terms in documents.items():
+        module, day, session = location(Path(path).relative_to(root))
+        if module is None:
+            continue
+
+        scores = {}
+        for term in doc_terms:
+            for code, share in postings.get(term, ()):
+                scores[code] = scores.get(code, 0.0) + share
+        ranked = sorted((s, c) for c, s in scores.items() if s >= threshold)[::-1][:top]
+
+        for score, code in ranked:
+            keys = [(code, module, None, None)]
+            if session is not None:
+                keys.append((code, module, day, session))
+            for key in keys:
+                if key not in best or score > best[key].score:
+                    best[key] = Suggestion(*key, score, path)
+
+    return sorted(best.values(), key=lambda s: (-s.score, s.code, s.module, s.day or 0, s.session or 0))
+
+
+def evidence(path, vector, width, lines):
+    """The line of a file sharing the most weight with a KSB's terms, trimmed
+
+    lines caches each file's lines ({path: [line, ...]}) for a run, since
+    a file is usually the evidence for several suggestions.
+    """
+    if path not in lines:
+        try:
+            lines[path] = Path(path).read_text(errors='replace').splitlines()
+        except OSError:
+            lines[path] = []
+
+    # The KSB's terms as whole words, allowing the plural tokenise() folds away
+    terms = sorted(vector, key=len, reverse=True)
+    pattern = re.compile(rf"(?<![a-z0-9])({'|'.join(map(re.escape, terms))})s?(?![a-z0-9])",
+                         re.IGNORECASE)
+
+    best, best_score = '', 0.0
+    for line in lines[path]:
+        score = sum(vector[term] for term in {m.lower() for m in pattern.findall(line)})
+        if score > best_score:
+            best, best_score = line, score
+    best = ' '.join(best.lstrip('#>*- ').split())
+    return best if len(best) <= width else best[:width - 3] + '...'
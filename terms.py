@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Ulwazi Terms
+Word counts for comparing texts: KSB descriptions with each other
+('ulwazi crosswalk') and with course material ('ulwazi suggest'). Kept
+out of ulwazi.py so worker processes can tokenise without the CLI.
+"""
+
+import re
+from collections import Counter
+
+# Words too common in KSB descriptions to say anything about similarity
+STOPWORDS = frozenset('''
+    a an and are as at be by for from how in including into is it its of on or
+    such that the their them these they this to use used using with within
+'''.split())
+
+WORD = re.compile(r'[a-z][a-z0-9]+')
+
+
+def tokenise(text):
+    """Lower-case word counts with stopwords dropped and plurals folded"""
+    terms = Counter()
+    # Counted first, so each distinct word is folded once however often it appears
+    for word, count in Counter(WORD.findall((text or '').lower())).items():
+        if word in STOPWORDS:
+            continue
+        if len(word) > 4 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        terms[word] += count
+    return terms
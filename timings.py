@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Ulwazi Timings
+Where a command's time goes: start-up, config, connecting, each SQL
+statement (time and rows), sorting and output. Switched on with
+'ulwazi --timings' or ULWAZI_TRACE; costs nothing when off. Each phase
+is exclusive: time spent in a nested phase (e.g. SQL while connecting)
+is only counted once, against the innermost one.
+"""
+
+import json
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+
+# The recorder for the running command, or None when timings are off
+active = None
+
+# SQL shown per statement in the breakdown
+SQL_WIDTH = 70
+
+
+class Statement:
+    """Totals for one SQL text"""
+
+    __slots__ = ('sql', 'calls', 'seconds', 'rows')
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.calls = 0
+        self.seconds = 0.0
+        self.rows = 0
+
+
+class Timings:
+    """Phase and statement times for one command"""
+
+    def __init__(self, command, startup=0.0):
+        self.command = command
+        self.started = time.perf_counter()
+        self.phases = defaultdict(float)
+        if startup:
+            self.phases['startup'] = startup
+        self.stack = []
+        self.statements = {}
+        # Everything SQLite ran, including COMMIT and trigger programs
+        self.traced = Counter()
+        self.connections = []
+
+    def push(self, name):
+        self.stack.append([name, time.perf_counter(), 0.0])
+
+    def pop(self):
+        """End the innermost phase; returns its elapsed time"""
+        name, start, nested = self.stack.pop()
+        elapsed = time.perf_counter() - start
+        self.phases[name] += elapsed - nested
+        if self.stack:
+            self.stack[-1][2] += elapsed
+        return elapsed
+
+    @contextmanager
+    def phase(self, name):
+        self.push(name)
+        try:
+            yield
+        finally:
+            self.pop()
+
+    def statement(self, sql):
+        key = ' '.join(sql.split())
+        statement = self.statements.get(key)
+        if statement is None:
+            statement = self.statements[key] = Statement(key)
+        return statement
+
+    def watch(self, conn):
+        """Count every statement SQLite runs on conn until finish()"""
+        if conn not in self.connections:
+            conn.set_trace_callback(self.trace)
+            self.connections.append(conn)
+
+    def trace(self, sql):
+        self.traced[re.split(r'\s', sql.strip(), maxsplit=1)[0].upper()] += 1
+
+    def finish(self):
+        """Stop recording; returns the record as a dict"""
+        total = time.perf_counter() - self.started + self.phases.get('startup', 0.0)
+        for conn in self.connections:
+            try:
+                conn.set_trace_callback(None)
+            except conn.ProgrammingError:
+                # Already closed
+                pass
+
+        phases = dict(self.phases)
+        phases['other'] = max(total - sum(phases.values()), 0.0)
+        statements = sorted(self.statements.values(), key=lambda s: -s.seconds)
+
+        from datetime import datetime
+        return {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'command': self.command,
+            'total_ms': round(total * 1000, 3),
+            'phases': {name: round(seconds * 1000, 3) for name, seconds in phases.items()},
+            'statements': [{'sql': s.sql, 'calls': s.calls, 'rows': s.rows,
+                            'ms': round(s.seconds * 1000, 3)} for s in statements],
+            'traced': dict(self.traced.most_common()),
+        }
+
+
+def start(command, startup=0.0):
+    global active
+    active = Timings(command, startup)
+    return active
+
+
+def stop():
+    """Finish the running recorder; returns its record, or None if timings are off"""
+    global active
+    if active is None:
+        return None
+    recorder, active = active, None
+    while recorder.stack:
+        recorder.pop()
+    return recorder.finish()
+
+
+def phase(name):
+    """Context manager timing one phase of the running command (no-op when off)"""
+    return active.phase(name) if active else nullcontext()
+
+
+def timed_echo(echo):
+    """Wrap click.echo so output is charged to the 'output' phase"""
+    def wrapper(*args, **kwargs):
+        if active is None:
+            return echo(*args, **kwargs)
+        with active.phase('output'):
+            return echo(*args, **kwargs)
+    wrapper.__wrapped__ = echo
+    return wrapper
+
+
+def format_record(record):
+    """Breakdown of one record as lines of text"""
+    lines = [f"Timings: {record['command']} {record['total_ms']:.2f}ms"]
+    for name, ms in sorted(record['phases'].items(), key=lambda item: -item[1]):
+        lines.append(f"  {name:<10} {ms:>9.2f}ms")
+
+    if record['statements']:
+        lines.append(f"SQL ({sum(s['calls'] for s in record['statements'])} statements):")
+        for s in record['statements']:
+            sql = s['sql'] if len(s['sql']) <= SQL_WIDTH else s['sql'][:SQL_WIDTH - 3] + '...'
+            lines.append(f"  {s['ms']:>9.2f}ms {s['calls']:>4}x {s['rows']:>7} rows  {sql}")
+
+    if record['traced']:
+        lines.append("Traced: " + ', '.join(f"{kind} {count}" for kind, count in record['traced'].items()))
+    return lines
+
+
+def append_log(path, record):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+def read_log(path):
+    """Records from a JSON lines log, skipping any line that doesn't parse"""
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def summarise(records):
+    """{command: {'runs', 'p50', 'p95', 'phases': {name: p50}}} from log records"""
+    by_command = defaultdict(list)
+    for record in records:
+        by_command[record.get('command') or '-'].append(record)
+
+    summary = {}
+    for command, runs in sorted(by_command.items()):
+        totals = sorted(r['total_ms'] for r in runs)
+        phase_times = defaultdict(list)
+        for r in runs:
+            for name, ms in r.get('phases', {}).items():
+                phase_times[name].append(ms)
+        summary[command] = {
+            'runs': len(runs),
+            'p50': percentile(totals, 0.50),
+            'p95': percentile(totals, 0.95),
+            'phases': {name: percentile(sorted(times), 0.50) for name, times in phase_times.items()},
+        }
+    return summary
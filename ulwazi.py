@@ -3,31 +3,72 @@
 Ulwazi - KSB Mapping Tool for Apprenticeship Training
 """
 
+import os
 import re
+import sys
+import cmd
+import time
+import shlex
 import click
-import sqlite3
 import json
+import math
+import itertools
+import timings
 
 from pathlib import Path
-from collections import defaultdict
+from collections import Counter, defaultdict
+from queries import (CATEGORY_RANKS, CATEGORY_STEP, NATURAL_ORDER, coverage_query, hours_query,
+                     show_query)
 
 # Configuration
 CONFIG_DIR = Path.home() / '.ulwazi'
 CONFIG_FILE = CONFIG_DIR / 'config.json'
 DB_FILE = Path('/mnt/ssd/Applications/ulwazi/ulwazi.db')
 
+# Measured from here by --timings ('startup' covers imports and click parsing)
+IMPORTED_AT = time.perf_counter()
+
+# JSON lines written by --timings / ULWAZI_TRACE and read by 'ulwazi stats'
+TIMINGS_LOG = 'timings.jsonl'
+
+# Query cache kept in CONFIG_DIR when 'ulwazi cache --disk' is on
+CACHE_FILE = 'cache.pickle'
+
+# Per-standard snapshots written by 'ulwazi snapshot', under CONFIG_DIR
+SNAPSHOT_DIR = 'snapshots'
+
+# Start-up budget checked by 'ulwazi --startup-profile'
+STARTUP_BUDGET_MS = 250
+STARTUP_RUNS = 5
+STARTUP_PROFILE_TOP = 8
+
+# Importing (rather than running ulwazi.py as a script) lets Python reuse the cached bytecode
+ENTRY_POINT = "import ulwazi; ulwazi.cli(prog_name='ulwazi')"
+
 
 def ensure_config_dir():
     """Ensure config directory exists"""
     CONFIG_DIR.mkdir(exist_ok=True)
 
 
+# State kept alive between commands by 'ulwazi shell'
+shell_state = {'active': False, 'config': None}
+
+
 def load_config():
     """Load current configuration"""
-    if CONFIG_FILE.exists():
-        with open(CONFIG_FILE, 'r') as f:
-            return json.load(f)
-    return {}
+    if shell_state['config'] is not None:
+        return dict(shell_state['config'])
+
+    config = {}
+    with timings.phase('config'):
+        if CONFIG_FILE.exists():
+            with open(CONFIG_FILE, 'r') as f:
+                config = json.load(f)
+
+    if shell_state['active']:
+        shell_state['config'] = config
+    return dict(config)
 
 
 def save_config(config):
@@ -36,6 +77,9 @@ def save_config(config):
     with open(CONFIG_FILE, 'w') as f:
         json.dump(config, f, indent=2)
 
+    if shell_state['active']:
+        shell_state['config'] = dict(config)
+
 
 def get_current_course(course):
     """Get the currently set course"""
@@ -46,23 +90,216 @@ def get_current_course(course):
     return config.get('current_course')
 
 
-def init_database():
-    """Initialise the SQLite database"""
+# One store (and connection) per process, shared by every command and the shell
+store_state = {'store': None}
+
+
+def get_store():
+    """Get the process-wide KsbStore, opening it on first use"""
+    if store_state['store'] is not None:
+        return store_state['store']
+
     if not DB_FILE.exists():
         click.echo("Database not found. Run 'python setup_db.py' first.")
         exit(1)
-    return
+
+    cache_path = CONFIG_DIR / CACHE_FILE if load_config().get('disk_cache') else None
+
+    with timings.phase('connect'):
+        # Imported here so commands that only need the config never load them
+        import atexit
+        from store import KsbStore, SchemaError
+
+        try:
+            store = KsbStore(DB_FILE, cache_path)
+        except SchemaError as e:
+            click.echo(str(e))
+            exit(1)
+
+    atexit.register(store.close)
+    store_state['store'] = store
+    return store
+
+
+def snapshot_path(course_code):
+    return CONFIG_DIR / SNAPSHOT_DIR / f'{course_code}.snap'
+
+
+def load_snapshot(course_code):
+    """The standard's snapshot if there is one and nothing has changed since, else None"""
+    path = snapshot_path(course_code)
+    if not path.exists():
+        return None
+    with timings.phase('snapshot'):
+        import snapshot
+
+        # An open store (e.g. in the shell) already tracks the generation
+        store = store_state['store']
+        stamp = store.cache.current_generation() if store else None
+        return snapshot.load(path, DB_FILE, stamp)
+
+
+def past_state(course_code, as_of):
+    """The course as it was at a local time, rebuilt from the change journal
+
+    Prints an error and returns None if the time doesn't parse.
+    """
+    import history
+
+    try:
+        at = history.journal_time(as_of)
+    except ValueError:
+        click.echo("Error: Times look like 2026-01-31 or 2026-01-31T14:30")
+        return None
+
+    conn = get_db_connection()
+    state, _ = history.state_at(conn, course_code, history.change_id_at(conn, at))
+    return state
 
 
 def get_db_connection():
     """Get database connection with foreign key support"""
-    if not DB_FILE.exists():
-        click.echo("Database not found. Run 'python setup_db.py' first.")
-        exit(1)
-    
-    conn = sqlite3.connect(DB_FILE)
-    conn.execute("PRAGMA foreign_keys = ON")
-    return conn
+    return get_store().conn
+
+
+# Map the first letter of a KSB code to its category
+CATEGORY_PREFIXES = {
+    'K': 'Knowledge',
+    'S': 'Skill',
+    'B': 'Behaviour',
+}
+
+
+def category_from_code(code):
+    """Determine the KSB category from its code (K1 -> Knowledge)"""
+    return CATEGORY_PREFIXES.get(code[:1].upper())
+
+
+# 'K1: Description' or 'K1  Description' (other lines are headings or blank)
+KSB_LINE = re.compile(r'^\s*([KSBksb]\d+)\s*(?::|\s)\s*(\S.*)$')
+
+
+def parse_ksb_file(path, file_format):
+    """Read (code, description) pairs from a text, CSV or JSONL file
+
+    text:  'K1: Description' or 'K1  Description' per line (as in ksb-*.txt)
+    csv:   code,description columns (header row optional)
+    jsonl: {"code": "K1", "description": "..."} per line
+    """
+    import csv
+
+    rows = []
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if file_format == 'csv':
+            for record in csv.reader(f):
+                if len(record) < 2 or record[0].strip().lower() == 'code':
+                    continue
+                rows.append((record[0], record[1]))
+        elif file_format == 'jsonl':
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    raise ValueError(f"line {line_number}: {e}") from None
+                if not isinstance(record, dict):
+                    raise ValueError(f"line {line_number}: expected {{\"code\": ..., \"description\": ...}}")
+                code, description = record.get('code'), record.get('description')
+                if not isinstance(code, str) or not isinstance(description, str):
+                    raise ValueError(f"line {line_number}: code and description must be strings")
+                rows.append((code, description))
+        else:
+            for line in f:
+                match = KSB_LINE.match(line)
+                if match:
+                    rows.append(match.groups())
+
+    return [(code.strip().upper(), description.strip()) for code, description in rows]
+
+
+# Manifest location: Discover, M1 or M1/D2/S3
+MANIFEST_LINE = re.compile(
+    r'^\s*(discover|m(\d+)(?:\s*/\s*d(\d+)\s*/\s*s(\d+))?)\s*:(.*)$', re.IGNORECASE)
+
+
+def parse_mapping_manifest(lines):
+    """Parse a mapping manifest into module and session rows
+
+    Discover: K1 K2
+    M1: K1 K2 K3 S1 B1
+    M1/D2/S3: K1 S1
+
+    Blank lines and text after # are ignored. Returns (module_rows, session_rows)
+    as (code, phase, module_number) and (code, module, day, session) tuples.
+    """
+    module_rows = []
+    session_rows = []
+    for line_number, line in enumerate(lines, 1):
+        line = line.split('#', 1)[0]
+        if not line.strip():
+            continue
+
+        match = MANIFEST_LINE.match(line)
+        if not match:
+            raise ValueError(f"line {line_number}: expected 'Discover:', 'M<n>:' or 'M<n>/D<n>/S<n>:'")
+
+        location, module, day, session, codes = match.groups()
+        codes = [c.upper() for c in codes.replace(',', ' ').split()]
+
+        if location.lower() == 'discover':
+            module_rows += [(code, 'Discover', None) for code in codes]
+        elif day:
+            session_rows += [(code, int(module), int(day), int(session)) for code in codes]
+        else:
+            module_rows += [(code, 'Module', int(module)) for code in codes]
+
+    # Drop repeats within the manifest, keeping the first occurrence
+    return list(dict.fromkeys(module_rows)), list(dict.fromkeys(session_rows))
+
+
+# Plan constraint: 'K1 K2 < S3' (left side taught before right side)
+PREREQUISITE_LINE = re.compile(r'^\s*([^<]+?)\s*<\s*([^<]+?)\s*$')
+
+
+def parse_plan_constraints(lines):
+    """Parse pins and prerequisites for 'ulwazi plan'
+
+    M1/D2/S3: K1 K2     pin K1 and K2 to that session
+    K3 < K4 S1          K3 before K4 and S1 (wherever they share a module)
+
+    Blank lines and text after # are ignored. Returns (pins, prerequisites)
+    as (code, module, day, session) and (before, after) tuples.
+    """
+    pins = []
+    prerequisites = []
+    for line_number, line in enumerate(lines, 1):
+        line = line.split('#', 1)[0]
+        if not line.strip():
+            continue
+
+        match = MANIFEST_LINE.match(line)
+        if match and match.group(3):
+            _, module, day, session, codes = match.groups()
+            pins += [(code.upper(), int(module), int(day), int(session))
+                     for code in codes.replace(',', ' ').split()]
+            continue
+
+        match = PREREQUISITE_LINE.match(line)
+        if not match or ':' in line:
+            raise ValueError(f"line {line_number}: expected 'M<n>/D<n>/S<n>: codes' or 'codes < codes'")
+        before, after = ([c.upper() for c in side.replace(',', ' ').split()] for side in match.groups())
+        prerequisites += [(a, b) for a in before for b in after if a != b]
+
+    return list(dict.fromkeys(pins)), list(dict.fromkeys(prerequisites))
+
+
+# Output formats for show and coverage (see render.py)
+OUTPUT_FORMATS = ['text', 'markdown', 'html', 'csv']
+
+# What 'ulwazi report' can write per standard, and what it writes by default
+REPORT_LEVELS = ['show', 'discover', 'module', 'day', 'session']
+DEFAULT_REPORT_LEVELS = ('show', 'discover', 'module', 'day')
 
 
 # Display grouped by category with natural sorting
@@ -72,30 +309,143 @@ def natural_sort_key(code):
     return int(match.group()) if match else 0
 
 
-# Sort by category first, then by natural number within category
-def full_sort_key(code, ksb_data):
-    """Sort by category first, then by natural number within category"""
-    category = ksb_data[code]['category']
-    return (category, natural_sort_key(code))
+def ksb_sort_key(category, code):
+    """ksbs.sort_key computed in Python, for rows that don't come from SQL"""
+    number = re.match(r'\d*', code[1:]).group()
+    return CATEGORY_RANKS.get(category, 0) * CATEGORY_STEP + int(number or 0)
+
+
+def page_start(after):
+    """(sort_key, code) that a page given --after CODE starts after"""
+    code = after.upper()
+    return ksb_sort_key(category_from_code(code), code), code
+
+
+def first_ksbs(rows, limit, code_at=0):
+    """The rows of the first `limit` KSBs in an ordered listing (all if limit is None)
+
+    A KSB can have several adjacent rows (one per session). Reading stops
+    at the next KSB, so a cursor is only stepped as far as the page.
+    """
+    if not limit:
+        yield from rows
+        return
+    count, last = 0, None
+    for row in rows:
+        if row[code_at] != last:
+            if count == limit:
+                return
+            count, last = count + 1, row[code_at]
+        yield row
+
+
+def startup_profile(ctx, param, value):
+    """Report where CLI start-up time goes and check it against the budget"""
+    if not value or ctx.resilient_parsing:
+        return
+
+    import subprocess
+    import statistics
+
+    script = Path(__file__).resolve()
+
+    # Import cost of each module ulwazi pulls in directly
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ulwazi'],
+        cwd=script.parent, capture_output=True, text=True)
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports.append((name.rstrip(), int(self_us), int(cumulative_us)))
+
+    total = next((cumulative for name, _, cumulative in imports if name.strip() == 'ulwazi'), 0)
+    # Names are indented two spaces per nesting level after one leading space
+    direct = sorted((i for i in imports if len(i[0]) - len(i[0].lstrip()) == 3),
+                    key=lambda i: i[2], reverse=True)
+
+    click.echo(f"\nImport time: {total / 1000:.1f} ms (python -X importtime -c 'import ulwazi')\n")
+    for name, self_us, cumulative_us in direct[:STARTUP_PROFILE_TOP]:
+        click.echo(f"  {name.strip():<20} {cumulative_us / 1000:>7.1f} ms")
+    own = next((self_us for name, self_us, _ in imports if name.strip() == 'ulwazi'), 0)
+    click.echo(f"  {'(ulwazi module body)':<20} {own / 1000:>7.1f} ms")
+
+    # Cold start of a config-only command through the bin/ulwazi.sh entry point
+    cold_starts = []
+    for _ in range(STARTUP_RUNS):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', ENTRY_POINT, '--version'],
+                       cwd=script.parent, capture_output=True)
+        cold_starts.append((time.perf_counter() - start) * 1000)
+
+    median = statistics.median(cold_starts)
+    click.echo(f"\nCold start: {median:.1f} ms median of {STARTUP_RUNS} runs "
+               f"(budget {STARTUP_BUDGET_MS} ms)\n")
+
+    if median > STARTUP_BUDGET_MS:
+        click.echo("Error: Cold start is over budget")
+        ctx.exit(1)
+    ctx.exit()
+
+
+def start_timings(ctx, show_breakdown):
+    """Record this command's phases and SQL; report and log them when it ends"""
+    # Start-up only means something for the first command in the process
+    startup = 0.0 if shell_state['active'] else time.perf_counter() - IMPORTED_AT
+    timings.start(ctx.invoked_subcommand, startup)
+
+    if not hasattr(click.echo, '__wrapped__'):
+        click.echo = timings.timed_echo(click.echo)
+
+    def finish():
+        record = timings.stop()
+        if record is None:
+            return
+        if show_breakdown:
+            for line in timings.format_record(record):
+                click.echo(line, err=True)
+        try:
+            timings.append_log(CONFIG_DIR / TIMINGS_LOG, record)
+        except OSError as e:
+            click.echo(f"Error: Could not write the timings log: {e}", err=True)
+
+    ctx.call_on_close(finish)
 
 
 @click.group()
 @click.version_option(version='0.1.1')
-def cli():
-    """Ulwazi - KSB Mapping Tool"""
-    init_database()
+@click.option('--startup-profile', is_flag=True, expose_value=False, is_eager=True,
+              callback=startup_profile, help='Report where start-up time goes and exit')
+@click.option('--timings', 'show_timings', is_flag=True,
+              help='Print where the time went (phases and SQL) and log it for ulwazi stats')
+@click.pass_context
+def cli(ctx, show_timings):
+    """Ulwazi - KSB Mapping Tool
+
+    ULWAZI_TRACE=1 in the environment works like --timings;
+    ULWAZI_TRACE=log only writes the log.
+    """
+    trace = os.environ.get('ULWAZI_TRACE', '').lower()
+    if trace in ('', '0'):
+        trace = None
+    # The shell times each command run inside it instead of the whole session
+    if (show_timings or trace) and ctx.invoked_subcommand not in (None, 'stats', 'shell'):
+        start_timings(ctx, show_timings or trace != 'log')
 
 
 @cli.command()
 @click.argument('course_code')
 def course(course_code):
-    """Set the current working course (DE5 or DA4)"""
+    """Set the current working course (any standard, e.g. DE5 or DA4)"""
     course_code = course_code.upper().strip()
-    
-    if course_code not in ['DE5', 'DA4', 'TEST']:
-        click.echo("Course must be DE5 or DA4")
+
+    if not get_store().standard_exists(course_code):
+        click.echo(f"Error: {course_code} is not a standard")
+        click.echo(f"Add it first with: ulwazi standard {course_code} --add 'Title'")
         return
-    
+
     config = load_config()
     config['current_course'] = course_code
     save_config(config)
@@ -114,35 +464,241 @@ def current():
     click.echo(f"Currently working on: {course_code}")
 
 
+def format_hours(minutes):
+    return f"{(minutes or 0) / 60:g}h"
+
+
+def parse_date(value):
+    """An ISO date (YYYY-MM-DD) as given, or None for '' (clears it)"""
+    from datetime import date
+
+    if value:
+        date.fromisoformat(value)
+    return value or None
+
+
 @cli.command()
-@click.argument('code')
-@click.option('--course', help='Course code (Uses current course if not specified)')
-@click.option('--add', 'description', help='Add a new KSB with description')
-@click.option('--update', help='Update KSB description')
-@click.option('--remove', is_flag=True, help='Remove KSB (and all mappings)')
-def ksb(code, course, description, update, remove):
-    """Manage KSBs (view, add, update, remove)"""
-    course_code = get_current_course(course)
+@click.argument('code', required=False)
+@click.option('--add', 'title', help='Add a new standard with this title')
+@click.option('--title', 'new_title', help='Rename the standard, module (-m) or session (-m -d -s)')
+@click.option('-m', '--module', type=int, help='Module number')
+@click.option('-d', '--day', type=int, help='Day number')
+@click.option('-s', '--session', type=int, help='Session number')
+@click.option('--start', help="Module start date (YYYY-MM-DD, '' to clear)")
+@click.option('--date', 'day_date', help="Day date (YYYY-MM-DD, '' to clear)")
+@click.option('--minutes', type=int, help='Session length (every session matching -m/-d/-s)')
+@click.option('--modules', type=int, help='Modules in the timetable (Default: 7)')
+@click.option('--days', type=int, help='Days per module (Default: 5)')
+@click.option('--sessions', type=int, help='Sessions per day (Default: 4)')
+def standard(code, title, new_title, module, day, session, start, day_date, minutes,
+             modules, days, sessions):
+    """List standards, or show, add and edit one's timetable
+
+    \b
+      ulwazi standard                           every standard
+      ulwazi standard DE5                       its modules (-m N for days and sessions)
+      ulwazi standard XY4 --add 'Title'         new standard, 7 modules x 5 days x 4 sessions
+      ulwazi standard DE5 --modules 8           add missing modules, days or sessions
+      ulwazi standard DE5 -m 2 --start 2026-03-02 --title 'Pipelines'
+      ulwazi standard DE5 -m 2 -d 1 -s 3 --minutes 60
+    """
+    from setup_db import DEFAULT_DAYS, DEFAULT_MODULES, DEFAULT_SESSION_MINUTES, DEFAULT_SESSIONS
+    from store import DatabaseBusy
+
+    store = get_store()
+    conn = store.conn
+
+    if not code:
+        rows = conn.execute('''
+            SELECT s.code, s.title,
+                (SELECT COUNT(*) FROM modules m WHERE m.standard = s.code),
+                (SELECT COUNT(*) FROM sessions se WHERE se.standard = s.code),
+                (SELECT SUM(minutes) FROM sessions se WHERE se.standard = s.code),
+                (SELECT COUNT(*) FROM ksbs k WHERE k.standard = s.code)
+            FROM standards s
+            ORDER BY s.code
+        ''').fetchall()
+        if not rows:
+            click.echo("No standards yet. Add one with: ulwazi standard <CODE> --add 'Title'")
+            return
+        click.echo()
+        for standard_code, standard_title, module_count, session_count, total, ksb_count in rows:
+            click.echo(f"  {standard_code:<6} {standard_title or '':<40} {module_count} modules, "
+                       f"{session_count} sessions, {format_hours(total)}, {ksb_count} KSBs")
+        click.echo()
+        return
 
-    if not course_code:
-        click.echo("No current course set. Use 'ulwazi course <DE5|DA4>' first.")
+    code = code.upper().strip()
+    if not re.fullmatch(r'[A-Z0-9]+', code):
+        click.echo("Error: Standard codes are letters and digits (e.g. DE5)")
         return
 
-    code = code.upper()
+    for name, value in (('--modules', modules), ('--days', days), ('--sessions', sessions)):
+        if value is not None and value < 1:
+            click.echo(f"Error: {name} must be at least 1")
+            return
+    if minutes is not None and minutes < 0:
+        click.echo("Error: --minutes can't be negative")
+        return
+    try:
+        if start is not None:
+            start = parse_date(start)
+        if day_date is not None:
+            day_date = parse_date(day_date)
+    except ValueError as e:
+        click.echo(f"Error: {e}")
+        return
 
-    # Determine category from code
-    if code.startswith('K'):
-        category = 'Knowledge'
-    elif code.startswith('S'):
-        category = 'Skill'
-    elif code.startswith('B'):
-        category = 'Behaviour'
-    else:
-        click.echo("KSB code must start with K, S, or B")
+    shape = (modules or DEFAULT_MODULES, days or DEFAULT_DAYS, sessions or DEFAULT_SESSIONS)
+
+    # Add a new standard
+    if title:
+        try:
+            # Checked under the write lock, so two adds of one code can't both pass
+            with store.transaction():
+                exists = store.standard_exists(code)
+                if not exists:
+                    store.add_standard(code, title, *shape, minutes or DEFAULT_SESSION_MINUTES)
+        except DatabaseBusy as e:
+            click.echo(f"Error: {e}")
+            return
+        if exists:
+            click.echo(f"Error: {code} already exists")
+            return
+        click.echo(f"Standard: Added {code} ({shape[0]} modules x {shape[1]} days x {shape[2]} sessions)")
         return
 
-    conn = get_db_connection()
+    if not store.standard_exists(code):
+        click.echo(f"Error: {code} is not a standard")
+        click.echo(f"Add it with: ulwazi standard {code} --add 'Title'")
+        return
+
+    if session and not day or day and not module:
+        click.echo("Error: -s/--session requires -d/--day, and -d/--day requires -m/--module")
+        return
+
+    # Grow the timetable
+    if modules or days or sessions:
+        try:
+            with store.transaction():
+                current_shape = conn.execute('''
+                    SELECT MAX(module_number), MAX(day_number), MAX(session_number)
+                    FROM sessions WHERE standard = ?
+                ''', (code,)).fetchone()
+                shape = tuple(new or old or default for new, old, default in zip(
+                    (modules, days, sessions), current_shape,
+                    (DEFAULT_MODULES, DEFAULT_DAYS, DEFAULT_SESSIONS)))
+                added = store.extend_timetable(code, *shape, minutes or DEFAULT_SESSION_MINUTES)
+        except DatabaseBusy as e:
+            click.echo(f"Error: {e}")
+            return
+        click.echo(f"Standard: {code} ~ {added} sessions added")
+        return
+
+    # Edit titles, dates and lengths
+    if new_title is not None or start is not None or day_date is not None or minutes is not None:
+        # Matches every session (or module, or day) under the -m/-d/-s given
+        where, params = 'standard = ?', [code]
+        for column, value in (('module_number', module), ('day_number', day),
+                              ('session_number', session)):
+            if value:
+                where += f' AND {column} = ?'
+                params.append(value)
+
+        if start is not None and (not module or day):
+            click.echo("Error: --start is a module's start date (use -m only)")
+            return
+        if day_date is not None and (not day or session):
+            click.echo("Error: --date is a day's date (use -m and -d only)")
+            return
+        if new_title is not None and day and not session:
+            click.echo("Error: Days have a --date, not a --title")
+            return
+
+        changed = 0
+        try:
+            with store.transaction():
+                if new_title is not None and not module:
+                    changed += conn.execute('''
+                        UPDATE standards SET title = ? WHERE code = ?
+                    ''', (new_title or None, code)).rowcount
+                elif new_title is not None:
+                    table = 'sessions' if session else 'modules'
+                    changed += conn.execute(f'''
+                        UPDATE {table} SET title = ? WHERE {where}
+                    ''', [new_title or None, *params]).rowcount
+                if start is not None:
+                    changed += conn.execute(f'''
+                        UPDATE modules SET start_date = ? WHERE {where}
+                    ''', [start, *params]).rowcount
+                if day_date is not None:
+                    changed += conn.execute(f'''
+                        UPDATE days SET date = ? WHERE {where}
+                    ''', [day_date, *params]).rowcount
+                if minutes is not None:
+                    changed += conn.execute(f'''
+                        UPDATE sessions SET minutes = ? WHERE {where}
+                    ''', [minutes, *params]).rowcount
+        except DatabaseBusy as e:
+            click.echo(f"Error: {e}")
+            return
+
+        location = '/'.join(f'{p}{n}' for p, n in (('M', module), ('D', day), ('S', session)) if n)
+        if not changed:
+            click.echo(f"Error: {code} has no {location}")
+        else:
+            click.echo(f"Standard: Updated {code} {location}".rstrip())
+        return
+
+    # View the timetable (default behaviour)
+    standard_title = conn.execute('''
+        SELECT title FROM standards WHERE code = ?
+    ''', (code,)).fetchone()[0]
+    click.echo(f"\nStandard: {code}" + (f" - {standard_title}" if standard_title else ''))
+
+    if not module:
+        rows = conn.execute('''
+            SELECT m.module_number, m.title, m.start_date,
+                COUNT(DISTINCT se.day_number), COUNT(se.session_number), SUM(se.minutes)
+            FROM modules m
+            LEFT OUTER JOIN sessions se
+                ON se.standard = m.standard AND se.module_number = m.module_number
+            WHERE m.standard = ?
+            GROUP BY m.module_number
+            ORDER BY m.module_number
+        ''', (code,)).fetchall()
+        click.echo()
+        for number, module_title, start_date, day_count, session_count, total in rows:
+            starts = f" (starts {start_date})" if start_date else ''
+            click.echo(f"  M{number}{starts}: {module_title or ''}".rstrip())
+            click.echo(f"      {day_count} days, {session_count} sessions, {format_hours(total)}")
+        click.echo()
+        return
+
+    rows = conn.execute('''
+        SELECT d.day_number, d.date, se.session_number, se.title, se.minutes
+        FROM days d
+        INNER JOIN sessions se
+            ON se.standard = d.standard AND se.module_number = d.module_number
+            AND se.day_number = d.day_number
+        WHERE d.standard = ? AND d.module_number = ?
+        ORDER BY d.day_number, se.session_number
+    ''', (code, module)).fetchall()
+    if not rows:
+        click.echo(f"Error: {code} has no M{module}")
+        return
+
+    current_day = None
+    for day_number, date, session_number, session_title, session_minutes in rows:
+        if day_number != current_day:
+            current_day = day_number
+            click.echo(f"\nM{module}/D{day_number}" + (f" ({date})" if date else '') + ":")
+        click.echo(f"  S{session_number}: {session_minutes}min  {session_title or ''}".rstrip())
+    click.echo()
 
+
+def edit_ksb(conn, course_code, code, category, description, update, remove):
+    """Add, update or remove one KSB (inside a transaction)"""
     # Add new KSB
     if description:
         try:
@@ -150,12 +706,15 @@ def ksb(code, course, description, update, remove):
                 INSERT INTO ksbs (standard, code, category, description)
                 VALUES (?, ?, ?, ?)
             ''', (course_code, code, category, description))
-            conn.commit()
             click.echo(f"KSB: Added {code} ({category}) to {course_code}")
-        except sqlite3.IntegrityError:
-            click.echo(f"Error: {code} already exists in {course_code}")
-            click.echo("Use --update to modify it")
-        conn.close()
+        except conn.IntegrityError as e:
+            from store import is_foreign_key_error
+            if is_foreign_key_error(e):
+                click.echo(f"Error: {course_code} is not a standard")
+                click.echo(f"Add it first with: ulwazi standard {course_code} --add 'Title'")
+            else:
+                click.echo(f"Error: {code} already exists in {course_code}")
+                click.echo("Use --update to modify it")
         return
 
     # Update existing KSB
@@ -169,9 +728,7 @@ def ksb(code, course, description, update, remove):
         if result.rowcount == 0:
             click.echo(f"Error: {code} not found in {course_code}")
         else:
-            conn.commit()
             click.echo(f"KSB: Updated {code} description")
-        conn.close()
         return
 
     # Remove KSB
@@ -184,11 +741,44 @@ def ksb(code, course, description, update, remove):
         if result.rowcount == 0:
             click.echo(f"Error: {code} not found in {course_code}")
         else:
-            conn.commit()
             click.echo(f"KSB: Removed {code} (and all mappings)")
-        conn.close()
+
+
+@cli.command()
+@click.argument('code')
+@click.option('--course', help='Course code (Uses current course if not specified)')
+@click.option('--add', 'description', help='Add a new KSB with description')
+@click.option('--update', help='Update KSB description')
+@click.option('--remove', is_flag=True, help='Remove KSB (and all mappings)')
+def ksb(code, course, description, update, remove):
+    """Manage KSBs (view, add, update, remove)"""
+    course_code = get_current_course(course)
+
+    if not course_code:
+        click.echo("No current course set. Use 'ulwazi course <DE5|DA4>' first.")
         return
 
+    code = code.upper()
+
+    # Determine category from code
+    category = category_from_code(code)
+    if not category:
+        click.echo("KSB code must start with K, S, or B")
+        return
+
+    if description or update or remove:
+        store = get_store()
+        from store import DatabaseBusy
+
+        try:
+            with store.transaction() as conn:
+                edit_ksb(conn, course_code, code, category, description, update, remove)
+        except DatabaseBusy as e:
+            click.echo(f"Error: {e}")
+        return
+
+    conn = get_db_connection()
+
     # View KSB (default behaviour)
     result = conn.execute('''
         SELECT code, category, description
@@ -198,7 +788,6 @@ def ksb(code, course, description, update, remove):
 
     if not result:
         click.echo(f"KSB: {code} not found in {course_code}")
-        conn.close()
         return
 
     code, category, desc = result
@@ -225,8 +814,100 @@ def ksb(code, course, description, update, remove):
         click.echo(f"\nCovered in: {' / '.join(locations)}")
     
     click.echo()
-    
-    conn.close()
+
+
+def compare_ksbs(existing, records):
+    """(added codes, changed codes, unchanged count) of records {code: (category, description)}
+    against existing {code: description}"""
+    added = [code for code in records if code not in existing]
+    changed = [code for code in records
+               if code in existing and existing[code] != records[code][1]]
+    return added, changed, len(records) - len(added) - len(changed)
+
+
+@cli.command('import')
+@click.argument('filename', type=click.Path(exists=True, dir_okay=False))
+@click.option('--course', help='Course code (Uses current course if not specified)')
+@click.option('--format', 'file_format', type=click.Choice(['text', 'csv', 'jsonl']),
+              help='File format (Default: from the file extension)')
+@click.option('--upsert', is_flag=True, help='Update descriptions of existing KSBs')
+@click.option('--dry-run', is_flag=True, help='Show the changes without writing them')
+def import_ksbs(filename, course, file_format, upsert, dry_run):
+    """Load a whole standard from a file (e.g. ksb-de5.txt)"""
+    course_code = get_current_course(course)
+
+    if not course_code:
+        click.echo("No current course set. Use 'ulwazi course <DE5|DA4>' first.")
+        return
+
+    if not file_format:
+        file_format = {
+            '.csv': 'csv',
+            '.jsonl': 'jsonl',
+        }.get(Path(filename).suffix.lower(), 'text')
+
+    try:
+        rows = parse_ksb_file(filename, file_format)
+    except ValueError as e:
+        click.echo(f"Error: Could not parse {filename} ({e})")
+        return
+
+    # Validate every code before touching the database
+    records = {}
+    for code, description in rows:
+        category = category_from_code(code)
+        if not category:
+            click.echo(f"Error: {code} - KSB code must start with K, S, or B")
+            return
+        records[code] = (category, description)
+
+    if not records:
+        click.echo(f"Import: No KSBs found in {filename}")
+        return
+
+    store = get_store()
+
+    if dry_run:
+        # The same error the real run would give
+        if not store.standard_exists(course_code):
+            click.echo(f"Error: {course_code} is not a standard")
+            click.echo(f"Add it first with: ulwazi standard {course_code} --add 'Title'")
+            return
+
+        existing = store.descriptions(course_code)
+        added, changed, unchanged = compare_ksbs(existing, records)
+        click.echo(f"\nCourse: {course_code} (dry run)\n")
+        for code in added:
+            click.echo(f"  + {code}: {records[code][1]}")
+        for code in changed:
+            click.echo(f"  - {code}: {existing[code]}")
+            click.echo(f"  + {code}: {records[code][1]}")
+        click.echo()
+
+    else:
+        from store import DatabaseBusy
+
+        try:
+            # One transaction for the whole file, with the comparison it writes from
+            with store.transaction():
+                if not store.standard_exists(course_code):
+                    click.echo(f"Error: {course_code} is not a standard")
+                    click.echo(f"Add it first with: ulwazi standard {course_code} --add 'Title'")
+                    return
+
+                added, changed, unchanged = compare_ksbs(store.descriptions(course_code), records)
+                store.add_ksbs([(course_code, code, *records[code]) for code in added])
+                if upsert:
+                    store.update_descriptions(
+                        [(course_code, code, records[code][1]) for code in changed])
+        except DatabaseBusy as e:
+            click.echo(f"Error: {e}")
+            return
+
+    updated = len(changed) if upsert else 0
+    click.echo(f"Import: {course_code} ~ {len(added)} added, {updated} updated, {unchanged} unchanged")
+    if changed and not upsert:
+        click.echo(f"{len(changed)} existing KSBs differ. Use --upsert to update them")
 
 
 @cli.command()
@@ -234,134 +915,167 @@ def ksb(code, course, description, update, remove):
 @click.option('--ksb', help='Filter by category (k/s/b)')
 @click.option('--desc', 'show_desc', is_flag=True, help='Show KSB description')
 @click.option('-t', '--trim', default=500, help='Trim the description to this length')
-def show(course, ksb, show_desc, trim):
+@click.option('--format', 'output_format', type=click.Choice(OUTPUT_FORMATS), default='text',
+              help='Output format')
+@click.option('--as-of', 'as_of', help='As the course was then, from the change journal (e.g. 2026-01-31)')
+@click.option('-n', '--limit', type=int, help='Show this many KSBs (a page)')
+@click.option('--after', help='Start after this KSB (the last one of the previous page)')
+def show(course, ksb, show_desc, trim, output_format, as_of, limit, after):
     """Show all KSBs for current course"""
     course_code = get_current_course(course)
-    
+
     if not course_code:
         click.echo("No current course set. Use 'ulwazi course <DE5|DA4>' first.")
         return
-    
-    conn = get_db_connection()
-    
-    # Build query with LEFT JOIN to get module mappings
-    query = '''
-        SELECT k.code, k.category, k.description, m.phase, m.module_number
-        FROM ksbs k
-        LEFT OUTER JOIN module_ksbs m 
-            ON k.standard = m.standard AND k.code = m.ksb_code
-        WHERE k.standard = ?
-    '''
-    params = [course_code]
 
-    # Build query based on filter
-    category = ''
+    category = None
     if ksb:
         category = {
             'k': 'Knowledge',
-            's': 'Skill', 
+            's': 'Skill',
             'b': 'Behaviour'
         }.get(ksb.lower())
-        
+
         if not category:
             click.echo("Use --ksb k, --ksb s, or --ksb b")
             return
- 
-        query += ' AND k.category = ?'
-        params.append(category)
-    
-    query += ' ORDER BY k.category, k.code, m.phase, m.module_number'
-    
-    results = conn.execute(query, params).fetchall()
-    conn.close()
-    
-    if not results:
-        click.echo(f"List: No {category} KSBs found for {course_code}")
+
+    if after and not category_from_code(after):
+        click.echo("Error: --after takes a KSB code (e.g. K12)")
         return
-    
-    click.echo(f"\nCourse: {course_code}")
-    
-    # Group results by code
-    ksb_data = defaultdict(lambda: {'category': None, 'mappings': []})
-    
-    for code, category, description, phase, module_number in results:
-        ksb_data[code]['category'] = category
-        ksb_data[code]['description'] = description
-        if phase:  # Only add if there's a mapping
-            if phase == 'Discover':
-                ksb_data[code]['mappings'].append('Discover')
-            else:
-                ksb_data[code]['mappings'].append(f'M{module_number}')
-    
-    # Display grouped by category
-    current_category = None
-    for code in sorted(ksb_data.keys(), key=lambda c: full_sort_key(c, ksb_data)):
-        category = ksb_data[code]['category']
-        description = ksb_data[code]['description']
-        mappings = ksb_data[code]['mappings']
-        
-        if category != current_category:
-            click.echo(f"\n{category}:")
-            current_category = category
-        
-        if mappings:
-            click.echo(f"  {code:<3} - {', '.join(mappings)}")
-            if show_desc: click.echo(f"        {description[:trim]}\n")
-        else:
-            click.echo(f"  {code:<3} ~ {description[:trim]}")
 
-    click.echo()
+    past = None
+    if as_of:
+        past = past_state(course_code, as_of)
+        if past is None:
+            return
 
+    rows = iter(show_rows(course_code, category, trim, past, limit, after))
+    first = next(rows, None)
+    if first is None:
+        # On stderr for the other formats, so a file they're written to stays empty
+        click.echo(f"List: No {f'{category} ' if category else ''}KSBs found for {course_code}",
+                   err=output_format != 'text')
+        return
+    rows = itertools.chain([first], rows)
 
-@cli.command()
-@click.argument('code')
-@click.option('--course', help='Course code (Uses current course if not specified)')
-@click.option('-m', '--module', type=int, help='Module number (1-7)')
-@click.option('--discover', is_flag=True, help='Map to Discover phase')
-@click.option('--remove', is_flag=True, help='Remove this mapping')
-def map(code, course, module, discover, remove):
-    """Map a KSB to a module or Discover phase"""
-    course_code = get_current_course(course)
+    if output_format != 'text':
+        from render import render
 
-    if not course_code:
-        click.echo("No current course set. Use 'ulwazi course <DE5|DA4>' first.")
+        render(output_format, click.echo, f"Course: {course_code}",
+               ['Code', 'Description', 'Covered in'], rows, group_labels=('Category',))
         return
 
-    code = code.upper()
+    from render import show_text
 
-    # Validate: must specify either module or discover (not both)
-    if module and discover:
-        click.echo("Error: Specify either --module or --discover, not both")
-        return
+    # Rows arrive in order, one per KSB, so they print as they come
+    shown, last = show_text(click.echo, f"Course: {course_code}", rows, show_desc)
 
-    if not module and not discover:
-        click.echo("Error: Specify either --module <N> or --discover")
-        return
+    if limit and shown == limit:
+        click.echo(f"\nNext page: --after {last}")
+    click.echo()
 
-    # Determine phase and module_number
-    if discover:
-        phase = 'Discover'
-        module_number = None
+
+def show_rows(course_code, category, trim, past=None, limit=None, after=None):
+    """(category, code, description, 'Discover, M1, ...' or None) per KSB, in order
+
+    From the change journal for past, else the standard's snapshot if it
+    is fresh, else SQL. A page (limit, after) is read straight off the
+    ksbs_sort index, so its cost doesn't grow with the standard.
+    """
+    start = page_start(after) if after else None
+
+    snap = None if past else load_snapshot(course_code)
+    if past:
+        from history import location
+
+        found = {}
+        for code, ksb_category, description, phase, module in past.show_rows(category):
+            row = found.setdefault(code, (ksb_category, code, (description or '')[:trim], []))
+            if phase:
+                row[3].append(location(phase, module))
+        rows = [(*row[:3], ', '.join(row[3]) or None)
+                for row in sorted(found.values(), key=lambda r: (ksb_sort_key(r[0], r[1]), r[1]))]
+    elif snap:
+        rows = snap.show_rendered_rows(trim, category)
     else:
-        phase = 'Module'
-        module_number = module
+        rows = get_store().cache.rows(*show_query(course_code, category, start, limit))
+        return ((ksb_category, code, description and description[:trim], locations)
+                for ksb_category, code, description, locations in rows)
 
-    conn = get_db_connection()
+    if start:
+        rows = (row for row in rows if (ksb_sort_key(row[0], row[1]), row[1]) > start)
+    return first_ksbs(rows, limit, 1)
 
-    # Check KSB exists
-    exists = conn.execute('''
-        SELECT 1 FROM ksbs
-        WHERE standard = ? AND code = ?
-    ''', (course_code, code)).fetchone()
 
-    if not exists:
-        click.echo(f"Error: {code} not found in {course_code}")
-        click.echo(f"Add it first with: ulwazi ksb {code} --add 'Description'")
-        conn.close()
+def map_from_manifest(course_code, manifest):
+    """Apply a mapping manifest in a single transaction"""
+    try:
+        module_rows, session_rows = parse_mapping_manifest(manifest)
+    except ValueError as e:
+        click.echo(f"Error: {manifest.name} {e}")
         return
 
-    # Remove mapping
-    if remove:
+    store = get_store()
+    from store import DatabaseBusy, is_foreign_key_error
+
+    try:
+        # The checks run inside the transaction so no other writer can change what they saw
+        with store.transaction():
+            # One set-based existence check for every code in the manifest
+            known = set(store.descriptions(course_code))
+
+            referenced = {row[0] for row in module_rows + session_rows}
+            unknown = sorted(referenced - known, key=lambda c: (c[:1], natural_sort_key(c)))
+            module_rows = [row for row in module_rows if row[0] in known]
+            session_rows = [row for row in session_rows if row[0] in known]
+
+            added_modules = store.add_module_mappings(
+                [(course_code, *row) for row in module_rows])
+
+            # Sessions need the KSB mapped to the module (including rows added above)
+            mapped = store.module_pairs(course_code)
+            unmapped = [row for row in session_rows if (row[0], row[1]) not in mapped]
+            session_rows = [row for row in session_rows if (row[0], row[1]) in mapped]
+
+            added_sessions = store.add_session_mappings(
+                [(course_code, *row, '') for row in session_rows])
+    except DatabaseBusy as e:
+        click.echo(f"Error: {e}")
+        return
+    except store.conn.IntegrityError as e:
+        if not is_foreign_key_error(e):
+            raise
+        # The timetable rejected a module or session; nothing was written
+        click.echo(f"Error: {manifest.name} maps to modules or sessions {course_code} doesn't have")
+        click.echo(f"See the timetable with: ulwazi standard {course_code}")
+        return
+
+    for code in unknown:
+        click.echo(f"Error: {code} not found in {course_code}")
+    for code, module, day, session in unmapped:
+        click.echo(f"Error: {code} not mapped to M{module} (skipped M{module}/D{day}/S{session})")
+
+    click.echo(f"{course_code}: Modules ~ {added_modules} added, "
+               f"{len(module_rows) - added_modules} duplicate")
+    click.echo(f"{course_code}: Sessions ~ {added_sessions} added, "
+               f"{len(session_rows) - added_sessions} duplicate, "
+               f"{len(unmapped)} not mapped to module")
+    click.echo(f"{course_code}: Unknown ~ {len(unknown)}")
+
+
+def map_ksb(store, conn, course_code, code, phase, module_number, remove):
+    """Add or remove one module or Discover mapping (inside a transaction)"""
+    location = "Discover" if phase == 'Discover' else f"M{module_number}"
+
+    # Check KSB exists
+    if not store.ksb_exists(course_code, code):
+        click.echo(f"Error: {code} not found in {course_code}")
+        click.echo(f"Add it first with: ulwazi ksb {code} --add 'Description'")
+        return
+
+    # Remove mapping
+    if remove:
         result = conn.execute('''
             DELETE FROM module_ksbs
             WHERE standard = ? AND ksb_code = ? AND phase = ?
@@ -369,13 +1083,9 @@ def map(code, course, module, discover, remove):
         ''', (course_code, code, phase, module_number, module_number))
 
         if result.rowcount == 0:
-            location = f"Discover" if discover else f"M{module}"
             click.echo(f"Error: {course_code} ~ No mapping found for {code} in {location}")
         else:
-            conn.commit()
-            location = f"Discover" if discover else f"M{module}"
             click.echo(f"{course_code}: Removed {code} from {location}")
-        conn.close()
         return
 
     # Add mapping
@@ -384,14 +1094,71 @@ def map(code, course, module, discover, remove):
             INSERT INTO module_ksbs (standard, ksb_code, phase, module_number)
             VALUES (?, ?, ?, ?)
         ''', (course_code, code, phase, module_number))
-        conn.commit()
-        location = f"Discover" if discover else f"M{module}"
         click.echo(f"{course_code}: Mapped {code} to {location}")
-    except sqlite3.IntegrityError:
-        location = f"Discover" if discover else f"M{module}"
-        click.echo(f"Error: {course_code} ~ {code} already mapped to {location}")
+    except conn.IntegrityError as e:
+        from store import is_foreign_key_error
+        if is_foreign_key_error(e):
+            click.echo(f"Error: {course_code} has no module M{module_number}")
+            click.echo(f"See the timetable with: ulwazi standard {course_code}")
+        else:
+            click.echo(f"Error: {course_code} ~ {code} already mapped to {location}")
+
+
+@cli.command()
+@click.argument('code', required=False)
+@click.option('--course', help='Course code (Uses current course if not specified)')
+@click.option('-m', '--module', type=int, help='Module number (1-7)')
+@click.option('--discover', is_flag=True, help='Map to Discover phase')
+@click.option('--remove', is_flag=True, help='Remove this mapping')
+@click.option('--from-file', 'manifest', type=click.File('r'),
+              help='Load a mapping manifest (use - for stdin)')
+def map(code, course, module, discover, remove, manifest):
+    """Map a KSB to a module or Discover phase"""
+    course_code = get_current_course(course)
+
+    if not course_code:
+        click.echo("No current course set. Use 'ulwazi course <DE5|DA4>' first.")
+        return
+
+    if manifest:
+        if code or module or discover or remove:
+            click.echo("Error: --from-file cannot be combined with a KSB code, -m, --discover or --remove")
+            return
+        map_from_manifest(course_code, manifest)
+        return
+
+    if not code:
+        click.echo("Error: Specify a KSB code or --from-file <manifest>")
+        return
+
+    code = code.upper()
+
+    # Validate: must specify either module or discover (not both)
+    if module and discover:
+        click.echo("Error: Specify either --module or --discover, not both")
+        return
+
+    if not module and not discover:
+        click.echo("Error: Specify either --module <N> or --discover")
+        return
+
+    # Determine phase and module_number
+    if discover:
+        phase = 'Discover'
+        module_number = None
+    else:
+        phase = 'Module'
+        module_number = module
+
+    store = get_store()
+    from store import DatabaseBusy
 
-    conn.close()
+    try:
+        # The check and the write share one write-locked transaction
+        with store.transaction() as conn:
+            map_ksb(store, conn, course_code, code, phase, module_number, remove)
+    except DatabaseBusy as e:
+        click.echo(f"Error: {e}")
 
 
 @cli.command()
@@ -404,7 +1171,14 @@ def map(code, course, module, discover, remove):
 @click.option('--notes', is_flag=True, help='Show session notes')
 @click.option('--markdown', is_flag=True,  help='Format the output with Markdown')
 @click.option('-t', '--trim', default=500, help='Trim the description to this length')
-def coverage(course, module, day, session, discover, ksb, notes, markdown, trim):
+@click.option('--format', 'output_format', type=click.Choice(OUTPUT_FORMATS), default='text',
+              help='Output format')
+@click.option('--all-modules', is_flag=True, help='Every module, day and session (course handbook)')
+@click.option('--hours', is_flag=True, help='Hours of sessions per KSB (whole course, or -m)')
+@click.option('-n', '--limit', type=int, help='Show this many KSBs (a page)')
+@click.option('--after', help='Start after this KSB (the last one of the previous page)')
+def coverage(course, module, day, session, discover, ksb, notes, markdown, trim, output_format,
+             all_modules, hours, limit, after):
     """Show KSB coverage for a module, day, or session"""
     course_code = get_current_course(course)
 
@@ -412,6 +1186,31 @@ def coverage(course, module, day, session, discover, ksb, notes, markdown, trim)
         click.echo("No current course set. Use 'ulwazi course <DE5|DA4>' first.")
         return
 
+    if markdown:
+        output_format = 'markdown'
+
+    if (limit or after) and (hours or all_modules):
+        click.echo("Error: -n/--limit and --after cannot be combined with --hours or --all-modules")
+        return
+
+    if after and not category_from_code(after):
+        click.echo("Error: --after takes a KSB code (e.g. K12)")
+        return
+
+    if hours:
+        if day or session or discover or all_modules:
+            click.echo("Error: --hours cannot be combined with -d, -s, --discover or --all-modules")
+            return
+        coverage_hours(course_code, module, ksb, trim, output_format)
+        return
+
+    if all_modules:
+        if module or day or session or discover:
+            click.echo("Error: --all-modules cannot be combined with -m, -d, -s or --discover")
+            return
+        coverage_handbook(course_code, ksb, trim, output_format)
+        return
+
     # Validate options
     if discover and (module or day or session):
         click.echo("Error: --discover cannot be combined with -m, -d, or -s")
@@ -429,59 +1228,18 @@ def coverage(course, module, day, session, discover, ksb, notes, markdown, trim)
         click.echo("Error: Specify either -m/--module <N> or --discover")
         return
 
-    conn = get_db_connection()
-
     # Determine what level we're querying
     if session:
-        # Session level
-        query = '''
-            SELECT k.code, k.category, k.description, s.notes
-            FROM ksbs k
-            INNER JOIN session_ksbs s
-                ON k.standard = s.standard AND k.code = s.ksb_code
-            WHERE k.standard = ? AND s.module_number = ?
-            AND s.day_number = ? AND s.session_number = ?
-        '''
-        params = [course_code, module, day, session]
         location = f'M{module}/D{day}/S{session}'
-
     elif day:
-        # Day level
-        query = '''
-            SELECT k.code, k.category, k.description, s.notes
-            FROM ksbs k
-            INNER JOIN session_ksbs s
-                ON k.standard = s.standard AND k.code = s.ksb_code
-            WHERE k.standard = ? AND s.module_number = ? AND s.day_number = ?
-        '''
-        params = [course_code, module, day]
         location = f'M{module}/D{day}'
-
     elif discover:
-        # Discover phase
-        query = '''
-            SELECT k.code, k.category, k.description
-            FROM ksbs k
-            INNER JOIN module_ksbs m
-                ON k.standard = m.standard AND k.code = m.ksb_code
-            WHERE k.standard = ? AND m.phase = 'Discover'
-        '''
-        params = [course_code]
         location = 'Discover'
-
     else:
-        # Module level
-        query = '''
-            SELECT k.code, k.category, k.description
-            FROM ksbs k
-            INNER JOIN module_ksbs m
-                ON k.standard = m.standard AND k.code = m.ksb_code
-            WHERE k.standard = ? AND m.phase = 'Module' AND m.module_number = ?
-        '''
-        params = [course_code, module]
         location = f'M{module}'
 
     # Add category filter if requested
+    category = None
     if ksb:
         category = {
             'k': 'Knowledge',
@@ -491,140 +1249,1822 @@ def coverage(course, module, day, session, discover, ksb, notes, markdown, trim)
 
         if not category:
             click.echo("Use --ksb k, --ksb s, or --ksb b")
-            conn.close()
             return
 
-        query += ' AND k.category = ?'
-        params.append(category)
+    start = page_start(after) if after else None
+
+    # Snapshots don't carry session notes
+    snap = None if notes else load_snapshot(course_code)
+    if snap:
+        found = snap.coverage_rows(module, day, session, discover, category)
+        if start:
+            found = (row for row in found if (ksb_sort_key(row[1], row[0]), row[0]) > start)
+    else:
+        # A page starts on the ksbs_sort index, so its cost doesn't grow with the standard
+        found = get_store().cache.rows(*coverage_query(
+            course_code, module, day, session, discover, category, start, limit))
+    # A day lists a KSB once per session, so a page ends on a KSB boundary
+    found = first_ksbs(found, limit)
+
+    first = next(found, None)
+    if first is None:
+        # On stderr for the other formats, so a file they're written to stays empty
+        click.echo(f"Coverage: No KSBs found for {course_code} {location}", err=output_format != 'text')
+        return
+    found = itertools.chain([first], found)
+
+    # Stream already-ordered rows straight to the renderer
+    if output_format != 'text':
+        from render import render
+
+        columns = ['Code', 'Description']
+        if notes and (session or day):
+            columns.append('Notes')
+
+        rows = ((row[1], row[0], row[2][:trim], *row[3:len(columns) + 1]) for row in found)
+        render(output_format, click.echo, f"Course: {course_code} - {location}",
+               columns, rows, group_labels=('Category',))
+        return
+
+    from render import coverage_text
 
-    query += ' ORDER BY k.category, k.code'
+    shown, last = coverage_text(click.echo, f"Course: {course_code} - {location}",
+                                ((ksb_category, code, description[:trim],
+                                  session_notes[0] if notes and session_notes else None)
+                                 for code, ksb_category, description, *session_notes in found))
 
-    results = conn.execute(query, params).fetchall()
-    conn.close()
+    if limit and shown == limit:
+        click.echo(f"\nNext page: --after {last}")
+    click.echo()
+
+
+def coverage_hours(course_code, module, ksb, trim, output_format):
+    """Sessions and hours per KSB, summed from the timetable in one query"""
+    location = f'M{module} hours' if module else 'Hours'
+
+    category = None
+    if ksb:
+        category = {'k': 'Knowledge', 's': 'Skill', 'b': 'Behaviour'}.get(ksb.lower())
+        if not category:
+            click.echo("Use --ksb k, --ksb s, or --ksb b")
+            return
 
+    results = list(get_store().cache.rows(*hours_query(course_code, module, category)))
     if not results:
-        click.echo(f"Coverage: No KSBs found for {course_code} {location}")
+        click.echo(f"Coverage: No KSBs found for {course_code}", err=output_format != 'text')
         return
 
-    click.echo(f"\nCourse: {course_code} - {location}\n")
+    if output_format != 'text':
+        from render import render
 
-    # Group by category
-    by_category = defaultdict(list)
+        rows = ((category, code, count, (minutes or 0) / 60, description[:trim])
+                for category, code, count, minutes, description in results)
+        render(output_format, click.echo, f"Course: {course_code} - {location}",
+               ['Code', 'Sessions', 'Hours', 'Description'], rows, group_labels=('Category',))
+        return
 
-    # Handle results based on whether we have notes column
-    if session or day:
-        for code, category, description, session_notes in results:
-            by_category[category].append((code, description, session_notes))
-    else:
-        for code, category, description in results:
-            by_category[category].append((code, description, None))
+    click.echo(f"\nCourse: {course_code} - {location}")
+    current = None
+    total = 0
+    for category, code, count, minutes, description in results:
+        if category != current:
+            current = category
+            click.echo(f"\n{category}:")
+        total += minutes or 0
+        if count:
+            click.echo(f"  {code}: {format_hours(minutes)} in {count} session{'s' if count > 1 else ''}")
+        else:
+            click.echo(f"  {code}: not taught")
+    click.echo(f"\nTotal: {format_hours(total)} of KSB teaching\n")
+
+
+def coverage_handbook(course_code, ksb, trim, output_format):
+    """Every Discover, module, day and session mapping with notes, in one query"""
+    from render import render
+
+    # Module KSBs with no session in that module are listed as 'Not in a session'
+    query = f'''
+        SELECT CASE m.phase WHEN 'Discover' THEN 'Discover' ELSE m.module_number END,
+            CASE WHEN m.phase = 'Module' AND s.day_number IS NULL
+                 THEN 'Not in a session' ELSE s.day_number END,
+            s.session_number,
+            k.category, k.code, SUBSTR(k.description, 1, ?), s.notes
+        FROM module_ksbs m
+        INNER JOIN ksbs k
+            ON k.standard = m.standard AND k.code = m.ksb_code
+        LEFT OUTER JOIN session_ksbs s
+            ON s.standard = m.standard AND s.ksb_code = m.ksb_code
+            AND s.module_number = m.module_number AND m.phase = 'Module'
+        WHERE m.standard = ?
+    '''
+    params = [trim, course_code]
 
-    # Display
-    if markdown:
-        pass
+    if ksb:
+        category = {
+            'k': 'Knowledge',
+            's': 'Skill',
+            'b': 'Behaviour'
+        }.get(ksb.lower())
+
+        if not category:
+            click.echo("Use --ksb k, --ksb s, or --ksb b")
+            return
+
+        query += ' AND k.category = ?'
+        params.append(category)
+
+    query += f'''
+        ORDER BY m.phase, m.module_number, s.day_number NULLS LAST, s.session_number,
+            {NATURAL_ORDER}
+    '''
+
+    count = render(output_format, click.echo, f"Course handbook: {course_code}",
+                   ['Category', 'Code', 'Description', 'Notes'], get_store().cache.rows(query, params),
+                   group_labels=('Module', 'Day', 'Session'))
 
+    if not count and output_format == 'text':
+        click.echo(f"Coverage: No KSBs mapped for {course_code}")
+
+
+@cli.command()
+@click.option('--course', help='Course code (Uses current course if not specified)')
+@click.option('--all', 'all_standards', is_flag=True, help='Every standard')
+@click.option('-o', '--output', 'directory', type=click.Path(file_okay=False, path_type=Path),
+              default='reports', help='Directory to write the reports under (Default: reports)')
+@click.option('--level', 'levels', multiple=True, type=click.Choice(REPORT_LEVELS),
+              help='Reports to write, repeat for several (Default: show, discover, module, day)')
+@click.option('--format', 'output_format', type=click.Choice(OUTPUT_FORMATS), default='markdown',
+              help='Output format (Default: markdown)')
+@click.option('--notes', is_flag=True, help='Include session notes in day and session reports')
+@click.option('-t', '--trim', default=500, help='Trim the description to this length')
+@click.option('-j', '--jobs', type=click.IntRange(min=1), help='Processes (Default: one per CPU)')
+def report(course, all_standards, directory, levels, output_format, notes, trim, jobs):
+    """Write show and coverage reports to files, for one standard or all
+
+    One file per standard and level, e.g. reports/DE5/m2-d1.md for
+    'ulwazi coverage -m 2 -d 1 --course DE5'. Files are replaced whole,
+    so the pack can be regenerated while people are reading it.
+    """
+    import report as pack
+
+    store = get_store()
+    if all_standards:
+        standards = [code for code, in store.conn.execute('SELECT code FROM standards ORDER BY code')]
     else:
-        for category in sorted(by_category.keys()):
-            click.echo(f"{category}:")
-            for item in sorted(by_category[category], key=lambda x: natural_sort_key(x[0])):
-                code, description, session_notes = item
-                click.echo(f"  {code}: {description[:trim]}")
-                if notes and session_notes:
-                    click.echo(f"      Notes: {session_notes}")
-            click.echo()
+        course_code = get_current_course(course)
+
+        if not course_code:
+            click.echo("No current course set. Use 'ulwazi course <DE5|DA4>' first.")
+            return
+        if not store.standard_exists(course_code):
+            click.echo(f"Error: {course_code} is not a standard")
+            return
+        standards = [course_code]
+
+    start = time.perf_counter()
+    generation = store.cache.current_generation()
+    reports = pack.plan(store.conn, standards, set(levels or DEFAULT_REPORT_LEVELS))
+    if not reports:
+        click.echo("Report: Nothing to write")
+        return
+
+    ksbs = 0
+    written = pack.write_reports(DB_FILE, reports, directory, output_format, trim, notes, jobs)
+    with click.progressbar(written, length=len(reports), label='Writing reports',
+                           file=sys.stderr) as bar:
+        for _, count in bar:
+            ksbs += count
+
+    click.echo(f"Report: {len(reports)} files for {len(standards)} standard"
+               f"{'s' if len(standards) != 1 else ''} in {directory} "
+               f"({ksbs} KSB rows, {time.perf_counter() - start:.1f}s)")
+    if store.cache.current_generation() != generation:
+        click.echo("Note: The database changed while the reports were written; "
+                   "run it again for a consistent pack")
+
 
 @cli.command()
-@click.argument('code')
 @click.option('--course', help='Course code (Uses current course if not specified)')
-@click.option('-m', '--module', type=int, required=True, help='Module number (1-7)')
-@click.option('-d', '--day',    type=int, required=True, help='Day number (1-5)')
-@click.option('-s', '--session',type=int, required=True, help='Session number (1-4)')
-@click.option('--notes', help='Session notes (how/why this KSB is covered)')
-@click.option('--remove', is_flag=True, help='Remove session mapping')
-def session(code, course, module, day, session, notes, remove):
-    """Map a KSB to a specific session"""
+@click.option('--ksb', help='Filter by category (k/s/b)')
+@click.option('--rebuild', is_flag=True, help='Recompute the matrix from the mapping tables')
+def matrix(course, ksb, rebuild):
+    """Show the KSB x Discover/module grid with session counts"""
     course_code = get_current_course(course)
 
     if not course_code:
         click.echo("No current course set. Use 'ulwazi course <DE5|DA4>' first.")
         return
 
-    code = code.upper()
+    query = '''
+        SELECT ksb_code, category, discover, module_mask, session_count
+        FROM coverage_matrix
+        WHERE standard = ?
+    '''
+    params = [course_code]
 
-    conn = get_db_connection()
+    category = ''
+    if ksb:
+        category = {
+            'k': 'Knowledge',
+            's': 'Skill',
+            'b': 'Behaviour'
+        }.get(ksb.lower())
 
-    # Check KSB exists
-    exists = conn.execute('''
-        SELECT 1 FROM ksbs
-        WHERE standard = ? AND code = ?
-    ''', (course_code, code)).fetchone()
+        if not category:
+            click.echo("Use --ksb k, --ksb s, or --ksb b")
+            return
 
-    if not exists:
-        click.echo(f"Error: {code} not found in {course_code}")
-        click.echo(f"Add it first with: ulwazi ksb {code} --add 'Description'")
-        conn.close()
-        return
+        query += ' AND category = ?'
+        params.append(category)
 
-    # Check KSB is mapped to this module
-    module_mapped = conn.execute('''
-        SELECT 1 FROM module_ksbs
-        WHERE standard = ? AND ksb_code = ?
-        AND phase = 'Module' AND module_number = ?
-    ''', (course_code, code, module)).fetchone()
+    store = get_store()
+    conn = store.conn
+    from store import DatabaseBusy
 
-    if not module_mapped:
-        click.echo(f"Error: {code} not mapped to M{module}")
-        click.echo(f"Map it first with: ulwazi map {code} -m {module}")
-        conn.close()
+    try:
+        if rebuild:
+            from setup_db import rebuild_coverage_matrix
+            with store.transaction():
+                rebuild_coverage_matrix(conn)
+        results = conn.execute(query, params).fetchall()
+    except DatabaseBusy as e:
+        click.echo(f"Error: {e}")
+        return
+    except conn.OperationalError:
+        click.echo("Error: coverage_matrix not found. Run 'python setup_db.py' to create it.")
         return
 
-    # Remove session mapping
-    if remove:
-        result = conn.execute('''
-            DELETE FROM session_ksbs
-            WHERE standard = ? AND ksb_code = ?
-            AND module_number = ? AND day_number = ? AND session_number = ?
-        ''', (course_code, code, module, day, session))
-
-        if result.rowcount == 0:
-            click.echo(f"Error: No session mapping found for {code} in M{module}/D{day}/S{session}")
-        else:
-            conn.commit()
-            click.echo(f"Session: Removed {code} from M{module}/D{day}/S{session}")
-        conn.close()
+    if not results:
+        click.echo(f"Matrix: No {category} KSBs found for {course_code}")
         return
 
-    # Add session mapping
-    try:
-        conn.execute('''
-            INSERT INTO session_ksbs 
-                (standard, ksb_code, module_number, day_number, session_number, notes)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (course_code, code, module, day, session, notes or ''))
-        conn.commit()
-        click.echo(f"Session: Mapped {code} to M{module}/D{day}/S{session}")
-    except sqlite3.IntegrityError:
-        if not notes:
-            click.echo(f"Error: {code} already mapped to M{module}/D{day}/S{session}")
-            click.echo(f"Use --notes to modify notes or --remove to delete")
+    # At least M1..M7, more if a standard maps further
+    highest = max(mask.bit_length() - 1 for _, _, _, mask, _ in results)
+    modules = range(1, max(highest, 7) + 1)
 
-    # Update notes
-    if notes:
-        result = conn.execute('''
-            UPDATE session_ksbs
-            SET notes = ?
-            WHERE standard = ? AND ksb_code = ?
-            AND module_number = ? AND day_number = ? AND session_number = ?
-        ''', (notes, course_code, code, module, day, session))
+    header = f"  {'':<4} {'Disc':>4} " + ' '.join(f"M{n:<2}" for n in modules) + "  Sessions"
+    click.echo(f"\nCourse: {course_code}")
 
-        if result.rowcount == 0:
-            click.echo(f"Error: No session mapping found for {code} in M{module}/D{day}/S{session}")
-            click.echo(f"Add it first with: ulwazi session {code} -m {module} -d {day} -s {session}")
-        else:
-            conn.commit()
-            click.echo(f"Session: Updated notes for {code} in M{module}/D{day}/S{session}")
+    current_category = None
+    for code, category, discover, mask, session_count in sorted(
+            results, key=lambda r: (r[1], natural_sort_key(r[0]))):
+        if category != current_category:
+            click.echo(f"\n{category}:")
+            click.echo(header)
+            current_category = category
+
+        cells = ' '.join(f"{'x' if mask >> n & 1 else '.':<3}" for n in modules)
+        click.echo(f"  {code:<4} {'x' if discover else '.':>4} {cells}  {session_count:>8}")
+
+    click.echo()
+
+
+def find_gaps(conn, course_code, max_coverage):
+    """Run the gap checks for one standard (or every standard if None)
+
+    Returns a dict of check name -> list of row dicts.
+    """
+    where = 'WHERE k.standard = ?' if course_code else 'WHERE 1'
+    params = [course_code] if course_code else []
+
+    checks = {
+        # KSBs not mapped to Discover or any module
+        'unmapped': f'''
+            SELECT k.standard, k.code
+            FROM ksbs k
+            {where}
+            AND NOT EXISTS (
+                SELECT 1 FROM module_ksbs m
+                WHERE m.standard = k.standard AND m.ksb_code = k.code
+            )
+        ''',
+        # Module mappings with no session in that module
+        'no_session': f'''
+            SELECT k.standard, k.code, m.module_number
+            FROM ksbs k
+            INNER JOIN module_ksbs m
+                ON k.standard = m.standard AND k.code = m.ksb_code
+            {where} AND m.phase = 'Module'
+            AND NOT EXISTS (
+                SELECT 1 FROM session_ksbs s
+                WHERE s.standard = m.standard AND s.ksb_code = m.ksb_code
+                AND s.module_number = m.module_number
+            )
+        ''',
+        # Session mappings that don't say how the KSB is covered
+        'no_notes': f'''
+            SELECT k.standard, k.code, s.module_number, s.day_number, s.session_number
+            FROM ksbs k
+            INNER JOIN session_ksbs s
+                ON k.standard = s.standard AND k.code = s.ksb_code
+            {where} AND COALESCE(s.notes, '') = ''
+        ''',
+    }
+
+    gaps = {}
+    for name, query in checks.items():
+        cursor = conn.execute(query, params)
+        columns = [c[0] for c in cursor.description]
+        gaps[name] = [dict(zip(columns, row)) for row in cursor]
+
+    # KSBs mapped to more modules (Discover counts as one) than allowed
+    gaps['over_covered'] = []
+    if max_coverage is not None:
+        cursor = conn.execute(f'''
+            SELECT k.standard, k.code, COUNT(*) AS modules
+            FROM ksbs k
+            INNER JOIN module_ksbs m
+                ON k.standard = m.standard AND k.code = m.ksb_code
+            {where}
+            GROUP BY k.standard, k.code
+            HAVING COUNT(*) > ?
+        ''', params + [max_coverage])
+        columns = [c[0] for c in cursor.description]
+        gaps['over_covered'] = [dict(zip(columns, row)) for row in cursor]
+
+    for rows in gaps.values():
+        rows.sort(key=lambda r: (r['standard'], r['code'][:1], natural_sort_key(r['code']),
+                                 r.get('module_number') or 0, r.get('day_number') or 0,
+                                 r.get('session_number') or 0))
+    return gaps
+
+
+@cli.command()
+@click.option('--course', help='Course code (Uses current course if not specified)')
+@click.option('--all', 'all_standards', is_flag=True, help='Check every standard')
+@click.option('--max', 'max_coverage', type=int, help='Report KSBs mapped to more than N modules')
+@click.option('--json', 'as_json', is_flag=True, help='Output JSON')
+@click.option('--strict', is_flag=True, help='Exit with status 1 if any gaps are found')
+def gaps(course, all_standards, max_coverage, as_json, strict):
+    """Find unmapped KSBs, modules without sessions, and missing notes"""
+    course_code = None
+    if not all_standards:
+        course_code = get_current_course(course)
+
+        if not course_code:
+            click.echo("No current course set. Use 'ulwazi course <DE5|DA4>' first.")
+            return
+
+    conn = get_db_connection()
+    results = find_gaps(conn, course_code, max_coverage)
+
+    found = sum(len(rows) for rows in results.values())
+
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+
+    else:
+        headings = {
+            'unmapped': "Not mapped to Discover or any module",
+            'no_session': "Mapped to a module but no session in it",
+            'no_notes': "Session mappings without notes",
+            'over_covered': f"Mapped to more than {max_coverage} modules",
+        }
+
+        click.echo(f"\nGaps: {course_code or 'All standards'}")
+        for name, rows in results.items():
+            if name == 'over_covered' and max_coverage is None:
+                continue
+
+            click.echo(f"\n{headings[name]}: {len(rows)}")
+            for row in rows:
+                location = ''
+                if 'session_number' in row:
+                    location = f" M{row['module_number']}/D{row['day_number']}/S{row['session_number']}"
+                elif 'module_number' in row:
+                    location = f" M{row['module_number']}"
+                elif 'modules' in row:
+                    location = f" ({row['modules']} modules)"
+
+                standard = f"{row['standard']} " if not course_code else ''
+                click.echo(f"  {standard}{row['code']}{location}")
+        click.echo()
+
+    if strict and found:
+        sys.exit(1)
+
+
+def fts_phrase_query(text):
+    """Quote every word so FTS5 treats the input as plain terms"""
+    return ' '.join('"' + word.replace('"', '""') + '"' for word in text.split())
 
-    conn.close()
+
+@cli.command()
+@click.argument('terms', nargs=-1, required=False)
+@click.option('--course', help='Course code (Uses current course if not specified)')
+@click.option('--all', 'all_standards', is_flag=True, help='Search every standard')
+@click.option('--ksb', help='Filter by category (k/s/b)')
+@click.option('-m', '--module', type=int, help='Only KSBs mapped to this module')
+@click.option('--in', 'source', type=click.Choice(['all', 'desc', 'notes']), default='all',
+              help='Search descriptions, session notes, or both')
+@click.option('-n', '--limit', default=20, help='Maximum number of results')
+@click.option('--rebuild', is_flag=True, help='Rebuild the search index')
+def search(terms, course, all_standards, ksb, module, source, limit, rebuild):
+    """Search KSB descriptions and session notes (e.g. search data quality)"""
+    course_code = None
+    if not all_standards:
+        course_code = get_current_course(course)
+
+        if not course_code:
+            click.echo("No current course set. Use 'ulwazi course <DE5|DA4>' first.")
+            return
+
+    category = ''
+    if ksb:
+        category = {
+            'k': 'Knowledge',
+            's': 'Skill',
+            'b': 'Behaviour'
+        }.get(ksb.lower())
+
+        if not category:
+            click.echo("Use --ksb k, --ksb s, or --ksb b")
+            return
+
+    store = get_store()
+    conn = store.conn
+
+    if rebuild:
+        from setup_db import rebuild_search_index
+        from store import DatabaseBusy
+
+        try:
+            with store.transaction():
+                rebuild_search_index(conn)
+        except DatabaseBusy as e:
+            click.echo(f"Error: {e}")
+            return
+        click.echo("Search: Index rebuilt")
+
+    if not terms:
+        if not rebuild:
+            click.echo("Error: Specify search terms")
+        return
+
+    # Filters shared by both sources (k = the matching KSB)
+    filters = ''
+    params = []
+    if course_code:
+        filters += ' AND k.standard = ?'
+        params.append(course_code)
+    if category:
+        filters += ' AND k.category = ?'
+        params.append(category)
+
+    parts = []
+    if source in ('all', 'desc'):
+        module_filter = ''
+        if module:
+            module_filter = '''
+                AND EXISTS (
+                    SELECT 1 FROM module_ksbs m
+                    WHERE m.standard = k.standard AND m.ksb_code = k.code
+                    AND m.phase = 'Module' AND m.module_number = ?
+                )'''
+        parts.append((f'''
+            SELECT k.standard, k.code, k.category, NULL,
+                snippet(ksbs_fts, 0, '[', ']', '...', 12), bm25(ksbs_fts)
+            FROM ksbs_fts
+            INNER JOIN ksbs k ON k.rowid = ksbs_fts.rowid
+            WHERE ksbs_fts MATCH ? {filters} {module_filter}
+        ''', params + ([module] if module else [])))
+
+    if source in ('all', 'notes'):
+        parts.append((f'''
+            SELECT k.standard, k.code, k.category,
+                'M' || s.module_number || '/D' || s.day_number || '/S' || s.session_number,
+                snippet(notes_fts, 0, '[', ']', '...', 12), bm25(notes_fts)
+            FROM notes_fts
+            INNER JOIN session_ksbs s ON s.rowid = notes_fts.rowid
+            INNER JOIN ksbs k ON k.standard = s.standard AND k.code = s.ksb_code
+            WHERE notes_fts MATCH ? {filters} {'AND s.module_number = ?' if module else ''}
+        ''', params + ([module] if module else [])))
+
+    query = ' UNION ALL '.join(part for part, _ in parts) + ' ORDER BY 6 LIMIT ?'
+
+    text = ' '.join(terms)
+    results = None
+    for match in (text, fts_phrase_query(text)):
+        query_params = []
+        for _, part_params in parts:
+            query_params += [match] + part_params
+        try:
+            results = conn.execute(query, query_params + [limit]).fetchall()
+            break
+        except conn.OperationalError:
+            # Not valid FTS5 syntax, retry as plain words
+            continue
+
+    if not results:
+        click.echo(f"Search: No matches for '{text}' in {course_code or 'any standard'}")
+        return
+
+    click.echo(f"\nSearch: '{text}' in {course_code or 'all standards'}\n")
+    for standard, code, category, location, snippet, rank in results:
+        standard = f"{standard} " if not course_code else ''
+        location = f" {location} notes" if location else ''
+        click.echo(f"  {standard}{code}{location}: {snippet}")
+    click.echo()
+
+
+def refresh_ksb_terms(store):
+    """Tokenise KSBs whose cached terms are missing (new or edited descriptions)
+
+    A description without terms is stored as the one term '' (count 0),
+    so it isn't tokenised again on every run. Raises DatabaseBusy if
+    another writer holds the lock.
+    """
+    from terms import tokenise
+
+    stale_query = '''
+        SELECT k.standard, k.code, k.description
+        FROM ksbs k
+        WHERE NOT EXISTS (
+            SELECT 1 FROM ksb_terms t
+            WHERE t.standard = k.standard AND t.code = k.code
+        )
+    '''
+    # Checked first, so a run with nothing to tokenise never takes the write lock
+    if store.conn.execute(stale_query + ' LIMIT 1').fetchone() is None:
+        return 0
+
+    with store.transaction() as conn:
+        stale = conn.execute(stale_query).fetchall()
+        conn.executemany('''
+            INSERT OR REPLACE INTO ksb_terms (standard, code, term, count)
+            VALUES (?, ?, ?, ?)
+        ''', [(standard, code, term, count)
+              for standard, code, description in stale
+              for term, count in (tokenise(description) or {'': 0}).items()])
+    return len(stale)
+
+
+def ksb_idf(conn):
+    """Inverse document frequency per term over every KSB in the database"""
+    documents = conn.execute('''
+        SELECT COUNT(*) FROM (SELECT DISTINCT standard, code FROM ksb_terms)
+    ''').fetchone()[0]
+    return {term: math.log((1 + documents) / (1 + df)) + 1
+            for term, df in conn.execute('''
+                SELECT term, COUNT(*) FROM ksb_terms
+                WHERE term != ''
+                GROUP BY term
+            ''')}
+
+
+def refresh_term_weights(store):
+    """Rewrite every ksb_terms.weight if any KSB's terms changed since; True if it did
+
+    Each KSB's weights are its unit-length TF-IDF vector. Until the next
+    change to ksb_terms, crosswalk and suggest just read them back.
+    Raises DatabaseBusy if another writer holds the lock.
+    """
+    version_query = '''
+        SELECT version, weighted FROM ksb_terms_version
+    '''
+    version, weighted = store.conn.execute(version_query).fetchone()
+    if weighted == version:
+        return False
+
+    with store.transaction() as conn:
+        # Read again under the lock: another run may have just done it
+        version, weighted = conn.execute(version_query).fetchone()
+        if weighted == version:
+            return False
+
+        idf = ksb_idf(conn)
+        vectors = defaultdict(dict)
+        for standard, code, term, count in conn.execute('''
+            SELECT standard, code, term, count FROM ksb_terms
+            WHERE term != ''
+        '''):
+            vectors[standard, code][term] = (1 + math.log(count)) * idf[term]
+
+        rows = []
+        for (standard, code), vector in vectors.items():
+            norm = math.sqrt(sum(w * w for w in vector.values())) or 1.0
+            rows += [(weight / norm, standard, code, term) for term, weight in vector.items()]
+
+        conn.executemany('''
+            UPDATE ksb_terms SET weight = ?
+            WHERE standard = ? AND code = ? AND term = ?
+        ''', rows)
+        conn.execute('''
+            UPDATE ksb_terms_version SET weighted = ?
+        ''', (version,))
+    return True
+
+
+def tfidf_vectors(conn, standard):
+    """Unit-length TF-IDF vector per KSB code for one standard
+
+    Read from the stored weights: call refresh_ksb_terms() and
+    refresh_term_weights() first. Terms added since the weights were
+    last computed (no weight yet) are left out.
+    """
+    vectors = defaultdict(dict)
+    for code, term, weight in conn.execute('''
+        SELECT code, term, weight FROM ksb_terms
+        WHERE standard = ? AND term != '' AND weight IS NOT NULL
+    ''', (standard,)):
+        vectors[code][term] = weight
+    return vectors
+
+
+def crosswalk_matches(conn, source, target, threshold, top):
+    """Best target KSB matches (cosine similarity) for each source KSB
+
+    Returns {source_code: [(target_code, score), ...]}. Only target KSBs
+    sharing at least one term are scored, via an inverted index.
+    """
+    source_vectors = tfidf_vectors(conn, source)
+    target_vectors = tfidf_vectors(conn, target)
+
+    postings = defaultdict(list)
+    for code, vector in target_vectors.items():
+        for term, weight in vector.items():
+            postings[term].append((code, weight))
+
+    matches = {}
+    for code, vector in source_vectors.items():
+        scores = defaultdict(float)
+        for term, weight in vector.items():
+            for target_code, target_weight in postings.get(term, ()):
+                scores[target_code] += weight * target_weight
+
+        best = sorted(((c, s) for c, s in scores.items() if s >= threshold),
+                      key=lambda m: m[1], reverse=True)[:top]
+        if best:
+            matches[code] = best
+    return matches
+
+
+@cli.command()
+@click.argument('source')
+@click.argument('target')
+@click.option('--threshold', default=0.35, help='Minimum similarity (0-1) to count as a match')
+@click.option('--top', default=1, help='Matches to show per KSB')
+@click.option('-m', '--module', type=int, help='Only show what this module of SOURCE covers')
+def crosswalk(source, target, threshold, top, module):
+    """Find equivalent KSBs across two standards (e.g. crosswalk DE5 DA4)"""
+    source = source.upper().strip()
+    target = target.upper().strip()
+
+    from store import DatabaseBusy
+
+    store = get_store()
+    for code in (source, target):
+        if not store.standard_exists(code):
+            click.echo(f"Error: {code} is not a standard")
+            return
+
+    try:
+        refresh_ksb_terms(store)
+        refresh_term_weights(store)
+    except DatabaseBusy:
+        # Only a read: score with the weights already stored rather than fail
+        click.echo("Crosswalk: The database is busy; using the last stored term weights", err=True)
+
+    conn = store.conn
+    matches = crosswalk_matches(conn, source, target, threshold, top)
+
+    # Where each source KSB is taught
+    taught = defaultdict(list)
+    for code, module_number in conn.execute('''
+        SELECT ksb_code, module_number FROM module_ksbs
+        WHERE standard = ? AND phase = 'Module'
+        ORDER BY module_number
+    ''', (source,)):
+        taught[code].append(module_number)
+
+    if not matches:
+        click.echo(f"Crosswalk: No {source} KSBs match {target} at threshold {threshold}")
+        return
+
+    ordered = sorted(matches, key=lambda c: (c[:1], natural_sort_key(c)))
+
+    if not module:
+        click.echo(f"\nCrosswalk: {source} -> {target} (threshold {threshold})\n")
+        for code in ordered:
+            for target_code, score in matches[code]:
+                click.echo(f"  {code:<4} ~ {target_code:<4} {score:.2f}")
+
+    # Target KSBs already covered by each source module
+    covered = defaultdict(set)
+    for code in ordered:
+        for module_number in taught.get(code, []):
+            if module and module_number != module:
+                continue
+            covered[module_number].update(target_code for target_code, _ in matches[code])
+
+    click.echo(f"\n{target} KSBs already covered by {source} modules:\n")
+    for module_number in sorted(covered):
+        codes = sorted(covered[module_number], key=lambda c: (c[:1], natural_sort_key(c)))
+        click.echo(f"  M{module_number}: {', '.join(codes)}")
+    if not covered:
+        click.echo("  None")
+    click.echo()
+
+
+@cli.command('suggest')
+@click.argument('directory', type=click.Path(exists=True, file_okay=False, path_type=Path))
+@click.option('--course', help='Course code (Uses current course if not specified)')
+@click.option('--threshold', default=0.5, help="Minimum share (0-1) of a KSB's terms found in a file")
+@click.option('--top', default=3, help='KSBs suggested per file')
+@click.option('--apply', is_flag=True, help='Add the suggested mappings (in one transaction)')
+@click.option('-j', '--jobs', type=click.IntRange(min=1), help='Processes for indexing (Default: one per CPU)')
+@click.option('-t', '--trim', default=80, help='Trim the evidence to this length')
+def suggest_mappings(directory, course, threshold, top, apply, jobs, trim):
+    """Suggest module and session mappings from course material
+
+    DIRECTORY holds Markdown or text files with the module, day and
+    session in their path, e.g. module-2/day-1/session-3.md or M2/D1/S3.md.
+    Only files changed since the last run are re-indexed.
+    """
+    course_code = get_current_course(course)
+
+    if not course_code:
+        click.echo("No current course set. Use 'ulwazi course <DE5|DA4>' first.")
+        return
+
+    import suggest
+    from store import DatabaseBusy
+
+    store = get_store()
+    root = directory.resolve()
+    try:
+        stats = suggest.refresh_index(store, root, jobs)
+    except DatabaseBusy as e:
+        click.echo(f"Error: {e}")
+        return
+
+    try:
+        refresh_ksb_terms(store)
+        refresh_term_weights(store)
+    except DatabaseBusy as e:
+        click.echo(f"Error: {e}")
+        return
+    conn = store.conn
+    vectors = tfidf_vectors(conn, course_code)
+
+    # Only mappings that don't exist yet, in modules and sessions the timetable has
+    slots = store.timetable_slots(course_code)
+    modules = {module for module, _, _ in slots}
+    mapped = store.module_pairs(course_code)
+    in_sessions = set(store.session_slots(course_code))
+    proposed = [s for s in suggest.suggestions(conn, root, vectors, threshold, top)
+                if (s.module in modules and (s.code, s.module) not in mapped)
+                or ((s.module, s.day, s.session) in slots
+                    and (s.code, s.module, s.day, s.session) not in in_sessions)]
+
+    click.echo(f"\nSuggest: {course_code} from {directory} ({stats.files} files; "
+               f"{stats.tokenised} indexed, {stats.touched} touched but unchanged, {stats.removed} removed)\n")
+    if not proposed:
+        click.echo(f"  No new mappings: none reached --threshold {threshold}, or no file's path "
+                   "names its module (e.g. module-2/ or M2/)\n")
+        return
+
+    lines = {}
+    for s in proposed:
+        where = f"M{s.module}/D{s.day}/S{s.session}" if s.day else f"M{s.module}"
+        relative = Path(s.path).relative_to(root)
+        click.echo(f"  {where:<10} {s.code:<5} {s.score:.2f}  {relative}: "
+                   f"{suggest.evidence(s.path, vectors[s.code], trim, lines)}")
+    click.echo()
+
+    if not apply:
+        click.echo(f"Add these with: ulwazi suggest {directory} --apply")
+        return
+
+    module_rows = list(dict.fromkeys(
+        (course_code, s.code, 'Module', s.module) for s in proposed))
+    session_rows = [(course_code, s.code, s.module, s.day, s.session,
+                     f"Suggested from {Path(s.path).relative_to(root)}")
+                    for s in proposed if s.day]
+    try:
+        with store.transaction():
+            added_modules = store.add_module_mappings(module_rows)
+            added_sessions = store.add_session_mappings(session_rows)
+    except DatabaseBusy as e:
+        click.echo(f"Error: {e}")
+        return
+    click.echo(f"{course_code}: Modules ~ {added_modules} added")
+    click.echo(f"{course_code}: Sessions ~ {added_sessions} added")
+
+
+def map_session(store, conn, course_code, code, module, day, session, notes, remove):
+    """Add or remove one session mapping and set its notes (inside a transaction)"""
+    # Check KSB exists
+    if not store.ksb_exists(course_code, code):
+        click.echo(f"Error: {code} not found in {course_code}")
+        click.echo(f"Add it first with: ulwazi ksb {code} --add 'Description'")
+        return
+
+    # Check KSB is mapped to this module
+    if not store.module_mapped(course_code, code, module):
+        click.echo(f"Error: {code} not mapped to M{module}")
+        click.echo(f"Map it first with: ulwazi map {code} -m {module}")
+        return
+
+    # Remove session mapping
+    if remove:
+        result = conn.execute('''
+            DELETE FROM session_ksbs
+            WHERE standard = ? AND ksb_code = ?
+            AND module_number = ? AND day_number = ? AND session_number = ?
+        ''', (course_code, code, module, day, session))
+
+        if result.rowcount == 0:
+            click.echo(f"Error: No session mapping found for {code} in M{module}/D{day}/S{session}")
+        else:
+            click.echo(f"Session: Removed {code} from M{module}/D{day}/S{session}")
+        return
+
+    # Add session mapping
+    try:
+        conn.execute('''
+            INSERT INTO session_ksbs 
+                (standard, ksb_code, module_number, day_number, session_number, notes)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (course_code, code, module, day, session, notes or ''))
+        click.echo(f"Session: Mapped {code} to M{module}/D{day}/S{session}")
+    except conn.IntegrityError as e:
+        from store import is_foreign_key_error
+        if is_foreign_key_error(e):
+            click.echo(f"Error: {course_code} has no session M{module}/D{day}/S{session}")
+            click.echo(f"See the timetable with: ulwazi standard {course_code}")
+            return
+        if not notes:
+            click.echo(f"Error: {code} already mapped to M{module}/D{day}/S{session}")
+            click.echo(f"Use --notes to modify notes or --remove to delete")
+
+    # Update notes
+    if notes:
+        result = conn.execute('''
+            UPDATE session_ksbs
+            SET notes = ?
+            WHERE standard = ? AND ksb_code = ?
+            AND module_number = ? AND day_number = ? AND session_number = ?
+        ''', (notes, course_code, code, module, day, session))
+
+        if result.rowcount == 0:
+            click.echo(f"Error: No session mapping found for {code} in M{module}/D{day}/S{session}")
+            click.echo(f"Add it first with: ulwazi session {code} -m {module} -d {day} -s {session}")
+        else:
+            click.echo(f"Session: Updated notes for {code} in M{module}/D{day}/S{session}")
+
+
+@cli.command()
+@click.argument('code')
+@click.option('--course', help='Course code (Uses current course if not specified)')
+@click.option('-m', '--module', type=int, required=True, help='Module number (1-7)')
+@click.option('-d', '--day',    type=int, required=True, help='Day number (1-5)')
+@click.option('-s', '--session',type=int, required=True, help='Session number (1-4)')
+@click.option('--notes', help='Session notes (how/why this KSB is covered)')
+@click.option('--remove', is_flag=True, help='Remove session mapping')
+def session(code, course, module, day, session, notes, remove):
+    """Map a KSB to a specific session"""
+    course_code = get_current_course(course)
+
+    if not course_code:
+        click.echo("No current course set. Use 'ulwazi course <DE5|DA4>' first.")
+        return
+
+    code = code.upper()
+
+    store = get_store()
+    from store import DatabaseBusy
+
+    try:
+        # Checks, insert and notes update commit together or not at all
+        with store.transaction() as conn:
+            map_session(store, conn, course_code, code, module, day, session, notes, remove)
+    except DatabaseBusy as e:
+        click.echo(f"Error: {e}")
+
+
+@cli.command()
+@click.argument('code', required=False)
+@click.option('--course', help='Course code (Uses current course if not specified)')
+@click.option('--add', 'title', help='Add a new cohort on the course with this title')
+@click.option('--start', help='Cohort start date (YYYY-MM-DD)')
+@click.option('--remove', is_flag=True, help='Remove the cohort (with its learners and their evidence)')
+def cohort(code, course, title, start, remove):
+    """List cohorts, or add and remove one
+
+    \b
+      ulwazi cohort                                   the course's cohorts
+      ulwazi cohort DE5-2026A --add 'January 2026' --start 2026-01-12
+      ulwazi cohort DE5-2026A --remove
+    """
+    course_code = get_current_course(course)
+
+    if not course_code:
+        click.echo("No current course set. Use 'ulwazi course <DE5|DA4>' first.")
+        return
+
+    store = get_store()
+    from store import DatabaseBusy, is_foreign_key_error
+
+    if code and not re.fullmatch(r'[A-Za-z0-9._-]+', code):
+        click.echo("Error: Cohort codes are letters, digits, '.', '_' and '-' (e.g. DE5-2026A)")
+        return
+    try:
+        start = parse_date(start)
+    except ValueError as e:
+        click.echo(f"Error: {e}")
+        return
+
+    if code and (title or remove):
+        try:
+            with store.transaction() as conn:
+                if remove:
+                    removed = conn.execute('''
+                        DELETE FROM cohorts WHERE code = ? AND standard = ?
+                    ''', (code, course_code)).rowcount
+                    if removed:
+                        click.echo(f"Cohort: Removed {code} (and its learners and evidence)")
+                    else:
+                        click.echo(f"Error: {code} is not a cohort on {course_code}")
+                else:
+                    store.add_cohort(code, course_code, title, start)
+                    click.echo(f"Cohort: Added {code} to {course_code}")
+        except DatabaseBusy as e:
+            click.echo(f"Error: {e}")
+        except store.conn.IntegrityError as e:
+            if is_foreign_key_error(e):
+                click.echo(f"Error: {course_code} is not a standard")
+                click.echo(f"Add it first with: ulwazi standard {course_code} --add 'Title'")
+            else:
+                click.echo(f"Error: {code} already exists")
+        return
+
+    rows = store.conn.execute('''
+        SELECT c.code, c.title, c.start_date,
+            (SELECT COUNT(*) FROM learners l WHERE l.cohort = c.code)
+        FROM cohorts c
+        WHERE c.standard = ? AND c.code = COALESCE(?, c.code)
+        ORDER BY c.start_date, c.code
+    ''', (course_code, code)).fetchall()
+    if not rows:
+        click.echo(f"No cohorts on {course_code}. Add one with: "
+                   f"ulwazi cohort <CODE> --add 'Title' --start YYYY-MM-DD")
+        return
+    click.echo()
+    for cohort_code, cohort_title, start_date, learner_count in rows:
+        click.echo(f"  {cohort_code:<12} {cohort_title or '':<30} {start_date or '':<10}  "
+                   f"{learner_count} learners")
+    click.echo()
+
+
+# Errors listed before giving up on a file
+MAX_ROW_ERRORS = 10
+
+
+def echo_row_errors(filename, errors):
+    """Report the rows that stopped a file from loading"""
+    for error in errors[:MAX_ROW_ERRORS]:
+        click.echo(f"Error: {error}")
+    if len(errors) > MAX_ROW_ERRORS:
+        click.echo(f"... and {len(errors) - MAX_ROW_ERRORS} more")
+    click.echo(f"Nothing was loaded from {filename}")
+
+
+@cli.command()
+@click.argument('filename', type=click.Path(exists=True, dir_okay=False))
+@click.option('--cohort', help='Cohort for rows that don\'t name one')
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']),
+              help='File format (Default: from the file extension)')
+@click.option('--dry-run', is_flag=True, help='Check the file without writing it')
+def learners(filename, cohort, file_format, dry_run):
+    """Load or update learners from a file
+
+    \b
+    csv:   learner,name,cohort columns (header row required)
+    jsonl: {"learner": "A1042", "name": "...", "cohort": "DE5-2026A"} per line
+    """
+    import progress
+
+    file_format = file_format or ('jsonl' if Path(filename).suffix.lower() == '.jsonl' else 'csv')
+    try:
+        rows = progress.read_records(filename, file_format, progress.LEARNER_FIELDS, ('learner',))
+    except (ValueError, KeyError) as e:
+        click.echo(f"Error: Could not parse {filename} ({e})")
+        return
+
+    store = get_store()
+    conn = store.conn
+    from contextlib import nullcontext
+    from store import DatabaseBusy
+
+    try:
+        # A dry run writes nothing, so it reads without taking the write lock
+        with nullcontext() if dry_run else store.transaction():
+            cohorts = store.cohorts()
+            errors = []
+            records = {}
+            for learner, name, cohort_code in rows:
+                cohort_code = cohort_code or cohort
+                if not cohort_code:
+                    errors.append(f"{learner} has no cohort (add a cohort column or use --cohort)")
+                elif cohort_code not in cohorts:
+                    errors.append(f"{learner}: {cohort_code} is not a cohort")
+                else:
+                    records[learner] = (learner, name, cohort_code)
+
+            if errors:
+                echo_row_errors(filename, errors)
+                return
+
+            existing = {learner for learner, in conn.execute('SELECT id FROM learners')}
+            added = sum(1 for learner in records if learner not in existing)
+            if not dry_run:
+                store.add_learners(sorted(records.values()))
+    except DatabaseBusy as e:
+        click.echo(f"Error: {e}")
+        return
+
+    dry = ' (dry run)' if dry_run else ''
+    click.echo(f"Learners{dry}: {added} added, {len(records) - added} updated")
+
+
+@cli.command('evidence')
+@click.argument('filename', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']),
+              help='File format (Default: from the file extension)')
+@click.option('--dry-run', is_flag=True, help='Check the file without writing it')
+def import_evidence(filename, file_format, dry_run):
+    """Load learners' portfolio evidence from a file
+
+    Each row is one piece of evidence for one KSB of the learner's
+    standard; rows already loaded (same learner, KSB and reference) are
+    skipped.
+
+    \b
+    csv:   learner,ksb,reference,date columns (header row required)
+    jsonl: {"learner": "A1042", "ksb": "K3", "reference": "...", "date": "2026-03-02"} per line
+    """
+    import progress
+
+    file_format = file_format or ('jsonl' if Path(filename).suffix.lower() == '.jsonl' else 'csv')
+    try:
+        rows = progress.read_records(filename, file_format, progress.EVIDENCE_FIELDS,
+                                     ('learner', 'ksb'))
+    except (ValueError, KeyError) as e:
+        click.echo(f"Error: Could not parse {filename} ({e})")
+        return
+
+    store = get_store()
+    from contextlib import nullcontext
+    from store import DatabaseBusy
+
+    try:
+        # One transaction for the whole file, checked against what it will write
+        # to; a dry run writes nothing, so it reads without taking the write lock
+        with nullcontext() if dry_run else store.transaction():
+            standards = store.learner_standards()
+            codes = {}
+            errors = []
+            records = set()
+            for learner, code, reference, evidenced_on in rows:
+                code = code.upper()
+                standard_code = standards.get(learner)
+                if standard_code is None:
+                    errors.append(f"{learner} is not a learner (load them with 'ulwazi learners')")
+                    continue
+                if standard_code not in codes:
+                    codes[standard_code] = set(store.categories(standard_code))
+                if code not in codes[standard_code]:
+                    errors.append(f"{learner}: {code} not found in {standard_code}")
+                    continue
+                try:
+                    evidenced_on = parse_date(evidenced_on)
+                except ValueError:
+                    errors.append(f"{learner} {code}: dates look like 2026-03-02, not {evidenced_on}")
+                    continue
+                records.add((learner, standard_code, code, reference or '', evidenced_on))
+
+            if errors:
+                echo_row_errors(filename, errors)
+                return
+
+            # In primary key order, so the inserts walk the index rather than jump around it
+            added = 0 if dry_run else store.add_evidence(sorted(records, key=lambda r: (r[0], r[2], r[3])))
+    except DatabaseBusy as e:
+        click.echo(f"Error: {e}")
+        return
+
+    if dry_run:
+        click.echo(f"Evidence (dry run): {len(records)} pieces from {len(rows)} rows are valid")
+    else:
+        click.echo(f"Evidence: {added} added, {len(records) - added} already loaded")
+
+
+@cli.command()
+@click.option('--course', help='Course code (Uses current course if not specified)')
+@click.option('--cohort', help='Only this cohort')
+@click.option('--learner', help="One learner's evidenced and missing KSBs")
+@click.option('-m', '--through-module', 'through', type=int,
+              help='Expect the KSBs of Discover and modules 1-N (Default: the modules started by today)')
+@click.option('--allow', default=0, help='Missing KSBs a learner can have without being at risk')
+@click.option('-n', '--limit', default=20, help='At-risk learners to list (0 for all)')
+@click.option('-t', '--trim', default=80, help='Trim the description to this length')
+@click.option('--json', 'as_json', is_flag=True, help='Output JSON')
+def progress(course, cohort, learner, through, allow, limit, trim, as_json):
+    """KSB completion per cohort and learner, and the learners at risk
+
+    Counts the KSBs each learner has evidence for out of those expected
+    by now: the KSBs mapped to Discover or to a module that has started
+    (set dates with 'ulwazi standard -m N --start'), or every KSB when no
+    module has a date.
+    """
+    import progress as tracking
+
+    conn = get_db_connection()
+
+    if learner:
+        row = conn.execute('''
+            SELECT l.name, l.cohort, c.standard
+            FROM learners l
+            INNER JOIN cohorts c ON c.code = l.cohort
+            WHERE l.id = ?
+        ''', (learner,)).fetchone()
+        if not row:
+            click.echo(f"Error: {learner} is not a learner")
+            return
+        name, cohort, course_code = row
+    else:
+        course_code = get_current_course(course)
+
+        if not course_code:
+            click.echo("No current course set. Use 'ulwazi course <DE5|DA4>' first.")
+            return
+
+    expected, label = tracking.expected_ksbs(conn, course_code, through)
+    rows = tracking.learner_progress(conn, course_code, expected, cohort, learner)
+
+    # One learner: what they have and what they're missing
+    if learner:
+        evidenced = tracking.evidenced_ksbs(conn, learner, course_code)
+        missing = sorted(expected.difference(evidenced), key=lambda c: (c[:1], natural_sort_key(c)))
+        if as_json:
+            click.echo(json.dumps({
+                'learner': learner, 'name': name, 'cohort': cohort, 'standard': course_code,
+                'expected': label, 'evidenced': rows[0].evidenced, 'missing': missing,
+                'ksbs': {code: {'pieces': pieces, 'latest': latest}
+                         for code, (pieces, latest) in evidenced.items()},
+            }, indent=2))
+            return
+
+        descriptions = get_store().descriptions(course_code)
+        click.echo(f"\nLearner: {learner} {name or ''} ({cohort}, {course_code})")
+        click.echo(f"Evidenced {rows[0].evidenced} of {len(expected)} expected KSBs ({label}), "
+                   f"{len(evidenced)} of {len(descriptions)} overall")
+        if missing:
+            click.echo(f"\nMissing: {len(missing)}")
+            for code in missing:
+                click.echo(f"  {code:<5} {(descriptions[code] or '')[:trim]}")
+        if evidenced:
+            click.echo(f"\nEvidenced: {len(evidenced)}")
+            for code in sorted(evidenced, key=lambda c: (c[:1], natural_sort_key(c))):
+                pieces, latest = evidenced[code]
+                click.echo(f"  {code:<5} {pieces} piece{'s' if pieces != 1 else ''}"
+                           + (f", latest {latest}" if latest else ''))
+        click.echo()
+        return
+
+    if cohort and not rows and cohort not in get_store().cohorts():
+        click.echo(f"Error: {cohort} is not a cohort")
+        return
+
+    summary = tracking.cohort_progress(rows, allow)
+    risky = tracking.at_risk(rows, allow)
+    listed = risky[:limit] if limit else risky
+    evidenced = tracking.evidenced_codes(conn, [r.learner for r in listed], course_code)
+    missing = {r.learner: sorted(expected.difference(evidenced.get(r.learner, ())),
+                                 key=lambda c: (c[:1], natural_sort_key(c)))
+               for r in listed}
+
+    if as_json:
+        click.echo(json.dumps({
+            'standard': course_code, 'expected': label, 'expected_ksbs': len(expected),
+            'cohorts': [c._asdict() for c in summary],
+            'at_risk': [dict(r._asdict(), missing=missing[r.learner]) for r in listed],
+            'at_risk_total': len(risky),
+        }, indent=2))
+        return
+
+    click.echo(f"\nProgress: {course_code} ~ {len(expected)} KSBs expected ({label})")
+    if not rows:
+        click.echo("\nNo learners yet. Load them with: ulwazi learners <FILE>\n")
+        return
+
+    click.echo(f"\n  {'Cohort':<12} {'Learners':>9} {'Complete':>9} {'Average':>9} {'At risk':>9}")
+    for c in summary:
+        click.echo(f"  {c.cohort:<12} {c.learners:>9} {c.complete:>9} {c.average:>9.0%} {c.at_risk:>9}")
+    if len(summary) > 1:
+        complete = sum(c.complete for c in summary)
+        average = sum(c.average * c.learners for c in summary) / len(rows)
+        click.echo(f"  {'All':<12} {len(rows):>9} {complete:>9} {average:>9.0%} {len(risky):>9}")
+
+    click.echo(f"\nAt risk (missing more than {allow} of {len(expected)} expected KSBs): {len(risky)}")
+    for r in listed:
+        codes = missing[r.learner]
+        shown = ' '.join(codes[:6]) + (f" +{len(codes) - 6}" if len(codes) > 6 else '')
+        click.echo(f"  {r.learner:<10} {(r.name or '')[:24]:<24} {r.cohort:<12} "
+                   f"{r.evidenced:>3}/{r.expected:<3}  missing {shown}")
+    if len(listed) < len(risky):
+        click.echo(f"  ... and {len(risky) - len(listed)} more (-n 0 lists them all)")
+    click.echo()
+
+
+class UlwaziShell(cmd.Cmd):
+    """Line-based front end that runs ulwazi commands in one process"""
+
+    intro = "Ulwazi shell - type a command (e.g. 'ksb K1', 'coverage -m 1'), 'help' or 'exit'"
+
+    def __init__(self, interactive):
+        super().__init__()
+        self.use_rawinput = interactive
+        self.interactive = interactive
+        self.update_prompt()
+
+    def update_prompt(self):
+        course_code = get_current_course(None)
+        self.prompt = f"ulwazi {course_code}> " if course_code else "ulwazi> "
+        if not self.interactive:
+            self.prompt = ''
+
+    def emptyline(self):
+        pass
+
+    def default(self, line):
+        if line.strip() == 'EOF':
+            return self.do_exit(line)
+
+        try:
+            args = shlex.split(line)
+        except ValueError as e:
+            click.echo(f"Error: {e}")
+            return
+
+        if args and args[0] == 'shell':
+            click.echo("Error: Already in the shell")
+            return
+
+        try:
+            cli.main(args, prog_name='ulwazi', standalone_mode=False)
+        except click.exceptions.Abort:
+            click.echo("Aborted!")
+        except click.ClickException as e:
+            e.show()
+        except SystemExit:
+            pass
+
+    def do_help(self, arg):
+        self.default(f"{arg} --help" if arg else '--help')
+
+    def do_exit(self, arg):
+        """Leave the shell"""
+        if self.interactive:
+            click.echo()
+        return True
+
+    do_quit = do_exit
+
+    def postcmd(self, stop, line):
+        self.update_prompt()
+        return stop
+
+    def completenames(self, text, *ignored):
+        names = list(cli.commands) + ['help', 'exit']
+        return [name for name in names if name.startswith(text) and name != 'shell']
+
+    def completedefault(self, text, line, begidx, endidx):
+        """Complete KSB codes for the current (or --course) course"""
+        if text.startswith('-'):
+            return []
+
+        args = line.split()
+        course_code = None
+        if '--course' in args[:-1]:
+            course_code = args[args.index('--course') + 1].upper()
+        course_code = course_code or get_current_course(None)
+        if not course_code:
+            return []
+
+        conn = get_db_connection()
+        codes = [row[0] for row in conn.execute('''
+            SELECT code FROM ksbs
+            WHERE standard = ? AND code LIKE ?
+        ''', (course_code, text.upper() + '%'))]
+        return sorted(codes, key=lambda c: (c[:1], natural_sort_key(c)))
+
+
+@cli.command()
+@click.argument('code', required=False)
+@click.option('--course', help='Course code (Uses current course if not specified)')
+@click.option('--as-of', 'as_of', help='Print the whole mapping as it was then, as a manifest')
+@click.option('--ksbs', 'with_ksbs', is_flag=True, help='With --as-of: print the KSBs (import format) instead')
+@click.option('-n', '--limit', default=50, help='Most recent changes to show')
+@click.option('-t', '--trim', default=80, help='Trim descriptions and notes to this length')
+def history(code, course, as_of, with_ksbs, limit, trim):
+    """Show the recorded changes to a KSB, or the mapping as of a time
+
+    Times are local, e.g. 2026-01-31 or 2026-01-31T14:30. The --as-of
+    manifest can be loaded back with 'ulwazi map --from-file'.
+    """
+    import history as journal
+
+    course_code = get_current_course(course)
+
+    if not course_code:
+        click.echo("No current course set. Use 'ulwazi course <DE5|DA4>' first.")
+        return
+
+    if as_of:
+        past = past_state(course_code, as_of)
+        if past is None:
+            return
+        order = lambda code: (code[:1], natural_sort_key(code))
+        click.echo(f"# {course_code} as of {as_of}")
+
+        if with_ksbs:
+            for code in sorted(past.ksbs, key=order):
+                click.echo(f"{code}: {past.ksbs[code][1] or ''}")
+            return
+
+        by_location = defaultdict(list)
+        for code, phase, module in past.modules:
+            by_location[(phase, module or 0, 0, 0)].append(code)
+        for code, module, day, session in past.sessions:
+            by_location[('Module', module, day, session)].append(code)
+        for phase, module, day, session in sorted(by_location):
+            where = journal.location(phase, module, day or None, session or None)
+            codes = sorted(by_location[(phase, module, day, session)], key=order)
+            click.echo(f"{where}: {' '.join(codes)}")
+        return
+
+    if not code:
+        click.echo("Error: Specify a KSB code or --as-of <time>")
+        return
+
+    code = code.upper()
+    rows = journal.entries(get_db_connection(), course_code, code, limit)
+    if not rows:
+        click.echo(f"History: No changes recorded for {code} in {course_code}")
+        return
+
+    click.echo(f"\nHistory: {course_code} {code}\n")
+    for at, *entry in rows:
+        click.echo(f"  {journal.local_time(at)}  {journal.describe(*entry, trim)}")
+    click.echo()
+
+
+@cli.command()
+@click.option('--course', help='Course code (Uses current course if not specified)')
+@click.option('--since', required=True, help='Compare from this time (e.g. 2026-01-31)')
+@click.option('--until', help='Compare up to this time (Default: now)')
+def diff(course, since, until):
+    """Show what changed in a course's KSBs and mappings between two times"""
+    import history as journal
+
+    course_code = get_current_course(course)
+
+    if not course_code:
+        click.echo("No current course set. Use 'ulwazi course <DE5|DA4>' first.")
+        return
+
+    try:
+        start = journal.journal_time(since)
+        end = journal.journal_time(until) if until else None
+    except ValueError:
+        click.echo("Error: Times look like 2026-01-31 or 2026-01-31T14:30")
+        return
+
+    conn = get_db_connection()
+    start_id = journal.change_id_at(conn, start)
+    before, _ = journal.state_at(conn, course_code, start_id)
+    if end:
+        end_id = journal.change_id_at(conn, end)
+        after, _ = journal.state_at(conn, course_code, end_id)
+    else:
+        end_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM changes').fetchone()[0]
+        after = journal.current_state(conn, course_code)
+
+    entries = conn.execute('''
+        SELECT COUNT(*) FROM changes
+        WHERE standard = ? AND id > ? AND id <= ?
+    ''', (course_code, start_id, end_id)).fetchone()[0]
+
+    changes = journal.diff(before, after)
+    span = f"{since} and {until}" if until else f"{since} and now"
+    click.echo(f"\nChanges to {course_code} between {span} ({entries} journal entries)\n")
+    if not changes:
+        click.echo("  No differences\n")
+        return
+
+    signs = {'-': 0, '~': 1, '+': 2}
+    for code, sign, what in sorted(changes, key=lambda c: (c[0][:1], natural_sort_key(c[0]),
+                                                           c[2] != 'KSB', c[2], signs[c[1]])):
+        click.echo(f"  {sign} {code:<4} {what}")
+
+    counts = Counter(sign for _, sign, _ in changes)
+    click.echo(f"\nDiff: {counts['+']} added, {counts['-']} removed, {counts['~']} changed\n")
+
+
+def plan_modules(store, course_code, modules, capacity, pins, prerequisites, replace, seed):
+    """Plan each module and print the preview; returns (added, removed, worse)
+
+    added and removed are (code, module, day, session) rows; worse counts
+    constraints the plan breaks that the current timetable doesn't.
+    Prints an error and returns None if a pin doesn't fit the timetable.
+    """
+    from planner import ModulePlanner, plan_module
+
+    categories = store.categories(course_code)
+    mapped = store.module_pairs(course_code)
+
+    # Category, then number: the order every listing uses
+    def order(code):
+        return ksb_sort_key(categories.get(code), code)
+
+    # Each module's sessions, as the planner's slot indexes
+    grids = {}
+    for module in sorted({module for _, module in mapped}):
+        grid = store.session_grid(course_code, module)
+        grids[module] = {slot: index for index, slot in enumerate(grid)}
+
+    for code, module, day, session in pins:
+        if (day, session) not in grids.get(module, {}):
+            click.echo(f"Error: M{module}/D{day}/S{session} is not a session of {course_code}")
+            return None
+        if (code, module) not in mapped:
+            click.echo(f"Error: {code} not mapped to M{module} (pinned to M{module}/D{day}/S{session})")
+            return None
+
+    if not modules:
+        modules = sorted(grids)
+
+    existing = defaultdict(lambda: defaultdict(list))
+    for code, module, day, session in store.session_slots(course_code):
+        if module in grids:
+            existing[module][code].append(grids[module][(day, session)])
+
+    added, removed = [], []
+    worse = 0
+    click.echo(f"\nPlan for {course_code} (max {capacity} KSBs per session)")
+
+    for module in modules:
+        codes = [code for code, m in mapped if m == module]
+        slots = list(grids.get(module, {}))
+        if codes and not slots:
+            click.echo(f"\nM{module}: No sessions in the {course_code} timetable (see 'ulwazi standard')")
+            continue
+        pinned = defaultdict(list)
+        for code, m, day, session in pins:
+            if m == module:
+                pinned[code].append(grids[module][(day, session)])
+
+        # The timetable as it is (with the pins), which the plan mustn't score worse than
+        current = {code: sorted(set(existing[module].get(code, []) + pinned.get(code, [])))
+                   for code in set(existing[module]) | set(pinned)}
+        fixed = dict(pinned) if replace else current
+        items = [code for code in codes if code not in fixed]
+        behaviours = {code for code in codes if categories.get(code) == 'Behaviour'}
+
+        before = ModulePlanner(current, [], behaviours, prerequisites, capacity, slots).violations()
+        placed, planner = plan_module(fixed, items, behaviours, prerequisites, capacity, slots,
+                                      order, seed=seed)
+        after = planner.violations()
+        worse += max(after[0] - before[0], 0) + max(after[1] - before[1], 0)
+
+        new_rows = {(code, *placed[code]) for code in items}
+        new_rows |= {(code, *slots[s]) for code, indexes in pinned.items() for s in indexes}
+        old_rows = {(code, *slots[s]) for code, indexes in existing[module].items() for s in indexes}
+        if not replace:
+            new_rows |= old_rows
+
+        module_added = sorted(new_rows - old_rows, key=lambda r: (r[1], r[2], order(r[0])))
+        module_removed = sorted(old_rows - new_rows, key=lambda r: (r[1], r[2], order(r[0])))
+        added += [(code, module, day, session) for code, day, session in module_added]
+        removed += [(code, module, day, session) for code, day, session in module_removed]
+
+        click.echo(f"\nM{module}: {len(items)} to place, {len(fixed)} fixed")
+        for sign, rows in (('-', module_removed), ('+', module_added)):
+            for code, day, session in rows:
+                click.echo(f"  {sign} {code:<4} M{module}/D{day}/S{session}")
+        used = [load for load in planner.load if load]
+        if used:
+            click.echo(f"  Sessions used: {len(used)} of {len(slots)}, {min(used)}-{max(used)} KSBs each")
+        over, order_breaks, together = after
+        if over or order_breaks or together:
+            click.echo(f"  Warning: {over} over capacity, {order_breaks} out of order, "
+                       f"{together} Behaviour pairs on the same day")
+
+    click.echo(f"\nPlan: {len(added)} added, {len(removed)} removed")
+    return added, removed, worse
+
+
+@cli.command()
+@click.option('--course', help='Course code (Uses current course if not specified)')
+@click.option('-m', '--module', 'modules', type=int, multiple=True,
+              help='Module to plan (repeatable; Default: every mapped module)')
+@click.option('--max', 'capacity', default=6, help='Most KSBs in one session')
+@click.option('--constraints', type=click.File('r'), help='File of pins and prerequisites')
+@click.option('--replace', is_flag=True, help='Re-plan KSBs already in sessions (pins are kept)')
+@click.option('--apply', 'apply_plan', is_flag=True, help='Write the plan (Default: preview only)')
+@click.option('--seed', default=0, help='Random seed for the local search')
+def plan(course, modules, capacity, constraints, replace, apply_plan, seed):
+    """Assign mapped KSBs to sessions (preview, or --apply to write)
+
+    Every KSB mapped to a module gets a day and session in it, keeping
+    sessions balanced and under --max, Behaviours on different days and
+    prerequisites first. The constraints file has one rule per line:
+
+    \b
+      M1/D2/S3: K1 K2     pin K1 and K2 to that session
+      K3 < K4 S1          teach K3 before K4 and S1
+    """
+    course_code = get_current_course(course)
+
+    if not course_code:
+        click.echo("No current course set. Use 'ulwazi course <DE5|DA4>' first.")
+        return
+
+    if capacity < 1:
+        click.echo("Error: --max must be at least 1")
+        return
+
+    pins, prerequisites = [], []
+    if constraints:
+        try:
+            pins, prerequisites = parse_plan_constraints(constraints)
+        except ValueError as e:
+            click.echo(f"Error: {constraints.name} {e}")
+            return
+
+    store = get_store()
+    if not apply_plan:
+        planned = plan_modules(store, course_code, modules, capacity, pins, prerequisites, replace, seed)
+        if planned and (planned[0] or planned[1]):
+            click.echo("Preview only. Run again with --apply to write it.")
+        return
+
+    from store import DatabaseBusy, is_foreign_key_error
+
+    try:
+        # Planned under the write lock, so the plan is made from the timetable it replaces
+        with store.transaction():
+            planned = plan_modules(store, course_code, modules, capacity, pins, prerequisites,
+                                   replace, seed)
+            if planned is None:
+                return
+            added, removed, worse = planned
+
+            if worse:
+                click.echo(f"Error: The plan breaks {worse} more constraints than the current timetable. "
+                           "Raise --max or relax the constraints.")
+                return
+
+            removed_count = store.remove_session_mappings([(course_code, *row) for row in removed])
+            added_count = store.add_session_mappings([(course_code, *row, '') for row in added])
+    except DatabaseBusy as e:
+        click.echo(f"Error: {e}")
+        return
+    except store.conn.IntegrityError as e:
+        if not is_foreign_key_error(e):
+            raise
+        # A module mapping or session the plan uses is gone; nothing was written
+        click.echo(f"Error: The plan uses modules or sessions {course_code} doesn't have")
+        click.echo(f"See the timetable with: ulwazi standard {course_code}")
+        return
+
+    click.echo(f"{course_code}: Applied {added_count} added, {removed_count} removed")
+
+
+@cli.command()
+@click.option('--disk/--no-disk', default=None, help='Keep the cache on disk between runs')
+@click.option('--clear', is_flag=True, help='Empty the cache and reset its statistics')
+def cache(disk, clear):
+    """Show query cache statistics, or configure the cache"""
+    cache_path = CONFIG_DIR / CACHE_FILE
+
+    if disk is not None:
+        config = load_config()
+        config['disk_cache'] = disk
+        save_config(config)
+        if not disk:
+            cache_path.unlink(missing_ok=True)
+        if store_state['store'] is not None:
+            store_state['store'].cache.path = cache_path if disk else None
+        click.echo(f"Disk cache {'on' if disk else 'off'}: {cache_path}")
+        return
+
+    result_cache = get_store().cache
+
+    if clear:
+        result_cache.clear()
+        click.echo("Cache cleared")
+        return
+
+    stats = result_cache.stats()
+    lookups = stats['hits'] + stats['misses']
+    location = f"on disk at {result_cache.path}" if result_cache.path else "in memory only"
+    click.echo(f"Cache: {stats['entries']}/{stats['size']} entries, {location}")
+    click.echo(f"Hits: {stats['hits']}  Misses: {stats['misses']}"
+               + (f"  ({stats['hits'] / lookups:.0%} hit rate)" if lookups else ''))
+
+
+@cli.command('snapshot')
+@click.option('--course', help='Course code (Uses current course if not specified)')
+@click.option('--all', 'all_standards', is_flag=True, help='Snapshot every standard')
+@click.option('--remove', is_flag=True, help='Delete the snapshot (show and coverage use SQLite)')
+def write_snapshot(course, all_standards, remove):
+    """Write a binary snapshot that show and coverage load instead of SQLite
+
+    The snapshot is ignored as soon as anything in the database changes;
+    run this again afterwards to bring it back into use.
+    """
+    if all_standards:
+        codes = [code for code, in get_db_connection().execute(
+            'SELECT code FROM standards ORDER BY code')]
+    else:
+        course_code = get_current_course(course)
+        if not course_code:
+            click.echo("No current course set. Use 'ulwazi course <DE5|DA4>' first.")
+            return
+        codes = [course_code]
+
+    if remove:
+        for code in codes:
+            path = snapshot_path(code)
+            if path.exists():
+                path.unlink()
+                click.echo(f"Snapshot: Removed {path}")
+            else:
+                click.echo(f"Snapshot: None for {code}")
+        return
+
+    import snapshot
+
+    store = get_store()
+    for code in codes:
+        if not store.standard_exists(code):
+            click.echo(f"Error: {code} is not a standard")
+            continue
+        path = snapshot_path(code)
+        try:
+            size = snapshot.save(store.conn, code, path)
+        except OSError as e:
+            click.echo(f"Error: Could not write {path}: {e}")
+            return
+        click.echo(f"Snapshot: {code} ~ {size / 1024:.1f}KB written to {path}")
+
+
+@cli.command()
+@click.option('--log', 'log_path', type=click.Path(dir_okay=False),
+              help='Timings log to read (Default: ~/.ulwazi/timings.jsonl)')
+@click.option('--command', 'command_name', help='Only this command')
+@click.option('--clear', is_flag=True, help='Delete the timings log')
+def stats(log_path, command_name, clear):
+    """Summarise logged --timings runs: p50/p95 per command"""
+    path = Path(log_path) if log_path else CONFIG_DIR / TIMINGS_LOG
+
+    if clear:
+        path.unlink(missing_ok=True)
+        click.echo(f"Cleared {path}")
+        return
+
+    if not path.exists():
+        click.echo(f"No timings logged yet. Run a command with --timings or ULWAZI_TRACE=log first.")
+        return
+
+    records = timings.read_log(path)
+    if command_name:
+        records = [r for r in records if r.get('command') == command_name]
+    if not records:
+        click.echo(f"Stats: No runs logged{' for ' + command_name if command_name else ''}")
+        return
+
+    click.echo(f"\n{'Command':<12} {'Runs':>5} {'p50 ms':>9} {'p95 ms':>9}  Slowest phases (p50 ms)")
+    for command, summary in timings.summarise(records).items():
+        slowest = sorted(summary['phases'].items(), key=lambda item: -item[1])[:3]
+        click.echo(f"{command:<12} {summary['runs']:>5} {summary['p50']:>9.2f} {summary['p95']:>9.2f}  "
+                   + ', '.join(f"{name} {ms:.2f}" for name, ms in slowest))
+    click.echo()
+
+
+@cli.command()
+@click.option('--host', default='127.0.0.1', help='Address to listen on')
+@click.option('-p', '--port', default=8080, help='Port to listen on')
+@click.option('--readers', default=4, help='Read-only connections in the pool')
+def serve(host, port, readers):
+    """Serve ksb, show, coverage, map and session as a JSON API"""
+    # Checks the database and schema, and puts it in WAL mode
+    get_store()
+
+    import asyncio
+    from server import ApiServer
+
+    api = ApiServer(DB_FILE, readers)
+    click.echo(f"Serving {DB_FILE} on http://{host}:{port} (Ctrl+C to stop)")
+    try:
+        asyncio.run(api.serve(host, port))
+    except KeyboardInterrupt:
+        click.echo()
+    except OSError as e:
+        click.echo(f"Error: {e}")
+    finally:
+        api.close()
+
+
+# Commands 'ulwazi watch' can follow, and the argument between several of them
+WATCH_VIEWS = ('show', 'coverage')
+WATCH_SEPARATOR = '+'
+
+
+def split_views(args):
+    """[[command, arg, ...], ...] from e.g. coverage -m 1 -d 1 + show --ksb k"""
+    views = [[]]
+    for arg in args:
+        if arg == WATCH_SEPARATOR:
+            views.append([])
+        else:
+            views[-1].append(arg)
+    return views
+
+
+def view_lines(views):
+    """The lines the views print, run in this process on its one store"""
+    import contextlib
+    import io
+
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        for name, *args in views:
+            cli.commands[name].main(args, prog_name=f'ulwazi {name}', standalone_mode=False)
+    return out.getvalue().splitlines()
+
+
+@cli.command(context_settings={'ignore_unknown_options': True, 'allow_interspersed_args': False})
+@click.option('-i', '--interval', type=float, default=1.0, help='Seconds between checks for changes')
+@click.argument('views', nargs=-1, type=click.UNPROCESSED)
+def watch(interval, views):
+    """Keep show or coverage on screen, redrawn as the database changes
+
+    VIEWS is a show or coverage command line (e.g. coverage -m 2 -d 1);
+    put + between several to follow them all, e.g. show + coverage -m 1.
+    """
+    views = split_views(views)
+    if not all(view and view[0] in WATCH_VIEWS for view in views):
+        click.echo("Error: Watch show or coverage, e.g. ulwazi watch coverage -m 1 -d 2")
+        return
+
+    if interval <= 0:
+        click.echo("Error: --interval must be more than 0")
+        return
+
+    from watch import Screen
+
+    store = get_store()
+    screen = Screen()
+    generation = None
+    try:
+        while True:
+            # One PRAGMA data_version while nothing changes; the views
+            # only run again once the write generation has moved
+            current = store.cache.current_generation()
+            if current != generation:
+                try:
+                    lines = view_lines(views)
+                except click.ClickException as e:
+                    screen.close()
+                    e.show()
+                    return
+                generation = current
+                status = f"Updated {time.strftime('%H:%M:%S')} - Ctrl-C to stop"
+            # Writes nothing unless the lines (or the terminal size) changed
+            screen.draw(lines, status)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        screen.close()
+
+
+@cli.command()
+def shell():
+    """Run commands in one session (reads a script from stdin if piped)"""
+    shell_state['active'] = True
+    interactive = sys.stdin.isatty()
+
+    try:
+        UlwaziShell(interactive).cmdloop(None if interactive else '')
+    except KeyboardInterrupt:
+        click.echo()
+    finally:
+        shell_state.update(active=False, config=None)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Ulwazi Watch
+The terminal side of 'ulwazi watch': keeps the output of one or more
+views on screen and, when it changes, redraws only the lines that
+differ rather than clearing and reprinting it all. A mapping added or
+removed inserts or deletes its line, so the rest of the screen scrolls
+instead of being rewritten (ANSI insert and delete line).
+
+Lines are clipped to the terminal so none wraps, which keeps screen row
+N showing line N; a resize redraws everything. When stdout isn't a
+terminal each changed output is printed in full instead.
+"""
+
+import shutil
+import sys
+from difflib import SequenceMatcher
+
+HIDE_CURSOR = '\x1b[?25l'
+SHOW_CURSOR = '\x1b[?25h'
+CLEAR_SCREEN = '\x1b[H\x1b[2J'
+CLEAR_LINE = '\x1b[K'
+
+
+def move_to(row):
+    return f'\x1b[{row};1H'
+
+
+def insert_lines(count):
+    return f'\x1b[{count}L'
+
+
+def delete_lines(count):
+    return f'\x1b[{count}M'
+
+
+def line_edits(previous, shown, height):
+    """Escape sequences turning the screen from previous to shown, or None
+
+    None when an insert would push a line still needed off the bottom of
+    the terminal, where it can't be scrolled back.
+    """
+    writes = []
+    length = len(previous)
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, previous, shown, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            continue
+        # Earlier edits have already moved old line i1 to row j1 + 1
+        old, new = i2 - i1, j2 - j1
+        if new > old:
+            length += new - old
+            if length > height:
+                return None
+            writes.append(move_to(j1 + old + 1) + insert_lines(new - old))
+        elif old > new:
+            length -= old - new
+            writes.append(move_to(j1 + new + 1) + delete_lines(old - new))
+        writes += [f'{move_to(row)}{line}{CLEAR_LINE}' for row, line in enumerate(shown[j1:j2], j1 + 1)]
+    return writes
+
+
+class Screen:
+    """What is on the terminal now, so a redraw only writes the lines that changed"""
+
+    def __init__(self, out=None):
+        self.out = out or sys.stdout
+        self.live = self.out.isatty()
+        self.lines = None
+        self.size = None
+
+    def draw(self, lines, status):
+        """Show lines with a status line below them; returns how many lines were written
+
+        Cheap to call when nothing has changed: it writes nothing.
+        """
+        if not self.live:
+            if lines == self.lines:
+                return 0
+            self.out.write('\n'.join(lines + [f'-- {status}', '']))
+            self.out.flush()
+            self.lines = lines
+            return len(lines)
+
+        width, height = shutil.get_terminal_size()
+        # The last column is left free so a full line never wraps
+        shown = [line[:width - 1] for line in lines[:height - 1]]
+        if len(lines) > len(shown):
+            shown[-1] = f'... {len(lines) - len(shown) + 1} more lines'[:width - 1]
+        shown.append(status[:width - 1])
+
+        writes = None
+        if self.lines is not None and (width, height) == self.size:
+            writes = line_edits(self.lines, shown, height)
+        if writes is None:
+            writes = [HIDE_CURSOR + CLEAR_SCREEN] + [
+                f'{move_to(row)}{line}' for row, line in enumerate(shown, 1)]
+
+        self.out.write(''.join(writes))
+        self.out.flush()
+        self.lines, self.size = shown, (width, height)
+        return len(writes)
+
+    def close(self):
+        """Leave the cursor below the last line drawn"""
+        if self.live and self.lines is not None:
+            self.out.write(move_to(len(self.lines) + 1) + SHOW_CURSOR)
+            self.out.flush()